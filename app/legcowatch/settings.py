@@ -146,6 +146,25 @@ LOGGING = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered pages of the raw documents, see raw.views.CachedPageMixin.  Use a file based or memcached
+    # backend to share them between processes, and so that the web processes see the member generation
+    # that the member processor bumps.  The keys change whenever a page is out of date,
+    # so the timeout only clears out pages that are no longer viewed
+    'raw_pages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'raw_pages',
+        'TIMEOUT': 60 * 60 * 24 * 7,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+# Splits the text of the search index and the queries into tokens, see raw.tokenizers
+SEARCH_TOKENIZER = 'raw.tokenizers.BigramTokenizer'
+
 CELERY_RESULT_BACKEND = 'djcelery.backends.database:DatabaseBackend'
 
 SCRAPY_FILES_PATH = './legco-data/files'
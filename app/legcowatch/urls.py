@@ -2,6 +2,7 @@ from django.conf.urls import patterns, include, url
 
 from django.contrib import admin
 from django.views.generic import TemplateView
+import raw.api
 import raw.views
 import common.views
 
@@ -48,9 +49,16 @@ urlpatterns = patterns('',
     
     #PARSED
     url(r'^parsed/?$', raw.views.ParsedModelListView.as_view(), name='parsed_model_list'),
+    url(r'^parsed/export/(?P<name>[a-z\-]+)\.(?P<fmt>csv|jsonl)$', raw.views.ParsedExportView.as_view(), name='parsed_export'),
     url(r'^parsed/(?P<model>[a-zA-Z]+)/?$', raw.views.ParsedModelInstanceList.as_view(), name='parsed_model_instances'),
     url(r'^parsed/(?P<model>[a-zA-Z]+)/(?P<uid>[a-zA-Z0-9\-_\.]+)/?$', raw.views.ParsedModelDetailView.as_view(), name='parsed_model_detail'),
     
+    #SEARCH
+    url(r'^search/?$', raw.views.SearchView.as_view(), name='search'),
+    
+    #API
+    url(r'^api/', include(raw.api.router.urls)),
+    
     #OTHERS
     url(r'^admin/', include(admin.site.urls)),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework'))
@@ -6,7 +6,7 @@ from raw.models import ScrapeJob, \
     RawCouncilQuestion, \
     RawCouncilHansard
 from raw.models import ParsedPerson, ParsedMembership, ParsedCommittee, ParsedCommitteeMembership, \
-    ParsedCouncilMeeting, ParsedQuestion
+    ParsedCouncilMeeting, ParsedQuestion, ParsedSpeech
     
 from raw.models.parsed import Override
 
@@ -28,5 +28,6 @@ admin.site.register(ParsedCommittee)
 admin.site.register(ParsedCommitteeMembership)
 admin.site.register(ParsedCouncilMeeting)
 admin.site.register(ParsedQuestion)
+admin.site.register(ParsedSpeech)
 
 admin.site.register(Override)
@@ -0,0 +1,121 @@
+"""
+Read-only API over the parsed models, at /api/
+
+Each model is listed in pages of a cursor over its id, so a page costs the same however far into the
+list it is, and related objects are joined in the same query, so a page costs the same number of
+queries however big it is.  Overrides are applied to every object, and deactivated objects are left out.
+
+Rendered JSON responses are cached, keyed by the parsed generation (see raw.models.ParsedGeneration),
+which changes whenever the parsed objects are populated or an override is saved.  The generation is read
+from the database on each request, so a cache local to each process never serves a response from before
+a change made by another process.  Configure a shared backend to share the responses between workers.
+Responses have an ETag, and clients that send it back in If-None-Match get a 304 until the data changes.
+"""
+import hashlib
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework import routers, viewsets
+from rest_framework.pagination import CursorPagination
+from raw.models import Override, parsed_generation
+from raw import serializers
+
+
+class ParsedCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 50
+
+
+class CachedResponseMixin(object):
+    """
+    Serves GET requests from the cache, and answers If-None-Match with a 304 when the ETag matches
+    """
+    cache_timeout = 60 * 60 * 24
+    cache_format = 'json'
+
+    def get_response_cache_key(self, request):
+        # The Accept header picks the renderer
+        parts = [parsed_generation(), request.get_full_path(), request.META.get('HTTP_ACCEPT', u'')]
+        key = u'raw-api:' + u':'.join([unicode(xx) for xx in parts])
+        # Keep the key within memcached's limits, whatever the path
+        return u'raw-api:' + hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET':
+            return super(CachedResponseMixin, self).dispatch(request, *args, **kwargs)
+        key = self.get_response_cache_key(request)
+        cached = cache.get(key)
+        if cached is None:
+            response = super(CachedResponseMixin, self).dispatch(request, *args, **kwargs)
+            renderer = getattr(response, 'accepted_renderer', None)
+            if response.status_code != 200 or renderer is None or renderer.format != self.cache_format:
+                return response
+            response.render()
+            cached = (response.content, response['Content-Type'], hashlib.md5(response.content).hexdigest())
+            cache.set(key, cached, self.cache_timeout)
+        content, content_type, etag = cached
+        etag = u'"{}"'.format(etag)
+        if etag in [xx.strip() for xx in request.META.get('HTTP_IF_NONE_MATCH', u'').split(u',')]:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['Vary'] = 'Accept'
+        return response
+
+
+class ParsedModelViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Lists and retrieves the active objects of a parsed model by uid, with their overrides applied
+    """
+    lookup_field = 'uid'
+    lookup_value_regex = r'[a-zA-Z0-9\-_\.]+'
+    pagination_class = ParsedCursorPagination
+    # Related objects that are serialized along with each object
+    related = ()
+
+    def get_queryset(self):
+        queryset = self.serializer_class.Meta.model.objects.active()
+        if self.related:
+            queryset = queryset.select_related(*self.related)
+        return queryset
+
+    def paginate_queryset(self, queryset):
+        page = super(ParsedModelViewSet, self).paginate_queryset(queryset)
+        if page is not None:
+            page = Override.objects.apply(page, self.serializer_class.Meta.model)
+        return page
+
+    def get_object(self):
+        obj = super(ParsedModelViewSet, self).get_object()
+        Override.objects.apply([obj])
+        return obj
+
+
+class ParsedPersonViewSet(ParsedModelViewSet):
+    serializer_class = serializers.ParsedPersonSerializer
+
+
+class ParsedCommitteeViewSet(ParsedModelViewSet):
+    serializer_class = serializers.ParsedCommitteeSerializer
+
+
+class ParsedCommitteeMembershipViewSet(ParsedModelViewSet):
+    serializer_class = serializers.ParsedCommitteeMembershipSerializer
+    related = ('committee', 'person')
+
+
+class ParsedCouncilMeetingViewSet(ParsedModelViewSet):
+    serializer_class = serializers.ParsedCouncilMeetingSerializer
+
+
+class ParsedQuestionViewSet(ParsedModelViewSet):
+    serializer_class = serializers.ParsedQuestionSerializer
+    related = ('meeting', 'asker')
+
+
+router = routers.DefaultRouter()
+router.register(r'people', ParsedPersonViewSet, base_name='api-person')
+router.register(r'committees', ParsedCommitteeViewSet, base_name='api-committee')
+router.register(r'committee-memberships', ParsedCommitteeMembershipViewSet, base_name='api-committee-membership')
+router.register(r'meetings', ParsedCouncilMeetingViewSet, base_name='api-meeting')
+router.register(r'questions', ParsedQuestionViewSet, base_name='api-question')
@@ -18,6 +18,9 @@ from raw.utils import to_string, to_unicode, grouper
 
 
 logger = logging.getLogger('legcowatch-docs')
+# See raw.views.CachedPageMixin.parser_version
+PARSER_VERSION = 1
+
 SECOND_READING_PATTERN_C = u'二讀'
 
 BILL_AMENDMENT_PATTERN_C = u'全體委員會審議階段修正案'
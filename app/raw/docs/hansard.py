@@ -26,6 +26,9 @@ from lxml.etree import tostring
 
 logger = logging.getLogger('legcowatch-docs')
 logger.setLevel(logging.INFO)
+# See raw.views.CachedPageMixin.parser_version
+PARSER_VERSION = 1
+
 # Global header patterns. All are <strong> and upper case. Some
 
 # these sub-sections should be in the main_heading section
@@ -1884,8 +1887,43 @@ class CouncilHansard(object):
         #print list_of_speeches[0][1]
         
         return list_of_speeches
-        
-    
+
+    def get_speeches(self):
+        """
+        Returns the speeches of every parsed section in the order they were made, as a list of
+        3-tuple [(section title, speaker, speech), ...], leaving out the events (speaker is None).
+        The section title is the question, bill or motion the speech is about, or the section header
+        """
+        sections = []
+        if self.language == LANG_EN:
+            headers = {'before_meeting': u'BEFORE MEETING', 'ce_q_and_a': CE_Q_AND_A_e, 'suspension': ADJOURNMENT_e}
+        else:
+            headers = {'before_meeting': u'會議前', 'ce_q_and_a': CE_Q_AND_A_c, 'suspension': ADJOURNMENT_c}
+        sections.append((headers['before_meeting'], self.before_meeting))
+        for questions in [self.urgent_questions, self.oral_questions, self.written_questions]:
+            # (number, title, dialogs)
+            for question in questions or []:
+                sections.append((question[1], question[2]))
+        for bill in self.bills or []:
+            # (stage, title, dialogs)
+            sections.append((bill[1], bill[2]))
+        for motion in self.motions or []:
+            # (title, dialogs)
+            sections.append((motion[0], motion[1]))
+        sections.append((headers['ce_q_and_a'], self.ce_q_and_a))
+        sections.append((headers['suspension'], self.suspension))
+
+        speeches = []
+        for title, dialogs in sections:
+            # Dialogs that could not be parsed are an error string
+            if not isinstance(dialogs, list):
+                continue
+            for speaker, speech in dialogs:
+                if speaker is not None:
+                    speeches.append((title or u'', speaker, speech))
+        return speeches
+
+
     
     def _get_member_list(self,elem_list):
         """
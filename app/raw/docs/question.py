@@ -18,6 +18,8 @@ from urllib2 import HTTPError
 from ..scraper.settings import USER_AGENT
 
 logger = logging.getLogger('legcowatch-docs')
+# See raw.views.CachedPageMixin.parser_version
+PARSER_VERSION = 1
 
 class CouncilQuestion(object):
     """
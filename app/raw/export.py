@@ -0,0 +1,121 @@
+"""
+Exports of the parsed models as CSV or JSON lines, for the export_parsed command and raw.views.ParsedExportView
+
+Rows are read in batches of a keyset over the id, and each batch with iterator(), so only one batch
+is ever in memory however big the table is.  Django doesn't use server side cursors, so a single
+iterator() over the whole table would still have the database driver fetch every row at once.
+
+Every active object is exported with its overrides applied, and objects it refers to by their uid.
+With since, only the objects whose raw objects were parsed after since are exported.
+"""
+from collections import OrderedDict
+import csv
+from datetime import date, datetime
+import json
+from raw.models import (Override, ParsedCommittee, ParsedCommitteeMembership, ParsedCouncilMeeting, ParsedMembership,
+                        ParsedPerson, ParsedQuestion)
+
+
+# Same names as the API
+EXPORT_MODELS = OrderedDict([
+    ('people', ParsedPerson),
+    ('memberships', ParsedMembership),
+    ('committees', ParsedCommittee),
+    ('committee-memberships', ParsedCommitteeMembership),
+    ('meetings', ParsedCouncilMeeting),
+    ('questions', ParsedQuestion),
+])
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+BATCH_SIZE = 1000
+
+
+def export_fields(model):
+    """
+    Returns the names of the exported fields of a model, leaving out the internal ones
+    """
+    return [xx.name for xx in model._meta.concrete_fields if xx.name not in ('id', 'deactivate', 'source_last_parsed')]
+
+
+def export_queryset(model, since=None):
+    qs = model.objects.active()
+    if since is not None:
+        qs = qs.filter(source_last_parsed__gt=since)
+    related = [xx.name for xx in model._meta.concrete_fields if xx.rel is not None]
+    if related:
+        qs = qs.select_related(*related)
+    return qs
+
+
+def iter_objects(qs, batch_size=BATCH_SIZE):
+    """
+    Yields the objects of a queryset in id order, with their overrides applied, one batch at a time
+    """
+    payloads = Override.objects.get_payloads(qs.model)
+    last_pk = None
+    while True:
+        batch = qs.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        objs = Override.objects.apply(batch[:batch_size].iterator(), qs.model, payloads)
+        if len(objs) == 0:
+            return
+        for obj in objs:
+            yield obj
+        if len(objs) < batch_size:
+            return
+        last_pk = objs[-1].pk
+
+
+def export_value(obj, name):
+    field = obj._meta.get_field(name)
+    if field.rel is not None:
+        related = getattr(obj, name)
+        return related.uid if related is not None else None
+    value = getattr(obj, name)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def export_rows(model, since=None, batch_size=BATCH_SIZE):
+    """
+    Yields an OrderedDict of field name -> value of each exported object
+    """
+    fields = export_fields(model)
+    for obj in iter_objects(export_queryset(model, since), batch_size):
+        yield OrderedDict((name, export_value(obj, name)) for name in fields)
+
+
+class _Line(object):
+    # Stands in for a file for csv.writer, to get each line back as it is written
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def export_lines(model, fmt, since=None, batch_size=BATCH_SIZE):
+    """
+    Yields the export of a model as utf-8 encoded lines, in fmt (one of FORMATS).  CSV starts with a header
+    """
+    if fmt not in FORMATS:
+        raise ValueError(u'Unknown export format {}'.format(fmt))
+    rows = export_rows(model, since, batch_size)
+    if fmt == 'csv':
+        writer = csv.writer(_Line())
+        yield writer.writerow(export_fields(model))
+        for row in rows:
+            yield writer.writerow([_csv_value(xx) for xx in row.values()])
+    else:
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False).encode('utf-8') + '\n'
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks loading library_hansard items against a database seeded with RawCouncilHansard rows.
+
+Seeds the rows and a matching feed, times the per-link title lookups the processor used to make
+against the preloaded title map, then times the processor itself rewriting every row (force) and
+skipping every row (unchanged).  Everything runs in a transaction that is rolled back at the end.
+
+$ python manage.py benchmark_hansard_upsert --rows 10000
+"""
+from optparse import make_option
+import time
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from raw.models import RawCouncilHansard, LANG_EN, LANG_CN
+from raw.processors.library_hansard import LibraryHansardProcessor
+
+
+class Rollback(Exception):
+    pass
+
+
+def make_item(i):
+    date = u'{:04d}.{:02d}.{:02d}'.format(1985 + i // 336, i // 28 % 12 + 1, i % 28 + 1)
+    date_str = date.replace(u'.', u'')
+    url = u'http://library.legco.gov.hk:1080/record=b{}'.format(i)
+    links = [[u'H{} (English Version)'.format(date_str), url + u'/e.doc'],
+             [u'H{} (中文版)'.format(date_str), url + u'/c.doc']]
+    return {
+        'type': 'LibraryHansard',
+        'title_en': u'Hong Kong Hansard {}'.format(date),
+        'title_cn': u'香港議事錄 {}'.format(date),
+        'links': links,
+        'file_urls': [xx[1] for xx in links],
+        'files': [{'url': xx[1], 'path': u'full/{:039x}{}.doc'.format(i, j), 'checksum': u''}
+                  for j, xx in enumerate(links)],
+        'source_url': url,
+    }
+
+
+def timed(label, fn):
+    with CaptureQueriesContext(connection) as queries:
+        start = time.time()
+        res = fn()
+        elapsed = time.time() - start
+    print(u'{:<32} {:>8.3f}s {:>7} queries'.format(label, elapsed, len(queries)))
+    return res
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the library_hansard processor against a seeded database'
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', default=10000, help='Number of RawCouncilHansard rows to seed'),
+    )
+
+    def handle(self, *args, **options):
+        items = [make_item(i) for i in range(options['rows'] // 2)]
+        try:
+            with transaction.atomic():
+                self.run(items)
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def run(self, items):
+        def seed():
+            objs = []
+            for i, item in enumerate(items):
+                date_str = item['links'][0][0][1:9]
+                for (title, url), lang, language in zip(item['links'], [u'e', u'c'], [LANG_EN, LANG_CN]):
+                    objs.append(RawCouncilHansard(
+                        uid=u'council_hansard-{}-{}'.format(date_str, lang), title=title, raw_date=date_str,
+                        language=language, url=url))
+            RawCouncilHansard.objects.bulk_create(objs, batch_size=500)
+        timed(u'Seed {} rows'.format(len(items) * 2), seed)
+        titles = [link[0] for item in items for link in item['links']]
+
+        timed(u'get(title=...) per link', lambda: [RawCouncilHansard.objects.get(title=xx) for xx in titles])
+
+        def preloaded():
+            by_title = dict((xx.title, xx) for xx in RawCouncilHansard.objects.all())
+            return [by_title[xx] for xx in titles]
+        timed(u'Preloaded title map', preloaded)
+
+        def process(force):
+            proc = LibraryHansardProcessor('benchmark', force=force)
+            proc.process_batch(items)
+            return proc
+        proc = timed(u'Processor, every row changed', lambda: process(True))
+        print(u'  {} created, {} updated, {} unchanged'.format(proc._count_created, proc._count_updated, proc._count_unchanged))
+        proc = timed(u'Processor, every row unchanged', lambda: process(False))
+        print(u'  {} created, {} updated, {} unchanged'.format(proc._count_created, proc._count_updated, proc._count_unchanged))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks the processors' items file reader against a plain json.loads loop.
+
+Writes a synthetic library_hansard style feed (mostly LibraryResultPage items, with
+a LibraryHansard item every ten lines) to a temporary directory, plain and gzipped,
+and times reading the LibraryHansard items out of it.
+
+$ python manage.py benchmark_items_reader --lines 100000
+"""
+from optparse import make_option
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+from django.core.management import BaseCommand
+from raw.processors import base
+
+
+def make_item(i):
+    if i % 10 == 0:
+        url = u'http://library.legco.gov.hk:1080/record=b{}'.format(i)
+        return {
+            'type': 'LibraryHansard',
+            'title_en': u'Hong Kong Hansard 2014.10.{:02d}'.format(i % 28 + 1),
+            'title_cn': u'香港議事錄 2014.10.{:02d}'.format(i % 28 + 1),
+            'links': [[u'H20141015 (English Version)', url + u'/e.doc'], [u'H20141015 (中文版)', url + u'/c.doc']],
+            'file_urls': [url + u'/e.doc', url + u'/c.doc'],
+            'files': [{'url': url + u'/e.doc', 'path': u'full/{:040x}.doc'.format(i), 'checksum': u'{:032x}'.format(i)}],
+            'source_url': url,
+        }
+    return {
+        'type': 'LibraryResultPage',
+        'title': u'Hong Kong Hansard 2014.10.{:02d}'.format(i % 28 + 1),
+        'link': u'http://library.legco.gov.hk:1080/search~S10?/tHong+Kong+Hansard/{}'.format(i),
+        'browse_url': u'http://library.legco.gov.hk:1080/search~S10?/tHong+Kong+Hansard/browse/{}'.format(i // 50),
+        'document_type': u'Hansard',
+    }
+
+
+def plain_loop(path, type_name):
+    # What the processors did before: decode every line, then check the type
+    with open(path, 'rb') as f:
+        return len([xx for xx in (json.loads(line) for line in f) if xx['type'] == type_name])
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the JSONL reader used by the processors'
+    option_list = BaseCommand.option_list + (
+        make_option('--lines', type='int', default=100000, help='Number of lines in the feed'),
+        make_option('--repeat', type='int', default=3, help='Best of this many runs is reported'),
+    )
+
+    def handle(self, *args, **options):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'library_hansard.jsonl')
+            with open(path, 'wb') as f:
+                for i in xrange(options['lines']):
+                    f.write(json.dumps(make_item(i)) + '\n')
+            gz_path = path + '.gz'
+            with open(path, 'rb') as f_in:
+                with gzip.open(gz_path, 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+
+            print(u'{} lines, {:.1f} MB ({:.1f} MB gzipped), JSON decoder: {}'.format(
+                options['lines'], os.path.getsize(path) / 1e6, os.path.getsize(gz_path) / 1e6,
+                base.fast_json.__name__))
+            runs = [
+                ('json.loads every line', lambda: plain_loop(path, 'LibraryHansard')),
+                ('file_wrapper, all types', lambda: len([xx for xx in base.file_wrapper(path)
+                                                        if xx['type'] == 'LibraryHansard'])),
+                ('file_wrapper, LibraryHansard', lambda: len(list(base.file_wrapper(path, ['LibraryHansard'])))),
+                ('file_wrapper, LibraryHansard, gzip', lambda: len(list(base.file_wrapper(gz_path, ['LibraryHansard'])))),
+            ]
+            for label, fn in runs:
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.time()
+                    count = fn()
+                    timings.append(time.time() - start)
+                print(u'{:<36} {:>8.3f}s  ({} items)'.format(label, min(timings), count))
+        finally:
+            shutil.rmtree(tmp_dir)
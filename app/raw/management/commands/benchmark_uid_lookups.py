@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks looking up raw and parsed rows by uid, at the current table sizes and at 10 times those.
+
+For RawCouncilQuestion and ParsedPerson, seeds rows until each table has the given number of rows,
+then times lookups of random uids and prints the query plan, to show whether the uid index is used.
+Everything runs in a transaction that is rolled back at the end.
+
+$ python manage.py benchmark_uid_lookups
+$ python manage.py benchmark_uid_lookups --rows 20000 --lookups 2000
+"""
+from optparse import make_option
+import random
+import time
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from raw.models import RawCouncilQuestion, ParsedPerson, GENDER_M, LANG_EN
+
+
+class Rollback(Exception):
+    pass
+
+
+def make_question(i):
+    return RawCouncilQuestion(uid=u'question-bench-{}-e'.format(i), raw_date=u'1.1.2014', language=LANG_EN,
+                              number_and_type=u'Q. 1 (Oral)', subject=u'Question {}'.format(i))
+
+
+def make_person(i):
+    return ParsedPerson(uid=u'member-bench-{}'.format(i), name_e=u'Member {}'.format(i), name_c=u'議員',
+                        title_e=u'Hon', title_c=u'議員', gender=GENDER_M)
+
+
+def query_plan(qs):
+    sql, params = qs.query.sql_with_params()
+    if connection.vendor == 'sqlite':
+        explain = u'EXPLAIN QUERY PLAN '
+    elif connection.vendor == 'postgresql':
+        explain = u'EXPLAIN '
+    else:
+        return u'(no query plan for {})'.format(connection.vendor)
+    cursor = connection.cursor()
+    cursor.execute(explain + sql, params)
+    return u'; '.join([unicode(xx[-1]) for xx in cursor.fetchall()])
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks uid lookups on the raw and parsed models'
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', default=None,
+                    help='Table size to start from, defaults to the current size of each table (at least 1000)'),
+        make_option('--scale', type='int', default=10, help='Also benchmark at this many times the size'),
+        make_option('--lookups', type='int', default=1000, help='Number of uids looked up at each size'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                for model, factory in [(RawCouncilQuestion, make_question), (ParsedPerson, make_person)]:
+                    rows = options['rows'] or max(model.objects.count(), 1000)
+                    for size in [rows, rows * options['scale']]:
+                        self.run(model, factory, size, options['lookups'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def run(self, model, factory, size, lookups):
+        count = model.objects.count()
+        if count < size:
+            start = time.time()
+            model.objects.bulk_create([factory(i) for i in range(count, size)], batch_size=500)
+            print(u'{}: seeded {} rows in {:.1f}s'.format(model.__name__, size - count, time.time() - start))
+        uids = list(model.objects.values_list('uid', flat=True))
+        sample = [random.choice(uids) for i in range(lookups)]
+
+        start = time.time()
+        for uid in sample:
+            list(model.objects.filter(uid=uid)[:1])
+        elapsed = time.time() - start
+        print(u'{:<20} {:>9} rows {:>8.3f} ms per lookup'.format(model.__name__, size, elapsed * 1000 / lookups))
+        print(u'  {}'.format(query_plan(model.objects.filter(uid=sample[0]))))
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Exports the parsed models as CSV or JSON lines, in constant memory, see raw.export
+
+$ python manage.py export_parsed questions --format jsonl > questions.jsonl
+$ python manage.py export_parsed --output-dir dumps --gzip
+$ python manage.py export_parsed committee-memberships --since 2014-06-01
+
+With a single model and no --output-dir, the export is written to stdout.  With --output-dir, each model
+is written to <name>.<format>, or <name>.<format>.gz with --gzip.  Exports every model by default
+"""
+import gzip
+from optparse import make_option
+import os
+import sys
+from django.core.management import BaseCommand, CommandError
+from raw import export
+from raw.utils import parse_since
+
+
+class Command(BaseCommand):
+    args = '[{}]'.format(' '.join(export.EXPORT_MODELS.keys()))
+    help = 'Exports the parsed models as CSV or JSON lines'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', default='csv', choices=export.FORMATS, help='csv (default) or jsonl'),
+        make_option('--since', default=None,
+                    help='Only export objects whose raw objects were parsed after this date (YYYY-MM-DD[THH:MM:SS])'),
+        make_option('--output-dir', default=None, help='Directory to write a file per model to, instead of stdout'),
+        make_option('--gzip', action='store_true', default=False, help='Gzip the output'),
+    )
+
+    def handle(self, *args, **options):
+        names = list(args) or export.EXPORT_MODELS.keys()
+        for name in names:
+            if name not in export.EXPORT_MODELS:
+                raise CommandError(u'Unknown model {}, use one of {}'.format(name, u', '.join(export.EXPORT_MODELS)))
+        if options['output_dir'] is None and len(names) != 1:
+            raise CommandError(u'Use --output-dir to export more than one model')
+        try:
+            since = parse_since(options['since']) if options['since'] else None
+        except ValueError as e:
+            raise CommandError(u'Could not parse --since: {}'.format(e))
+
+        fmt = options['format']
+        for name in names:
+            if options['output_dir'] is None:
+                # Write bytes, not through self.stdout
+                f = sys.stdout
+            else:
+                path = os.path.join(options['output_dir'], u'{}.{}{}'.format(name, fmt, '.gz' if options['gzip'] else ''))
+                f = open(path, 'wb')
+            out = gzip.GzipFile(fileobj=f, mode='wb') if options['gzip'] else f
+            count = 0
+            try:
+                for line in export.export_lines(export.EXPORT_MODELS[name], fmt, since):
+                    out.write(line)
+                    count += 1
+            finally:
+                if out is not f:
+                    # Writes the end of the gzip stream, but leaves f open
+                    out.close()
+                if f is not sys.stdout:
+                    f.close()
+            if options['output_dir'] is not None:
+                if fmt == 'csv':
+                    # Not the header
+                    count -= 1
+                self.stdout.write(u'{}: {} rows to {}'.format(name, count, path))
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Creates the ParsedSpeeches from the hansards, parsing them in parallel, then adds the speeches that
+changed to the search index.  raw2parsed does this along with the other parsed models, this is for
+repopulating the speeches on their own
+
+$ python manage.py populate_speeches
+$ python manage.py populate_speeches --since 2014-06-01 --processes 4
+"""
+from optparse import make_option
+from django.core.management import BaseCommand, CommandError
+from raw import search
+from raw.models import ParsedSpeech
+from raw.utils import parse_since
+
+
+class Command(BaseCommand):
+    help = 'Creates the speeches of the hansards'
+    option_list = BaseCommand.option_list + (
+        make_option('--since', default=None,
+                    help='Only populate the hansards parsed after this date (YYYY-MM-DD[THH:MM:SS])'),
+        make_option('--processes', type='int', default=None,
+                    help='Number of processes parsing the hansards, defaults to the number of CPUs'),
+        make_option('--skip-search-index', action='store_true', default=False,
+                    help="Don't index the new speeches for search afterwards"),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_since(options['since']) if options['since'] else None
+        except ValueError as e:
+            raise CommandError(u'Could not parse --since: {}'.format(e))
+        res = ParsedSpeech.objects.populate(since=since, processes=options['processes'])
+        self.stdout.write(u'{} speeches created, {} updated, {} unchanged in {:.1f}s ({:.0f} rows/s)'.format(
+            res['created'], res['updated'], res['unchanged'], res['seconds'], res['rows_per_second']))
+        if not options['skip_search_index']:
+            res = search.update_index()
+            self.stdout.write(u'Search index: {speeches} speeches, {questions} questions and replies, {removed} removed'.format(**res))
@@ -1,19 +1,54 @@
 # -*- coding: utf-8 -*-
+"""
+Creates or updates the parsed models from the raw models.
 
-from django.core.management import BaseCommand
+$ python manage.py raw2parsed
+$ python manage.py raw2parsed --changed-only
+$ python manage.py raw2parsed --since 2014-06-01
+
+By default every parsed object is rebuilt.  With --since, only the ones whose raw objects (or the raw
+objects they depend on, e.g. the RawMember of a ParsedMembership) were parsed after the given date.
+With --changed-only, each model is brought up to date from the latest raw change it has already populated.
+Then the speeches and questions that changed are added to the search index, see raw.search.
+"""
+from optparse import make_option
+from django.core.management import BaseCommand, CommandError
 import raw.models
-from raw.models import ParsedCommittee, ParsedCommitteeMembership, ParsedCouncilMeeting, ParsedMembership, ParsedPerson, ParsedPerson, ParsedQuestion
+from raw.models import ParsedCommittee, ParsedCommitteeMembership, ParsedCouncilMeeting, ParsedMembership, ParsedPerson, ParsedPerson, ParsedQuestion, ParsedSpeech
+from raw import search
+from raw.utils import parse_since
 import logging
 
 logging.disable(logging.CRITICAL)
 
+
 class Command(BaseCommand):
     help = 'Create parsed models from their raw correspondences'
-    
+    option_list = BaseCommand.option_list + (
+        make_option('--since', default=None,
+                    help='Only populate from raw objects parsed after this date (YYYY-MM-DD[THH:MM:SS])'),
+        make_option('--changed-only', action='store_true', default=False,
+                    help='Only populate from raw objects parsed after the ones each model was last populated from'),
+        make_option('--skip-search-index', action='store_true', default=False,
+                    help="Don't index the new speeches and questions for search afterwards"),
+    )
+
     def handle(self, *args, **options):
-        raw.models.ParsedCommittee.objects.populate()
-        raw.models.ParsedPerson.objects.populate()
-        raw.models.ParsedMembership.objects.populate()
-        raw.models.ParsedCommitteeMembership.objects.populate()
-        raw.models.ParsedCouncilMeeting.objects.populate()
-        #raw.models.ParsedQuestion.objects.populate()
\ No newline at end of file
+        if options['since'] and options['changed_only']:
+            raise CommandError(u'Use one of --since and --changed-only')
+        try:
+            since = parse_since(options['since']) if options['since'] else None
+        except ValueError as e:
+            raise CommandError(u'Could not parse --since: {}'.format(e))
+        for model in [ParsedCommittee, ParsedPerson, ParsedMembership, ParsedCommitteeMembership, ParsedCouncilMeeting,
+                      ParsedQuestion, ParsedSpeech]:
+            if options['changed_only']:
+                # Models that have never been populated are populated in full
+                since = model.objects.get_last_populated()
+            res = model.objects.populate(since=since)
+            if res is not None:
+                self.stdout.write(u'{}: {} created, {} updated, {} unchanged in {:.1f}s ({:.0f} rows/s)'.format(
+                    model.__name__, res['created'], res['updated'], res['unchanged'], res['seconds'], res['rows_per_second']))
+        if not options['skip_search_index']:
+            res = search.update_index()
+            self.stdout.write(u'Search index: {speeches} speeches, {questions} questions and replies, {removed} removed'.format(**res))
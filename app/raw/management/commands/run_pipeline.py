@@ -0,0 +1,44 @@
+"""
+Scrapes and processes the spiders, respecting the dependencies between the processors.
+
+$ python manage.py run_pipeline
+$ python manage.py run_pipeline --no-scrape schedule_committee schedule_membership
+
+By default the run is sent to the Celery workers, which run independent steps in parallel.
+With --local the steps are run in this process, one after the other, with each scrape in a child process.
+--shards splits the scrape files of the processors that support it, e.g. library_hansard, into parts
+that are processed in parallel:
+
+$ python manage.py run_pipeline --no-scrape --shards 4 library_hansard
+"""
+from optparse import make_option
+from django.core.management import BaseCommand
+from raw import pipeline
+from raw.tasks import run_pipeline
+
+
+class Command(BaseCommand):
+    args = '[spider ...]'
+    help = 'Scrape and process spiders in dependency order'
+    option_list = BaseCommand.option_list + (
+        make_option('--no-scrape', action='store_false', dest='scrape', default=True,
+                    help='Process the latest scrapes without scraping again'),
+        make_option('--force', action='store_true', default=False,
+                    help='Rewrite objects even if their items have not changed'),
+        make_option('--local', action='store_true', default=False,
+                    help='Run the steps in this process instead of on the Celery workers'),
+        make_option('--shards', type='int', default=1,
+                    help='Split each scrape file into this many parts, processed in parallel where the processor supports it'),
+    )
+
+    def handle(self, *args, **options):
+        spiders = list(args) or None
+        graph = pipeline.build_graph(spiders, options['scrape'])
+        for name in pipeline.topological_order(graph):
+            print u'{} <- {}'.format(name, u', '.join(graph[name]) or u'-')
+        if options['local']:
+            run_id = run_pipeline(spiders, options['scrape'], options['force'], options['shards'])
+            print u'Completed run {}'.format(run_id)
+        else:
+            result = run_pipeline.delay(spiders, options['scrape'], options['force'], options['shards'])
+            print u'Started run {}'.format(result.id)
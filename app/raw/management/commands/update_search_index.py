@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+Adds the hansard speeches and parsed questions that changed since the last update to the search index.
+raw2parsed does this after populating, this is for indexing on its own
+
+$ python manage.py update_search_index
+$ python manage.py update_search_index --rebuild
+"""
+from optparse import make_option
+from django.core.management import BaseCommand
+from raw import search
+
+
+class Command(BaseCommand):
+    help = 'Updates the search index of the hansard speeches and parsed questions'
+    option_list = BaseCommand.option_list + (
+        make_option('--rebuild', action='store_true', default=False,
+                    help='Index everything again, e.g. after changing the tokenizer'),
+    )
+
+    def handle(self, *args, **options):
+        res = search.update_index(rebuild=options['rebuild'])
+        self.stdout.write(u'{speeches} speeches, {questions} questions and replies indexed, {removed} removed'.format(**res))
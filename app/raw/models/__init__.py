@@ -1,4 +1,5 @@
 from .raw import *
 from scrape import *
 from parsed import *
+from search import *
 from constants import *
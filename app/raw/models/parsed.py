@@ -3,17 +3,24 @@ from copy import copy
 from datetime import datetime, date, time
 import json
 import logging
+import multiprocessing
 from django.conf import settings
-from django.db import models, IntegrityError
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction, IntegrityError
 from django.db.backends import BaseDatabaseWrapper
 from django.db.backends.util import CursorWrapper
-from django.db.models import get_model, Q
+from django.db.models import get_model, Count, Max, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver, Signal
 from django.utils.encoding import force_unicode
 from django.utils.text import slugify
 import re
-from constants import GENDER_CHOICES, LANG_EN
-from .raw import RawMember, RawCommittee, RawCommitteeMembership, RawCouncilAgenda, RawCouncilQuestion
-from ..names import MemberName, NameMatcher
+import time as time_module
+from constants import GENDER_CHOICES, LANG_CHOICES, LANG_CN, LANG_EN
+from .raw import RawMember, RawCommittee, RawCommitteeMembership, RawCouncilAgenda, RawCouncilHansard, RawCouncilQuestion
+from ..names import MemberName, NameMatcher, proper
+from ..utils import html_to_text
 from ..docs.agenda import logger as agenda_logger
 from ..docs.question import logger as question_logger
 from ..docs.question import CouncilQuestion
@@ -27,22 +34,69 @@ class TimestampMixin(object):
 
 
 class BaseParsedManager(models.Manager):
-    def create_from_raw(self, raw_obj):
-        # Create a parsed model from its corresponding raw one, but not saving
+    # Number of rows written per query by populate
+    BATCH_SIZE = 500
+
+    def get_uid(self, raw_obj):
+        # uid of the parsed object made from a raw one
+        return raw_obj.uid
+
+    def active(self):
+        # The objects that are neither deactivated by populate nor by an override
+        qs = self.filter(deactivate=False)
+        deactivated = [uid for uid, payload in Override.objects.get_payloads(self.model).items()
+                       if payload.get('deactivate')]
+        if deactivated:
+            qs = qs.exclude(uid__in=deactivated)
+        return qs
+
+    def get_raw_queryset(self, since=None):
+        # The raw objects that populate makes parsed objects from, or just the ones that changed after since.
+        # Managers whose objects also depend on other raw models add those changes here
+        qs = self.model.RAW_MODEL.objects.all()
+        if since is not None:
+            qs = qs.filter(last_parsed__gt=since)
+        return qs
+
+    def get_last_populated(self):
+        # The latest change to the raw objects that has been populated.  Anything that changed after this
+        # still needs to be populated
+        return self.aggregate(latest=Max('source_last_parsed'))['latest']
+
+    def get_copy_plan(self):
+        # Names of the fields copied directly from the raw object.  Works the same for every object
+        # of the model, so populate only works it out once
         if getattr(self, 'excluded', None) is not None:
             excluded = copy(self.excluded)
         else:
             excluded = []
-        # copy fields directly without any processing
+        excluded.append('source_last_parsed')
+        return [xx.name for xx in self.model._meta.fields if xx.name not in excluded]
+
+    def copy_from_raw(self, obj, raw_obj, plan):
+        # Fill in a parsed object from its corresponding raw one.  Managers that need more than
+        # a straight copy of the fields override this
+        for field in plan:
+            setattr(obj, field, getattr(raw_obj, field, None))
+        obj.deactivate = False
+        self.stamp_source(obj, raw_obj)
+        return obj
+
+    def stamp_source(self, obj, *raw_objs):
+        # Record the latest change to the raw objects a parsed object is made from
+        stamps = [xx.last_parsed for xx in raw_objs if xx is not None and xx.last_parsed is not None]
+        if obj.source_last_parsed is not None:
+            stamps.append(obj.source_last_parsed)
+        if stamps:
+            obj.source_last_parsed = max(stamps)
+
+    def create_from_raw(self, raw_obj):
+        # Create a parsed model from its corresponding raw one, but not saving
         try:
-            obj = self.get(uid=raw_obj.uid)
+            obj = self.get(uid=self.get_uid(raw_obj))
         except self.model.DoesNotExist:
             obj = self.model()
-        for field in [xx.name for xx in obj._meta.fields]:
-            if field not in excluded:
-                setattr(obj, field, getattr(raw_obj, field, None))
-        obj.deactivate = False
-        return obj
+        return self.copy_from_raw(obj, raw_obj, self.get_copy_plan())
 
     def _deactivate_db_debug(self):
         if settings.DEBUG:
@@ -53,28 +107,113 @@ class BaseParsedManager(models.Manager):
         if settings.DEBUG and getattr(self, 'original') is not None:
             BaseDatabaseWrapper.make_debug_cursor = self.original
 
-    def populate(self):
+    def _field_values(self, obj):
+        return [getattr(obj, xx.attname) for xx in self.model._meta.concrete_fields]
+
+    def populate(self, since=None):
+        """
+        Creates or updates the parsed objects for all of the raw objects, or for the ones that changed after since.
+
+        The existing parsed objects are loaded up front, and matched to the raw objects by uid.
+        Raw objects that share a uid update the same parsed object.  New objects are inserted with bulk_create,
+        and only the existing objects that changed are saved, all in a single transaction.
+        Returns a dict of the counts, and the rows per second
+        """
         self._deactivate_db_debug()
-        raw_items = self.model.RAW_MODEL.objects.all()
+        start = time_module.time()
+        plan = self.get_copy_plan()
+        pk_name = self.model._meta.pk.name
+        # Existing objects keep their primary key
+        update_plan = [xx for xx in plan if xx != pk_name]
+        raw_objs = list(self.get_raw_queryset(since).iterator())
+        existing = self._load_existing(None if since is None else [self.get_uid(xx) for xx in raw_objs])
+
+        objs = OrderedDict()
+        for raw_obj in raw_objs:
+            uid = self.get_uid(raw_obj)
+            if uid not in objs:
+                obj = existing.pop(uid, None)
+                objs[uid] = (obj or self.model(), None if obj is None else self._field_values(obj))
+            obj, before = objs[uid]
+            self.copy_from_raw(obj, raw_obj, plan if before is None else update_plan)
+        return self._write(start, objs)
+
+    def _load_existing(self, uids=None, field='uid'):
+        # The existing parsed objects by uid.  All of them, or the ones whose field is in uids.
+        # Where a uid has been deactivated as a duplicate, the active object is the one that's updated
+        if uids is None:
+            querysets = [self.order_by('deactivate', 'pk')]
+        else:
+            uids = sorted(set(uids))
+            querysets = [self.filter(**{'{}__in'.format(field): uids[i:i + self.BATCH_SIZE]}).order_by('deactivate', 'pk')
+                         for i in range(0, len(uids), self.BATCH_SIZE)]
+        existing = {}
+        for qs in querysets:
+            for obj in qs:
+                existing.setdefault(obj.uid, obj)
+        return existing
+
+    def _write(self, start, objs, dry_run=False):
+        # Writes the new and changed objects from an OrderedDict of uid -> (object, field values
+        # when loaded or None for new objects), and reports on it.  The objects are stored as parsed,
+        # overrides are applied when they are read
+        new_objs = [obj for obj, before in objs.values() if before is None]
+        changed_objs = [obj for obj, before in objs.values()
+                        if before is not None and self._field_values(obj) != before]
+        created = 0
+        if not dry_run:
+            with transaction.atomic():
+                created = self._bulk_write(new_objs, changed_objs)
+            if new_objs or changed_objs:
+                bump_parsed_generation()
+        self._reactivate_db_debug()
+        return self._report(start, created, len(changed_objs), len(objs) - len(new_objs) - len(changed_objs))
+
+    def _report(self, start, created, updated, unchanged):
+        elapsed = time_module.time() - start
+        total = created + updated + unchanged
+        res = {
+            'created': created,
+            'updated': updated,
+            'unchanged': unchanged,
+            'seconds': elapsed,
+            'rows_per_second': total / elapsed if elapsed > 0 else 0,
+        }
+        logger.info(u'Populated {}: {} created, {} updated, {} unchanged in {:.1f}s ({:.0f} rows/s)'.format(
+            self.model.__name__, created, updated, unchanged, elapsed, res['rows_per_second']))
+        return res
+
+    def _bulk_write(self, new_objs, changed_objs):
+        # Saves the changed objects and inserts the new ones in batches.  Returns the number of objects inserted
+        for obj in changed_objs:
+            obj.save()
         count = 0
-        for item in raw_items:
-            # Get or create, but without commit
-            obj = self.create_from_raw(item)
+        for i in range(0, len(new_objs), self.BATCH_SIZE):
+            batch = new_objs[i:i + self.BATCH_SIZE]
             try:
-                obj.save()
-                count += 1
-            except IntegrityError as e:
-                logger.warning(u'Could not create from {}'.format(item))
-                logger.warning(e)
-        logger.info('Populated {} objects'.format(count))
-        self._reactivate_db_debug()
-        
+                with transaction.atomic():
+                    self.bulk_create(batch)
+                count += len(batch)
+            except IntegrityError:
+                # Find the objects that can't be created, and create the rest
+                for obj in batch:
+                    try:
+                        with transaction.atomic():
+                            obj.save()
+                        count += 1
+                    except IntegrityError as e:
+                        logger.warning(u'Could not create {}'.format(obj.uid))
+                        logger.warning(e)
+        return count
+
 
 class BaseParsedModel(models.Model):
     # We don't constrain UIDs to be unique, because we may have duplicates in the raw data that we want
-    # to deactivate here
-    uid = models.CharField(max_length=255)
+    # to deactivate here.  The active ones are unique though, with a partial unique index (see migration 0043)
+    uid = models.CharField(max_length=255, db_index=True)
     deactivate = models.BooleanField(default=False)
+    # last_parsed of the raw object(s) this was populated from, for populating only what changed
+    source_last_parsed = models.DateTimeField(null=True, blank=True)
 
     # link to the raw model object we're mapping to
     RAW_MODEL = None
@@ -87,7 +226,7 @@ class BaseParsedModel(models.Model):
     def get_overridable_fields(self):
         # First we get the fields for the model
         # if the model has `not_overridable`, then we exclude it from the list
-        exclude = getattr(self, 'not_overridable', [])
+        exclude = list(getattr(self, 'not_overridable', []))
         # By default, we want to exclude things like the uid
         exclude.extend(['created', 'modified', 'uid', 'id'])
         # Now iterate over the model fields to get the field names we want
@@ -98,7 +237,14 @@ class BaseParsedModel(models.Model):
         return fields
 
 
+# Sent with the model_name and the uids of the objects whose overrides were saved or deleted
+overrides_changed = Signal(providing_args=['model_name', 'uids'])
+
+
 class OverrideManager(models.Manager):
+    # Cache key of the payloads of a model's overrides, at a parsed generation
+    PAYLOADS_KEY = u'raw.overrides.{}.{}'
+
     def get_from_reference(self, reference):
         # Tries to retrieve the override for a specific model instance
         model = reference._meta.model_name
@@ -125,6 +271,74 @@ class OverrideManager(models.Manager):
         instance = self.model(ref_model=model, ref_uid=ref_uid)
         return instance
 
+    def get_payloads(self, model):
+        """
+        Returns a dict of uid -> decoded payload of all of the overrides for a model (class or model_name).
+        They are cached under the parsed generation, which saving or deleting an override bumps, so checking
+        the cache costs one query for the generation, and loading the overrides one more.  The generation
+        is in the database, so a process doesn't keep using payloads that another process has changed
+        """
+        model_name = model if isinstance(model, basestring) else model._meta.model_name
+        key = self.PAYLOADS_KEY.format(model_name, parsed_generation())
+        payloads = cache.get(key)
+        if payloads is None:
+            payloads = dict((uid, decode_payload(data)) for uid, data in
+                            self.filter(ref_model=model_name).values_list('ref_uid', 'data'))
+            # The older generations aren't read again, so let them expire
+            cache.set(key, payloads)
+        return payloads
+
+    def invalidate(self, model_name, uids):
+        bump_parsed_generation()
+        overrides_changed.send(sender=self.model, model_name=model_name, uids=uids)
+
+    def apply(self, objs, model=None, payloads=None):
+        """
+        Applies the overrides to a list of parsed objects of the same model, in place, with only the
+        generation query once the model's overrides are cached.  Pass the payloads from get_payloads to
+        apply them to many lists without any queries.  Returns the list
+        """
+        objs = list(objs)
+        if len(objs) == 0:
+            return objs
+        model = model or objs[0].__class__
+        if payloads is None:
+            payloads = self.get_payloads(model)
+        if len(payloads) == 0:
+            return objs
+        fields = dict((xx.name, xx) for xx in model().get_overridable_fields())
+        for obj in objs:
+            payload = payloads.get(obj.uid)
+            if payload:
+                apply_payload(obj, payload, fields)
+        return objs
+
+    def set_deactivated(self, instances, deactivate=True):
+        """
+        Deactivates (or reactivates) a list of parsed objects of the same model.  Creates overrides for
+        the ones that don't have one when deactivating, and leaves them alone when reactivating
+        """
+        if len(instances) == 0:
+            return
+        model_name = instances[0]._meta.model_name
+        existing = dict((xx.ref_uid, xx) for xx in
+                        self.filter(ref_model=model_name, ref_uid__in=[xx.uid for xx in instances]))
+        new_overrides = []
+        with transaction.atomic():
+            for instance in instances:
+                override = existing.get(instance.uid)
+                if override is None:
+                    if deactivate:
+                        override = self.create_from(instance)
+                        override.merge_payload({'deactivate': True})
+                        new_overrides.append(override)
+                elif override.is_deactivated() != deactivate:
+                    override.merge_payload({'deactivate': deactivate})
+                    override.save()
+            # No post_save for these
+            self.bulk_create(new_overrides)
+        self.invalidate(model_name, [xx.uid for xx in instances])
+
 
 class Override(models.Model):
     # The lowercase string name of the model we're referencing, model._meta.model_name
@@ -164,9 +378,7 @@ class Override(models.Model):
 
     def get_payload(self):
         # Returns the unserialized data payload
-        if self.data == u'':
-            return {}
-        return json.loads(self.data)
+        return decode_payload(self.data)
 
     def merge_payload(self, data_to_merge):
         # Takes a dict and merges it the current payload
@@ -178,28 +390,74 @@ class Override(models.Model):
         payload = self.get_payload()
         return payload.get('deactivate', False)
 
+
+def decode_payload(data):
+    if data == u'':
+        return {}
+    return json.loads(data)
+
+
+def apply_payload(obj, payload, fields):
+    # Sets the fields of a parsed object from an override payload.  fields maps the names of the
+    # overridable fields to the fields, anything else in the payload is ignored
+    for name, value in payload.items():
+        field = fields.get(name)
+        if field is None:
+            continue
+        if isinstance(field, models.BooleanField) and value == u'on':
+            # Posted by a checkbox
+            value = True
+        try:
+            setattr(obj, field.attname, field.to_python(value))
+        except ValidationError:
+            logger.warn(u'Invalid override of {} on {}: {}'.format(name, obj.uid, value))
+
+
+@receiver(post_save, sender=Override)
+@receiver(post_delete, sender=Override)
+def invalidate_override_payloads(sender, instance, **kwargs):
+    Override.objects.invalidate(instance.ref_model, [instance.ref_uid])
+
+
+class ParsedGeneration(models.Model):
+    """
+    A counter that changes whenever the parsed objects or their overrides do, for caching anything made
+    from them (e.g. raw.api responses) without having to work out what a change affects.  It is kept in
+    the database, not the cache, so every process sees the changes made by the others, e.g. by populate
+    on a Celery worker.  There is a single row
+    """
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        app_label = 'raw'
+
+
+def parsed_generation():
+    return ParsedGeneration.objects.filter(pk=1).values_list('value', flat=True).first() or 0
+
+
+def bump_parsed_generation():
+    if ParsedGeneration.objects.filter(pk=1).update(value=models.F('value') + 1) == 0:
+        # Start from the time, so a table that was emptied doesn't reuse old generations
+        ParsedGeneration.objects.get_or_create(pk=1, defaults={'value': int(time_module.time() * 1000)})
+
+
 """
 Person
 """
-class PersonManager(models.Manager):
-    def create_from_raw(self, raw_obj):
-        try:
-            obj = self.get(uid=raw_obj.uid)
-        except self.model.DoesNotExist:
-            obj = self.model()
-        # Copy items over, but a few fields require special handling
-        excluded = ['education_e', 'education_c', 'occupation_e', 'occupation_c']
-        for field in [xx.name for xx in obj._meta.fields]:
-            if field not in excluded:
-                setattr(obj, field, getattr(raw_obj, field, None))
+class PersonManager(BaseParsedManager):
+    # Copy items over, but a few fields require special handling
+    excluded = ['education_e', 'education_c', 'occupation_e', 'occupation_c']
+
+    def copy_from_raw(self, obj, raw_obj, plan):
+        obj = super(PersonManager, self).copy_from_raw(obj, raw_obj, plan)
         # Concatenate the education and occupation fields
-        for field in excluded:
+        for field in self.excluded:
             raw_val = getattr(raw_obj, field)
             if raw_val is None or raw_val == u'':
                 continue
             json_val = json.loads(raw_val)
             setattr(obj, field, ', '.join(json_val))
-        obj.deactivate = False
         return obj
 
 
@@ -246,7 +504,7 @@ class ParsedPerson(TimestampMixin, BaseParsedModel):
         return matcher
 
 
-class MembershipManager(models.Manager):
+class MembershipManager(BaseParsedManager):
     def get_active_on_date(self, query_date):
         # Return True if a membership is active on a given query_date.
         return self.filter(start_date__lt=query_date, end_date__gt=query_date)
@@ -258,35 +516,78 @@ class MembershipManager(models.Manager):
 
     def create_from_raw(self, person):
         # Create all the memberships from a RawMember.  So could result in multiple new objects
-        service_objects = json.loads(person.service_e)
-        for service in service_objects:
-            parsed = MembershipParser(service)
-            uid = ParsedMembership.make_uid(person, parsed)
+        parsed_person = ParsedPerson.objects.get(uid=person.uid)
+        for uid, parsed in self._parse_services(person):
             # Get or create
             try:
                 obj = self.get(uid=uid)
             except self.model.DoesNotExist:
                 obj = self.model()
+            yield self._copy_membership(obj, uid, parsed, parsed_person, person)
+
+    def _parse_services(self, person):
+        # Yields the uid and MembershipParser of each of the services in a RawMember
+        if not person.service_e:
+            return
+        service_objects = json.loads(person.service_e)
+        for service in service_objects:
+            parsed = MembershipParser(service)
+            if parsed.start_date is None:
+                logger.warn(u'Could not parse the dates of membership {} of {}'.format(service, person.uid))
+                continue
+            yield ParsedMembership.make_uid(person, parsed), parsed
+
+    def _copy_membership(self, obj, uid, parsed, parsed_person, person):
+        # Copy data over
+        fields_to_copy = ['start_date', 'end_date', 'method_obtained', 'position', 'note']
+        for field in fields_to_copy:
+            # don't fill in nulls so defaults work
+            val = getattr(parsed, field, None)
+            if val is not None:
+                setattr(obj, field, val)
+        obj.deactivate = False
+        obj.person = parsed_person
+        obj.uid = uid
+        self.stamp_source(obj, person)
+        return obj
+
+    def _generate_memberships(self, people, existing, raw_members):
+        # Yields (uid, membership, existing field values or None for new memberships) for every
+        # service of every RawMember, from the preloaded people and memberships.
+        # Services that come up more than once update the same membership
+        seen = {}
+        for person in raw_members:
+            parsed_person = people.get(person.uid)
+            if parsed_person is None:
+                logger.warn(u'No ParsedPerson for {}, skipping its memberships'.format(person.uid))
+                continue
+            for uid, parsed in self._parse_services(person):
+                if uid not in seen:
+                    obj = existing.pop(uid, None)
+                    before = None if obj is None else self._field_values(obj)
+                    seen[uid] = (obj or self.model(), before)
+                obj, before = seen[uid]
+                yield uid, self._copy_membership(obj, uid, parsed, parsed_person, person), before
+
+    def populate(self, since=None):
+        """
+        Rebuilds the memberships from the service records of every RawMember, or of the ones that changed
+        after since, in one transaction.  The ParsedPersons and existing memberships are loaded up front,
+        so the number of queries doesn't depend on the number of memberships
+        """
+        self._deactivate_db_debug()
+        start = time_module.time()
+        raw_members = RawMember.objects.only('uid', 'service_e', 'last_parsed')
+        if since is not None:
+            raw_members = raw_members.filter(last_parsed__gt=since)
+        raw_members = list(raw_members.iterator())
+        people = dict((xx.uid, xx) for xx in ParsedPerson.objects.only('id', 'uid'))
+        existing = self._load_existing(None if since is None else [xx.uid for xx in raw_members], 'person__uid')
 
-            # Copy data over
-            fields_to_copy = ['start_date', 'end_date', 'method_obtained', 'position', 'note']
-            for field in fields_to_copy:
-                # don't fill in nulls so defaults work
-                val = getattr(parsed, field, None)
-                if val is not None:
-                    setattr(obj, field, val)
-            obj.deactivate = False
-            # Need a ParsedPerson
-            parsed_person = ParsedPerson.objects.get(uid=person.uid)
-            obj.person = parsed_person
-            obj.uid = uid
-            yield obj
-
-    def populate(self):
-        raw_items = RawMember.objects.all()
-        for item in raw_items:
-            for membership in self.create_from_raw(item):
-                membership.save()
+        memberships = OrderedDict()
+        for uid, obj, before in self._generate_memberships(people, existing, raw_members):
+            memberships[uid] = (obj, before)
+        return self._write(start, memberships)
 
 
 class ParsedMembership(TimestampMixin, BaseParsedModel):
@@ -407,18 +708,57 @@ class CommitteeMembershipManager(BaseParsedManager):
         today = date.today()
         return self.filter(Q(start_date__lt=today), Q(end_date__gt=today) | Q(end_date=None))
 
-    def create_from_raw(self, raw_obj):
-        obj = super(CommitteeMembershipManager, self).create_from_raw(raw_obj)
+    # uid -> ParsedCommittee and RawScheduleMember uid -> ParsedPerson, while populate is running
+    _committees = None
+    _people = None
+
+    def get_raw_queryset(self, since=None):
+        qs = RawCommitteeMembership.objects.select_related('committee', 'member')
+        if since is not None:
+            # Memberships also change when their committee or member does, or when the RawMember that
+            # the schedule member is matched to (re)appears
+            changed_members = ['s' + xx for xx in
+                               RawMember.objects.filter(last_parsed__gt=since).values_list('uid', flat=True)]
+            qs = qs.filter(Q(last_parsed__gt=since) | Q(committee__last_parsed__gt=since) |
+                           Q(member__last_parsed__gt=since) | Q(member__uid__in=changed_members))
+        return qs
+
+    def populate(self, since=None):
+        # Resolve the committees and people from maps loaded up front, instead of 3 queries per membership
+        self._committees = dict((xx.uid, xx) for xx in ParsedCommittee.objects.only('id', 'uid'))
+        # Schedule members are matched to RawMembers by uid, see RawScheduleMember.get_raw_member
+        raw_member_uids = set(RawMember.objects.values_list('uid', flat=True))
+        self._people = dict(('s' + xx.uid, xx) for xx in ParsedPerson.objects.only('id', 'uid') if xx.uid in raw_member_uids)
+        try:
+            return super(CommitteeMembershipManager, self).populate(since)
+        finally:
+            self._committees = None
+            self._people = None
+
+    def copy_from_raw(self, obj, raw_obj, plan):
+        obj = super(CommitteeMembershipManager, self).copy_from_raw(obj, raw_obj, plan)
+        self.stamp_source(obj, raw_obj.committee, raw_obj.member)
         # String up the person and the committee
         raw_committee = raw_obj.committee
         if raw_committee is not None:
-            committee = ParsedCommittee.objects.get(uid=raw_committee.uid)
-            obj.committee = committee
+            if self._committees is not None:
+                committee = self._committees.get(raw_committee.uid)
+                if committee is None:
+                    logger.warn(u'No ParsedCommittee for {}'.format(raw_committee.uid))
+            else:
+                committee = ParsedCommittee.objects.get(uid=raw_committee.uid)
+            if committee is not None:
+                obj.committee = committee
 
         if raw_obj.member is not None:
-            raw_member = raw_obj.member.get_raw_member()
-            if raw_member is not None:
-                person = ParsedPerson.objects.get(uid=raw_member.uid)
+            if self._people is not None:
+                person = self._people.get(raw_obj.member.uid)
+            else:
+                person = None
+                raw_member = raw_obj.member.get_raw_member()
+                if raw_member is not None:
+                    person = ParsedPerson.objects.get(uid=raw_member.uid)
+            if person is not None:
                 obj.person = person
         return obj
 
@@ -447,18 +787,17 @@ class ParsedCommitteeMembership(TimestampMixin, BaseParsedModel):
 class CouncilMeetingManager(BaseParsedManager):
     excluded = ['start_date', 'end_date']
 
-    def create_from_raw(self, raw_obj):
+    def get_uid(self, raw_obj):
         # Need to snip off the language on the agenda UID
-        new_uid = u'cmeeting-{:%Y%m%d}'.format(raw_obj.start_date)
-        try:
-            obj = self.get(uid=new_uid)
-        except self.model.DoesNotExist:
-            obj = self.model()
+        return u'cmeeting-{:%Y%m%d}'.format(raw_obj.start_date)
 
-        obj.uid = new_uid
+    def copy_from_raw(self, obj, raw_obj, plan):
+        # Nothing is copied directly
+        obj.uid = self.get_uid(raw_obj)
         start_date = raw_obj.start_date
         obj.start_date = datetime.combine(start_date, time(11, 0))
         obj.deactivate = False
+        self.stamp_source(obj, raw_obj)
         return obj
 
     def get_from_raw(self, raw_obj):
@@ -569,26 +908,103 @@ class QuestionManager(BaseParsedManager):
         
         return obj
         
-    def populate(self, dry_run=False):
+    def _changed_question_keys(self, since):
+        # The uids, without the language, of the questions that need to be rebuilt after since: the ones where either
+        # language or the asker changed, or that are on a date whose agenda changed
+        changed = RawCouncilQuestion.objects.filter(Q(last_parsed__gt=since) | Q(asker__last_parsed__gt=since))
+        keys = set(xx[:-1] for xx in changed.values_list('uid', flat=True))
+        agendas = RawCouncilAgenda.objects.filter(last_parsed__gt=since).values_list('uid', flat=True)
+        for date_str in set(xx.split(u'-')[1] for xx in agendas):
+            on_date = RawCouncilQuestion.objects.filter(uid__startswith=u'question-{}-'.format(date_str))
+            keys.update(xx[:-1] for xx in on_date.values_list('uid', flat=True))
+        return keys
+
+    def populate(self, dry_run=False, processes=None, since=None):
+        """
+        Creates or updates a ParsedQuestion for every English RawCouncilQuestion and its Chinese counterpart,
+        or only for the ones that changed after since.
+
+        Parsing the question files is the slow part, so the pairs are parsed in a pool of processes
+        (or in this process if processes is 1), which return plain dicts of the parsed fields.
+        The questions are then built and written here, with the meetings, people and existing
+        questions loaded up front
+        :param processes: int number of parser processes, defaults to the number of CPUs
+        """
         self._deactivate_db_debug()
         question_logger.deactivate = False
+        try:
+            return self._populate(dry_run, processes, since)
+        finally:
+            question_logger.deactivate = True
+            self._reactivate_db_debug()
+
+    def _populate(self, dry_run, processes, since):
+        start = time_module.time()
         # use English version as base, fill in Chinese info later
-        en_questions = RawCouncilQuestion.objects.filter(uid__endswith=u'e').order_by('raw_date')
-        count = 0
-        for raw_question in en_questions:
-            # Get or create, but without commit
-            obj = self.create_from_raw(raw_question)
-            if obj is not None:
-                try:
-                    obj.save()
-                    count += 1
-                except IntegrityError as e:
-                    logger.warning(u'Could not create from {}'.format(raw_question))
-                    logger.warning(e)
-        logger.info('Populated {} questions'.format(count))
-        question_logger.deactivate = True
-        self._reactivate_db_debug()
-        
+        en_questions = RawCouncilQuestion.objects.filter(uid__endswith=u'e').select_related('asker').order_by('date')
+        cn_questions = RawCouncilQuestion.objects.filter(uid__endswith=u'c').select_related('asker')
+        if since is not None:
+            keys = sorted(self._changed_question_keys(since))
+            en_questions = [xx for i in range(0, len(keys), self.BATCH_SIZE)
+                            for xx in en_questions.filter(uid__in=[k + u'e' for k in keys[i:i + self.BATCH_SIZE]])]
+            cn_questions = [xx for i in range(0, len(keys), self.BATCH_SIZE)
+                            for xx in cn_questions.filter(uid__in=[k + u'c' for k in keys[i:i + self.BATCH_SIZE]])]
+            en_questions.sort(key=lambda xx: xx.date)
+        cn_questions = dict((xx.uid, xx) for xx in cn_questions)
+        pairs = [(xx, cn_questions.get(xx.uid[:-1] + u'c')) for xx in en_questions]
+
+        parsed_fields = self._parse_pairs(pairs, processes)
+
+        meetings = dict((xx.uid, xx) for xx in ParsedCouncilMeeting.objects.all())
+        people = dict((xx.uid, xx) for xx in ParsedPerson.objects.only('id', 'uid'))
+        meeting_uids = None
+        if since is not None:
+            meeting_uids = [u'cmeeting-{}'.format(raw_en.uid.split('-')[1]) for raw_en, raw_cn in pairs]
+        existing = self._load_existing(meeting_uids, 'meeting__uid')
+        questions = OrderedDict()
+        for (raw_en, raw_cn), fields in zip(pairs, parsed_fields):
+            meeting_uid = u'cmeeting-{}'.format(raw_en.uid.split('-')[1])
+            meeting = meetings.get(meeting_uid)
+            if meeting is None:
+                # Sometimes a meeting is cancelled or delayed - in this case we can ignore this question
+                logger.warn(u'Cannot find a meeting for question:{} - required meeting uid: {}'.format(raw_en.uid, meeting_uid))
+                continue
+            uid = ParsedQuestion.generate_uid(meeting, raw_en.number, raw_en.is_urgent)
+            if uid not in questions:
+                obj = existing.pop(uid, None)
+                questions[uid] = (obj or self.model(uid=uid), None if obj is None else self._field_values(obj))
+            obj = questions[uid][0]
+            self.stamp_source(obj, raw_en, raw_cn)
+            obj.meeting = meeting
+            obj.number = raw_en.number
+            obj.urgent = raw_en.is_urgent
+            obj.question_type = ParsedQuestion.ORAL if raw_en.is_oral else ParsedQuestion.WRITTEN
+            # Sometimes the NameMatcher does not work, so try the asker of the other language
+            asker = raw_en.asker or (raw_cn.asker if raw_cn is not None else None)
+            person = people.get(asker.uid) if asker is not None else None
+            if person is not None:
+                obj.asker = person
+            else:
+                logger.warn('Cannot find asker for question {} with name "{}"'.format(raw_en.uid, raw_en.raw_asker))
+            # sometimes (rarely) the parser fails
+            if fields is not None:
+                for k, v in fields.items():
+                    setattr(obj, k, v)
+
+        return self._write(start, questions, dry_run)
+
+    def _parse_pairs(self, pairs, processes=None):
+        # Returns the parsed fields (or None) of each pair of questions, in order
+        processes = processes or multiprocessing.cpu_count()
+        if processes <= 1 or len(pairs) <= 1:
+            return [_parse_question_pair(xx) for xx in pairs]
+        # The workers only read the question files, they don't use the database connection
+        pool = multiprocessing.Pool(processes)
+        try:
+            return pool.map(_parse_question_pair, pairs, chunksize=20)
+        finally:
+            pool.close()
+            pool.join()
         
         ################ Depreciated - we parsed the Q&A from web page ##################
         """
@@ -713,6 +1129,37 @@ class QuestionManager(BaseParsedManager):
 #         self._reactivate_db_debug()
         
 
+def _parse_question_pair(pair):
+    """
+    Parses an English RawCouncilQuestion and its Chinese counterpart, and returns
+    a dict of the ParsedQuestion fields that come from the parsers, or None if either can't be parsed
+    """
+    raw_en, raw_cn = pair
+    if raw_cn is None:
+        return None
+    q_parser_en = raw_en.get_parser()
+    q_parser_cn = raw_cn.get_parser()
+    if not (q_parser_en and q_parser_cn):
+        return None
+    return {
+        # Replier(s)
+        'repliers_e': q_parser_en.repliers,
+        'repliers_c': q_parser_cn.repliers,
+        # Question subject
+        'ask_subject_e': q_parser_en.subject,
+        'ask_subject_c': q_parser_cn.subject,
+        # Reply subject
+        'reply_subject_e': q_parser_en.question_title,
+        'reply_subject_c': q_parser_cn.question_title,
+        # Question body
+        'body_e': q_parser_en.question_content,
+        'body_c': q_parser_cn.question_content,
+        # Reply body
+        'reply_e': q_parser_en.reply_content,
+        'reply_c': q_parser_cn.reply_content,
+    }
+
+
 class ParsedQuestion(TimestampMixin, BaseParsedModel):
     """
     Questions asked during LegCo meetings
@@ -754,3 +1201,164 @@ class ParsedQuestion(TimestampMixin, BaseParsedModel):
     @classmethod
     def generate_uid(cls, meeting, number, is_urgent):
         return u'{}-{}q{}'.format(meeting.uid, u'u' if is_urgent else u'', number)
+
+
+# Titles that the English hansards put before the names of the speakers, e.g. MR CHAN KAM-LAM
+SPEAKER_TITLE_RE = re.compile(r'^((THE|HON|MR|MRS|MISS|MS|DR|IR|PROF)\.? )+')
+
+
+def _speaker_member_name(speaker, language):
+    """
+    Returns the MemberName of the speaker of a hansard speech
+    """
+    speaker = speaker.strip()
+    if language == LANG_EN:
+        # The English hansards use upper case, which MemberName would take for the last name
+        speaker = u' '.join(proper(xx) for xx in SPEAKER_TITLE_RE.sub(u'', speaker).split())
+    return MemberName(speaker)
+
+
+def _parse_hansard_speeches(hansard):
+    """
+    Parses a RawCouncilHansard, and returns its speeches as a list of (section, speaker, text),
+    or None if it can't be parsed
+    """
+    parser = hansard.get_parser()
+    if parser is None:
+        return None
+    return [(section, speaker, html_to_text(speech)) for section, speaker, speech in parser.get_speeches()]
+
+
+class SpeechManager(BaseParsedManager):
+    # The fields that populate compares, to tell which speeches a hansard's new speeches changed
+    compared_fields = ['meeting', 'hansard_uid', 'date', 'section', 'order', 'speaker', 'speaker_name', 'language',
+                       'text']
+
+    def get_raw_queryset(self, since=None):
+        # Floor recordings (LANG_BOTH) can't be parsed.  The parts of a hansard share a uid ending in p-<lang>,
+        # so only the records they are merged into are parsed, along with the hansards that come in one piece.
+        # In the order they were parsed, so an interrupted populate carries on from where it stopped
+        qs = (RawCouncilHansard.objects.filter(language__in=[LANG_EN, LANG_CN])
+              .exclude(local_filename=None).exclude(local_filename='').exclude(uid__contains='p-'))
+        if since is not None:
+            qs = qs.filter(last_parsed__gt=since)
+        return qs.order_by('last_parsed', 'pk')
+
+    def populate(self, since=None, processes=None, dry_run=False):
+        """
+        Replaces the speeches of every RawCouncilHansard, or of the ones parsed after since.
+
+        Parsing the hansards is the slow part, so they are parsed in a pool of processes (or in this
+        process if processes is 1), which return the speeches as plain text.  The speakers are matched
+        to ParsedPersons here, and the speeches of each hansard are deleted and inserted again with bulk_create.
+        They are compared to the speeches they replace by uid for the counts of created, updated and unchanged.
+        The hansards that can't be parsed keep the speeches they had
+        :param processes: int number of parser processes, defaults to the number of CPUs
+        """
+        self._deactivate_db_debug()
+        start = time_module.time()
+        hansards = list(self.get_raw_queryset(since))
+        meetings = dict((xx.uid, xx) for xx in ParsedCouncilMeeting.objects.all())
+        matchers = {
+            LANG_EN: ParsedPerson.get_matcher(),
+            LANG_CN: ParsedPerson.get_matcher(english=False),
+        }
+        # The same few dozen people make most of the speeches
+        speakers = {}
+        attnames = [self.model._meta.get_field(xx).attname for xx in self.compared_fields]
+        created = updated = unchanged = removed = 0
+        for hansard, speeches in zip(hansards, self._parse_hansards(hansards, processes)):
+            if speeches is None:
+                continue
+            # Meetings that span several days only have a ParsedCouncilMeeting on the first one
+            meeting = meetings.get(u'cmeeting-{:%Y%m%d}'.format(hansard.start_date))
+            objs = []
+            for order, (section, speaker, text) in enumerate(speeches):
+                if not text:
+                    continue
+                key = (hansard.language, speaker)
+                if key not in speakers:
+                    match = matchers[hansard.language].match(_speaker_member_name(speaker, hansard.language))
+                    speakers[key] = match[1] if match is not None else None
+                obj = self.model(uid=u'{}-{}'.format(hansard.uid, order), meeting=meeting, hansard_uid=hansard.uid,
+                                 date=hansard.start_date, section=section, order=order, speaker=speakers[key],
+                                 speaker_name=speaker[:255], language=hansard.language, text=text)
+                self.stamp_source(obj, hansard)
+                objs.append(obj)
+            before = dict((xx[0], list(xx[1:])) for xx in
+                          self.filter(hansard_uid=hansard.uid).values_list('uid', *self.compared_fields))
+            for obj in objs:
+                values = before.pop(obj.uid, None)
+                if values is None:
+                    created += 1
+                elif values != [getattr(obj, xx) for xx in attnames]:
+                    updated += 1
+                else:
+                    unchanged += 1
+            removed += len(before)
+            if not dry_run:
+                with transaction.atomic():
+                    self.filter(hansard_uid=hansard.uid).delete()
+                    self.bulk_create(objs, batch_size=self.BATCH_SIZE)
+        if (created or updated or removed) and not dry_run:
+            bump_parsed_generation()
+        self._reactivate_db_debug()
+        if removed:
+            logger.info(u'Removed {} speeches that are no longer in their hansards'.format(removed))
+        return self._report(start, created, updated, unchanged)
+
+    def _parse_hansards(self, hansards, processes=None):
+        # Yields the speeches (or None) of each hansard, in order, as soon as they are parsed
+        processes = processes or multiprocessing.cpu_count()
+        if processes <= 1 or len(hansards) <= 1:
+            for hansard in hansards:
+                yield _parse_hansard_speeches(hansard)
+            return
+        # The workers only read the hansard files, they don't use the database connection
+        pool = multiprocessing.Pool(processes)
+        try:
+            for speeches in pool.imap(_parse_hansard_speeches, hansards):
+                yield speeches
+        finally:
+            pool.close()
+            pool.join()
+
+    def count_by_speaker_and_year(self):
+        """
+        Returns the number of speeches that each ParsedPerson made in each year, as a list of dicts of
+        speaker (the id of the ParsedPerson), year and count
+        """
+        year = connection.ops.date_extract_sql('year', '{}.date'.format(self.model._meta.db_table))
+        qs = self.active().exclude(speaker=None).extra(select={'year': year})
+        return list(qs.values('speaker', 'year').annotate(count=Count('id')).order_by('speaker', 'year'))
+
+
+class ParsedSpeech(TimestampMixin, BaseParsedModel):
+    """
+    A speech in a hansard, from CouncilHansard.get_speeches.  The uid is the uid of the hansard
+    and the position of the speech in it
+    """
+    meeting = models.ForeignKey(ParsedCouncilMeeting, related_name='speeches', blank=True, null=True)
+    hansard_uid = models.CharField(max_length=255, db_index=True)
+    date = models.DateField(db_index=True)
+    # The question, bill or motion the speech is about, or the section header
+    section = models.TextField(blank=True)
+    order = models.IntegerField()
+    # The member who made the speech, where the name could be matched
+    speaker = models.ForeignKey(ParsedPerson, related_name='speeches', blank=True, null=True)
+    # The name of the speaker as it appears in the hansard
+    speaker_name = models.CharField(max_length=255, blank=True)
+    language = models.IntegerField(choices=LANG_CHOICES)
+    text = models.TextField(blank=True)
+
+    objects = SpeechManager()
+    RAW_MODEL = RawCouncilHansard
+
+    class Meta:
+        app_label = 'raw'
+        ordering = ['date', 'hansard_uid', 'order']
+        # For counting the speeches of a member over time
+        index_together = [['speaker', 'date']]
+
+    def __unicode__(self):
+        return u'{} - {}'.format(self.uid, self.speaker_name)
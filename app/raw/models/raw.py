@@ -1,6 +1,8 @@
 # coding=utf-8
 import logging
 from datetime import date
+import time as time_module
+from django.core.cache import get_cache
 from django.db import models
 from django.db.models import Count
 from django.utils.encoding import force_unicode
@@ -44,10 +46,12 @@ class RawModel(models.Model):
     last_parsed = models.DateTimeField(null=True, blank=True)
     # A unique identifier for this type of item
     # We try to generate these as early as possible, but don't enforce a uniqueness constraint
-    # for flexibility
-    uid = models.CharField(max_length=100, blank=True)
+    # for flexibility.  Indexed because most lookups and the list views go by uid
+    uid = models.CharField(max_length=100, blank=True, db_index=True)
     # Page from which the Item was crawled
     crawled_from = models.TextField(blank=True)
+    # Hash of the scraped item(s) this object was last built from, so processors can skip unchanged items
+    fingerprint = models.CharField(max_length=40, blank=True)
 
     UID_PREFIX = None
     objects = RawModelManager()
@@ -86,6 +90,12 @@ class RawCouncilAgenda(RawModel):
     def full_local_filename(self):
         return utils.get_file_path(self.local_filename)
 
+    def get_source_file(self):
+        """
+        Returns the path of the html source on disk, or None
+        """
+        return utils.html_source_file(self.full_local_filename())
+
     def get_source(self):
         full_file = self.full_local_filename()
         filetype = utils.check_file_type(full_file)
@@ -137,13 +147,16 @@ class RawCouncilHansard(RawModel):
     Library DB does not tell which hansards come from a meeting that spread over a few days.
     We will use the raw_date field to match the date with agendas later (in parsed model perhaps).
     """
-    title = models.CharField(max_length=255, blank=True)
+    # The processor looks records up by title
+    title = models.CharField(max_length=255, blank=True, db_index=True)
     raw_date = models.CharField(max_length=100, blank=True)
     language = models.IntegerField(null=True, blank=True, choices=LANG_CHOICES)
     created_by_parts = models.BooleanField(default=False) #Indicates if this object is generated by merging parts of Hansard together
     url = models.URLField(blank=True)
     # Sometimes due to bandwidth/connection, file may fail to be downloaded
     local_filename = models.CharField(max_length=255, blank=True, null=True)
+    # Set on the parts of a hansard that could not be merged, so the processor tries again on its next run
+    merge_failed = models.BooleanField(default=False)
     
     UID_PREFIX = 'council_hansard'
     
@@ -153,9 +166,21 @@ class RawCouncilHansard(RawModel):
     
     def __unicode__(self):
         return u'{} - {}'.format(self.uid, self.title)
-    
+
+    @property
+    def start_date(self):
+        # council_hansard-<date: YYYYMMDD>-...
+        date_string = self.uid.split(u'-')[1]
+        return date(int(date_string[0:4]), int(date_string[4:6]), int(date_string[6:8]))
+
     def full_local_filename(self):
         return utils.get_file_path(self.local_filename)
+
+    def get_source_file(self):
+        """
+        Returns the path of the html source on disk, or None (e.g. for PDFs)
+        """
+        return utils.html_source_file(self.full_local_filename())
     
     def get_source(self):
         full_file = self.full_local_filename()
@@ -312,12 +337,39 @@ class RawMember(RawModel):
         return cls.objects.annotate(num_q=Count('raw_questions')).filter(num_q__gt=0)
 
 
+# The rendered pages of the raw documents match names against the members, so they are keyed by a generation
+# that the member processor bumps.  It is kept in the cache with the pages, which are shared between processes
+# the same way, so reading it costs no query
+MEMBERS_GENERATION_KEY = 'raw-members-generation'
+
+
+def members_generation():
+    page_cache = get_cache('raw_pages')
+    generation = page_cache.get(MEMBERS_GENERATION_KEY)
+    if generation is None:
+        # Start from the time, so a cleared cache doesn't reuse old generations
+        page_cache.add(MEMBERS_GENERATION_KEY, int(time_module.time() * 1000), None)
+        generation = page_cache.get(MEMBERS_GENERATION_KEY)
+    return generation
+
+
+def bump_members_generation():
+    page_cache = get_cache('raw_pages')
+    try:
+        page_cache.incr(MEMBERS_GENERATION_KEY)
+    except ValueError:
+        # Not set yet
+        members_generation()
+
+
 class RawCouncilQuestion(RawModel):
     """
     Storage for Members' questions, from http://www.legco.gov.hk/yr13-14/english/counmtg/question/ques1314.htm#toptbl
     """
     #format: d.m.yyyy
     raw_date = models.CharField(max_length=50, blank=True)
+    # raw_date parsed when the question is saved, for ordering and date ranges in SQL
+    date = models.DateField(null=True, blank=True, db_index=True)
     # Q. 5 <br> (Oral), for example
     number_and_type = models.CharField(max_length=255, blank=True)
     raw_asker = models.CharField(max_length=255, blank=True)
@@ -344,9 +396,13 @@ class RawCouncilQuestion(RawModel):
         else:
             return u'{}: {} on {}'.format(self.uid, force_unicode(self.asker), force_unicode(self.raw_date))
 
-    @property
-    def date(self):
-        match = re.match(self.DATE_RE, self.raw_date)
+    def save(self, *args, **kwargs):
+        self.date = self.parse_date(self.raw_date)
+        super(RawCouncilQuestion, self).save(*args, **kwargs)
+
+    @classmethod
+    def parse_date(cls, raw_date):
+        match = re.match(cls.DATE_RE, raw_date or u'')
         if match is None:
             return None
         groups = match.groupdict()
@@ -378,9 +434,10 @@ class RawCouncilQuestion(RawModel):
     def get_agenda(self):
         # Try to find the RawCouncilAgenda in which this question appears
         lang = u'e' if self.language == LANG_EN else u'c'
-        split_date = self.raw_date.split('.')
-        agenda_date = u'{}{}{}'.format(split_date[2], split_date[1].zfill(2), split_date[0].zfill(2))
-        agenda_uid = u'{}-{}-{}'.format(RawCouncilAgenda.UID_PREFIX, agenda_date, lang)
+        if self.date is None:
+            logger.warn(u'Could not find agenda for question {} without a date'.format(self.uid))
+            return None
+        agenda_uid = u'{}-{:%Y%m%d}-{}'.format(RawCouncilAgenda.UID_PREFIX, self.date, lang)
         try:
             agenda = RawCouncilAgenda.objects.get(uid=agenda_uid)
             return agenda
@@ -424,6 +481,12 @@ class RawCouncilQuestion(RawModel):
             return utils.get_file_path(self.local_filename)
         else:
             return None
+
+    def get_source_file(self):
+        """
+        Returns the path of the source on disk, which is html encoded in hkscs, or None
+        """
+        return self.full_local_filename()
     
     def get_source(self):
         full_file = self.full_local_filename()
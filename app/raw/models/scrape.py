@@ -1,3 +1,4 @@
+from datetime import datetime
 from django.db import models
 
 
@@ -51,6 +52,8 @@ class ScrapeJob(models.Model):
     raw_response = models.TextField()
     completed = models.DateTimeField(null=True, blank=True)
     last_fetched = models.DateTimeField(null=True, blank=True)
+    # The items were loaded by the DatabasePipeline while the spider was running, so process_scrape skips the job
+    loaded_while_crawling = models.BooleanField(default=False)
 
     objects = ScrapeJobManager()
 
@@ -59,3 +62,43 @@ class ScrapeJob(models.Model):
 
     class Meta:
         app_label = 'raw'
+
+
+class PipelineStepManager(models.Manager):
+    def completed_names(self, run_id):
+        return set(self.filter(run_id=run_id).exclude(completed=None).values_list('name', flat=True))
+
+    def claim(self, run_id, name):
+        """
+        Marks a step as dispatched, returning False if it had already been dispatched.
+        The update is atomic, so when two steps complete at the same time only one of them
+        gets to start a step that depends on both of them
+        """
+        return self.filter(run_id=run_id, name=name, dispatched=None).update(dispatched=datetime.now()) == 1
+
+    def claim_ready(self, run_id, graph, candidates):
+        """
+        Claims the candidate steps whose dependencies in the graph have all completed, and returns their names
+        """
+        completed = self.completed_names(run_id)
+        return [xx for xx in candidates if completed.issuperset(graph[xx]) and self.claim(run_id, xx)]
+
+
+class PipelineStep(models.Model):
+    """
+    A step in a run of raw.tasks.run_pipeline, either scraping a spider or processing its results
+    """
+    run_id = models.CharField(max_length=100)
+    name = models.CharField(max_length=100)
+    dispatched = models.DateTimeField(null=True, blank=True)
+    completed = models.DateTimeField(null=True, blank=True)
+    failed = models.DateTimeField(null=True, blank=True)
+
+    objects = PipelineStepManager()
+
+    def __unicode__(self):
+        return u"{}: {}".format(self.run_id, self.name)
+
+    class Meta:
+        app_label = 'raw'
+        unique_together = ('run_id', 'name')
@@ -0,0 +1,56 @@
+from django.db import models
+from django.dispatch import receiver
+from constants import LANG_CHOICES
+from .parsed import ParsedQuestion, ParsedSpeech, overrides_changed
+
+
+class SearchEntry(models.Model):
+    """
+    A passage of text in the search index: a speech from a hansard, or the question or reply of a ParsedQuestion.
+    The full text index over the text is kept by the database, see raw.search
+    """
+    SPEECH = 1
+    QUESTION = 2
+    REPLY = 3
+    KIND_CHOICES = (
+        (SPEECH, 'Speech'),
+        (QUESTION, 'Question'),
+        (REPLY, 'Reply'),
+    )
+    kind = models.IntegerField(choices=KIND_CHOICES)
+    # uid of the RawCouncilHansard of a speech, or of the ParsedQuestion
+    source_uid = models.CharField(max_length=255, db_index=True)
+    # Position in the source, e.g. the order of the speeches in a hansard
+    order = models.IntegerField(default=0)
+    language = models.IntegerField(choices=LANG_CHOICES)
+    date = models.DateField(null=True, blank=True, db_index=True)
+    # The question, bill or motion of a speech, or the subject of a question
+    section = models.TextField(blank=True)
+    # The name of the speaker as it appears in the source, or the asker or repliers of a question
+    speaker = models.CharField(max_length=255, blank=True)
+    text = models.TextField(blank=True)
+    # The tokens of the text separated by spaces, which the database indexes, see raw.tokenizers
+    tokens = models.TextField(blank=True)
+    # last_parsed of the raw object (or source_last_parsed of the parsed object) this was indexed from
+    source_last_parsed = models.DateTimeField(null=True, blank=True)
+    # Whether the overrides of the source changed since it was indexed, so it is indexed again
+    stale = models.BooleanField(default=False, db_index=True)
+
+    class Meta:
+        app_label = 'raw'
+        ordering = ['-date', 'source_uid', 'order']
+
+    def __unicode__(self):
+        return u'{} #{}'.format(self.source_uid, self.order)
+
+
+@receiver(overrides_changed)
+def mark_stale_entries(sender, model_name, uids, **kwargs):
+    if model_name == ParsedQuestion._meta.model_name:
+        kinds, source_uids = [SearchEntry.QUESTION, SearchEntry.REPLY], uids
+    elif model_name == ParsedSpeech._meta.model_name:
+        kinds = [SearchEntry.SPEECH]
+        source_uids = set(ParsedSpeech.objects.filter(uid__in=uids).values_list('hansard_uid', flat=True))
+    else:
+        return
+    SearchEntry.objects.filter(kind__in=kinds, source_uid__in=list(source_uids)).update(stale=True)
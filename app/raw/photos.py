@@ -0,0 +1,88 @@
+"""
+Store for the member photos served from raw/static/member_photos
+
+Photos are saved under the MD5 of their contents, the same checksum that the scraper's FilesPipeline
+records for each download.  So a photo that is already in the store is never copied again, and a stored
+file never changes, which means it can be cached forever.  Smaller versions for list pages are generated
+next to each photo when it is stored.
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+from PIL import Image
+
+
+logger = logging.getLogger('legcowatch')
+
+PHOTO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'member_photos')
+# Path of the photos relative to the static files
+PHOTO_STATIC_DIR = 'member_photos'
+# The largest width and height of each thumbnail size
+THUMBNAIL_SIZES = {
+    'small': (60, 80),
+    'medium': (120, 160),
+}
+# Photos stored before they were named by their checksum don't have thumbnails
+HASHED_NAME_RE = re.compile(r'^[0-9a-f]{32}\.jpg$')
+
+
+def file_checksum(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def thumbnail_name(name, size):
+    base, ext = os.path.splitext(name)
+    return u'{}-{}{}'.format(base, size, ext)
+
+
+def store_photo(source_path, checksum=None, photo_dir=PHOTO_DIR):
+    """
+    Adds a photo to the store, unless a photo with the same contents is already there
+    :param source_path: full path of the downloaded photo
+    :param checksum: MD5 of the photo, if already known (e.g. from the scraped item), to avoid reading it
+    :return: path of the stored photo relative to the static files, for RawMember.photo_file
+    """
+    if checksum is None or not re.match(r'^[0-9a-f]{32}$', checksum):
+        checksum = file_checksum(source_path)
+    name = u'{}.jpg'.format(checksum)
+    dest = os.path.join(photo_dir, name)
+    if not os.path.exists(dest):
+        if not os.path.exists(photo_dir):
+            os.makedirs(photo_dir)
+        # Copy under a temporary name, so there's never a partial file with the final name
+        shutil.copyfile(source_path, dest + '.tmp')
+        os.rename(dest + '.tmp', dest)
+    for size, dimensions in THUMBNAIL_SIZES.items():
+        thumbnail_path = os.path.join(photo_dir, thumbnail_name(name, size))
+        if not os.path.exists(thumbnail_path):
+            make_thumbnail(dest, thumbnail_path, dimensions)
+    return u'{}/{}'.format(PHOTO_STATIC_DIR, name)
+
+
+def make_thumbnail(source_path, dest_path, dimensions):
+    try:
+        img = Image.open(source_path)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail(dimensions, Image.ANTIALIAS)
+        img.save(dest_path, 'JPEG', quality=85)
+    except IOError as e:
+        logger.warn(u'Could not make a thumbnail of {}: {}'.format(source_path, e))
+
+
+def thumbnail_file(photo_file, size):
+    """
+    Returns the static path of a thumbnail of a stored photo.  Photos that don't have thumbnails are returned as is
+    """
+    if not photo_file:
+        return photo_file
+    directory, name = photo_file.rsplit('/', 1) if '/' in photo_file else ('', photo_file)
+    if not HASHED_NAME_RE.match(name) or size not in THUMBNAIL_SIZES:
+        return photo_file
+    return u'/'.join([xx for xx in [directory, thumbnail_name(name, size)] if xx])
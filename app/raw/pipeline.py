@@ -0,0 +1,82 @@
+"""
+Dependency graph for refreshing the raw models: scraping each spider, and processing its results.
+
+Processing a spider's results has to wait for its scrape, and for the processors it depends on in
+PROCESS_DEPENDENCIES.  Everything else can run at the same time, so raw.tasks.run_pipeline starts each
+step as soon as the steps it depends on have completed, and the whole refresh takes as long as its
+slowest chain of steps.
+"""
+from collections import OrderedDict
+from raw.processors import PROCESS_MAP, PROCESS_DEPENDENCIES
+
+
+SCRAPE = 'scrape'
+PROCESS = 'process'
+
+
+def step_name(kind, spider):
+    return u'{}:{}'.format(kind, spider)
+
+
+def parse_step_name(name):
+    """
+    Returns the (kind, spider) of a step name
+    """
+    kind, spider = name.split(u':', 1)
+    return kind, spider
+
+
+def build_graph(spiders=None, scrape=True):
+    """
+    Returns an OrderedDict mapping each step name to the list of step names it depends on
+
+    :param spiders: list of the spiders to refresh, defaults to all of the spiders in PROCESS_MAP.
+        Dependencies on processors that aren't in the list are dropped, on the basis that their
+        data is already in the database
+    :param scrape: bool whether to scrape before processing, or just process the latest scrapes
+    """
+    if spiders is None:
+        spiders = PROCESS_MAP.keys()
+    for spider in spiders:
+        if spider not in PROCESS_MAP:
+            raise RuntimeError("Invalid spider {}".format(spider))
+
+    graph = OrderedDict()
+    for spider in spiders:
+        deps = [step_name(PROCESS, xx) for xx in PROCESS_DEPENDENCIES.get(spider, []) if xx in spiders]
+        if scrape:
+            graph[step_name(SCRAPE, spider)] = []
+            deps.insert(0, step_name(SCRAPE, spider))
+        graph[step_name(PROCESS, spider)] = deps
+    # Raises if the dependencies are circular
+    topological_order(graph)
+    return graph
+
+
+def dependents(graph, name):
+    """
+    Returns the steps that directly depend on a step
+    """
+    return [k for k, v in graph.items() if name in v]
+
+
+def ready_steps(graph, completed):
+    """
+    Returns the steps that haven't completed, but whose dependencies all have
+    """
+    completed = set(completed)
+    return [k for k, v in graph.items() if k not in completed and completed.issuperset(v)]
+
+
+def topological_order(graph):
+    """
+    Returns the step names in an order in which they can be run one after the other
+    """
+    order = []
+    while len(order) < len(graph):
+        ready = ready_steps(graph, order)
+        if len(ready) == 0:
+            raise RuntimeError(u'Circular dependencies between {}'.format(
+                u', '.join([xx for xx in graph if xx not in order])))
+        order.extend(ready)
+    return order
@@ -27,11 +27,11 @@ def get_processor_for_spider(spider):
 
 
 # Use an OrderedDict because some processors require data from other processors
-# It won't cause an error to run out of order, but it'll be missing data
+# It won't cause an error to run out of order, but it'll be missing data.
+# The dependencies are listed in PROCESS_DEPENDENCIES, and this is one order that satisfies them
 PROCESS_MAP = OrderedDict([
     ('library_agenda', LibraryAgendaProcessor),
     ('library_member', LibraryMemberProcessor),
-    # The below processors should be run in this order
     ('schedule_member', ScheduleMemberProcessor),
     ('schedule_committee', ScheduleCommitteeProcessor),
     ('schedule_membership', ScheduleMembershipProcessor),#a lot of 'Could not find committee committee-dddd' warnings
@@ -44,6 +44,16 @@ PROCESS_MAP = OrderedDict([
 ])
 
 
+# The processors that need the results of other processors.  See raw.pipeline
+PROCESS_DEPENDENCIES = {
+    'schedule_membership': ['schedule_member', 'schedule_committee'],
+    'schedule_meeting_committee': ['schedule_committee'],
+    'schedule_meeting': ['schedule_meeting_committee'],
+    # Askers are matched against the RawMembers
+    'council_question': ['library_member'],
+}
+
+
 """
 Some scripts for testing
 
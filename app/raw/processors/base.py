@@ -1,36 +1,232 @@
+import gzip
+import hashlib
+import io
 import json
+import os
+
+try:
+    # Much faster than the standard library decoder, but optional
+    import ujson as fast_json
+except ImportError:
+    fast_json = json
+
+GZIP_MAGIC = '\x1f\x8b'
 
 
 class BaseProcessor(object):
     """
     Base class for processing lists of scraped Items and inserting them into the database
 
-    Subclasses should implement a process method
+    Subclasses should implement a process method.
+
+    Processors whose items can be loaded independently of each other can set shardable, and split
+    process into process_items, which handles the items in the file (or in the byte range of the file
+    given by shard), and finalize, which runs the steps that need all of the items to be loaded.
+    The items can then be loaded in parallel by several processors, one per shard of the file,
+    with their counts merged into a single processor that calls finalize.  They can also be handed
+    batches of items directly with process_batch, e.g. by the scraper's DatabasePipeline while a spider runs.
+
+    Items are read in file order within a shard, but shards run at the same time, so a record whose items
+    are in more than one shard can be created by each of them.  Shardable processors record the pk of each
+    record they save by its key with _saved, and finalize calls _remove_duplicates, which keeps the record of
+    the last of those shards, as if the file had been read in order
     """
-    def __init__(self, items_file_path, job=None):
+    # The item types this processor reads from the items file, or None to read every item
+    item_types = None
+    shardable = False
+    COUNTERS = ('items', 'created', 'updated', 'unchanged', 'merged', 'error', 'warning')
+
+    def __init__(self, items_file_path, job=None, force=False, shard=None):
         self.items_file_path = items_file_path
         self.job = job  # The ScrapeJob, if available
+        # Rewrite every object, even if the item it comes from has not changed since the last run
+        self.force = force
+        # (start, end) byte offsets of the part of the items file to process, or None for the whole file
+        self.shard = shard
+        # Items given to process_batch, read instead of the items file
+        self._batch = None
+        self._count_items = 0
         self._count_created = 0
         self._count_updated = 0
+        self._count_unchanged = 0
         self._count_merged = 0
         self._count_error = 0
         self._count_warning = 0
+        # key -> pk of the records saved by this processor, or by the last shard that saved them
+        self._saved_pks = {}
+        # pks of the records that an earlier shard also created, see merge_counts
+        self._duplicate_pks = []
 
     def process(self, *args, **kwargs):
         pass
 
+    def process_items(self):
+        raise NotImplementedError()
+
+    def finalize(self):
+        pass
+
+    def process_batch(self, items):
+        """
+        Loads a list of decoded items instead of reading them from the items file.
+        Can be called repeatedly, with finalize called after the last batch
+        """
+        self._batch = items
+        try:
+            self.process_items()
+        finally:
+            self._batch = None
+
+    def get_counts(self):
+        counts = dict((xx, getattr(self, '_count_{}'.format(xx))) for xx in self.COUNTERS)
+        counts['saved_pks'] = dict(self._saved_pks)
+        return counts
 
-def file_wrapper(fp):
+    def merge_counts(self, counts):
+        """
+        Adds the counts from another processor, e.g. one that loaded a shard of the items file.
+        Merge the shards in file order, so the records of the later shards replace those of the earlier ones
+        """
+        counts = dict(counts)
+        for key, pk in counts.pop('saved_pks', {}).items():
+            previous = self._saved_pks.get(key)
+            if previous is not None and previous != pk:
+                self._duplicate_pks.append(previous)
+            self._saved_pks[key] = pk
+        for k, v in counts.items():
+            attr = '_count_{}'.format(k)
+            setattr(self, attr, getattr(self, attr) + v)
+
+    def _items(self):
+        if self._batch is not None:
+            return [xx for xx in self._batch if self.item_types is None or xx.get('type') in self.item_types]
+        return file_wrapper(self.items_file_path, self.item_types, self.shard)
+
+    def _saved(self, key, pk):
+        self._saved_pks[key] = pk
+
+    def _remove_duplicates(self, model):
+        """
+        Deletes the records that shards running at the same time created more than once, keeping the last
+        shard's.  They are counted as created once, and updated by the later shards
+        """
+        if not self._duplicate_pks:
+            return
+        model.objects.filter(pk__in=self._duplicate_pks).delete()
+        self._count_created -= len(self._duplicate_pks)
+        self._count_updated += len(self._duplicate_pks)
+        self._duplicate_pks = []
+
+    def _is_unchanged(self, obj, fingerprint):
+        """
+        Compares an object against the fingerprint of the item it is about to be built from.
+        Existing objects (or ones already built from an earlier item in this run, saved or not) that were
+        last built from an identical item are counted as unchanged, and should be skipped by the caller.
+        Otherwise the object is counted as updated (new objects are counted when they are instantiated) and
+        stamped with the new fingerprint, ready to be saved
+        """
+        if obj.pk is not None or obj.fingerprint:
+            if obj.fingerprint == fingerprint and not self.force:
+                self._count_unchanged += 1
+                return True
+            self._count_updated += 1
+        obj.fingerprint = fingerprint
+        return False
+
+
+def item_fingerprint(item):
     """
-    Yields parsed JSON objects from a line separated JSON file
+    Returns a stable hash of the contents of a scraped item (or a list of items)
+    """
+    return hashlib.sha1(json.dumps(item, sort_keys=True)).hexdigest()
+
+
+def is_gzipped(path):
+    with open(path, 'rb') as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def open_items_file(path):
+    """
+    Opens an items file for reading, transparently decompressing gzipped feeds
+    """
+    if is_gzipped(path):
+        return io.BufferedReader(gzip.open(path, 'rb'))
+    return open(path, 'rb')
+
+
+def split_items_file(path, num_shards):
+    """
+    Splits an items file into at most num_shards (start, end) byte ranges that begin and end on line boundaries.
+    Gzipped files can't be read from an offset, so they are never split
+    """
+    if num_shards <= 1 or is_gzipped(path):
+        return [(0, None)]
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, num_shards):
+            f.seek(size * i // num_shards)
+            # Move on to the start of the next line
+            f.readline()
+            pos = f.tell()
+            if boundaries[-1] < pos < size:
+                boundaries.append(pos)
+    boundaries.append(size)
+    return zip(boundaries[:-1], boundaries[1:])
+
+
+def file_wrapper(fp, types=None, byte_range=None):
+    """
+    Yields parsed JSON objects from a line separated JSON file, which may be gzipped.
+
+    If types is given, only items of those types are yielded.  Lines are filtered with a substring
+    check on the quoted type name before they are decoded, so feeds that are mostly made up of
+    other item types (e.g. LibraryResultPage) are cheap to skip through.
+
+    byte_range is a (start, end) pair from split_items_file, to read only part of the file
     """
     if isinstance(fp, basestring):
-        with open(fp, 'rb') as fp:
-            for line in fp:
-                yield json.loads(line)
+        if byte_range is not None and byte_range != (0, None):
+            with open(fp, 'rb') as f:
+                for item in _decode_lines(_read_range(f, *byte_range), types):
+                    yield item
+        else:
+            with open_items_file(fp) as f:
+                for item in _decode_lines(f, types):
+                    yield item
     else:
-        for line in fp:
-            yield json.loads(line)
+        for item in _decode_lines(fp, types):
+            yield item
+
+
+def _read_range(f, start, end):
+    # Iterating over the file reads ahead, so use readline to keep track of the position
+    f.seek(start)
+    pos = start
+    while end is None or pos < end:
+        line = f.readline()
+        if not line:
+            break
+        pos += len(line)
+        yield line
 
 
+def _decode_lines(lines, types):
+    if types is None:
+        for line in lines:
+            yield fast_json.loads(line)
+        return
 
+    types = frozenset(types)
+    needles = ['"{}"'.format(xx) for xx in types]
+    for line in lines:
+        for needle in needles:
+            if needle in line:
+                break
+        else:
+            continue
+        item = fast_json.loads(line)
+        # The type name could have turned up elsewhere in the line, so check the decoded item too
+        if item.get('type') in types:
+            yield item
@@ -3,7 +3,7 @@ import logging
 import re
 import warnings
 from raw.models import RawCouncilAgenda, LANG_EN, LANG_CN, RawMember, GENDER_M, GENDER_F
-from raw.processors.base import BaseProcessor, file_wrapper
+from raw.processors.base import BaseProcessor, item_fingerprint
 
 
 logger = logging.getLogger('legcowatch')
@@ -13,10 +13,13 @@ class LibraryAgendaProcessor(BaseProcessor):
     """
     Class that handles the loading of Library Agenda scraped items into the RawCouncilAgenda table
     """
+    # Skip the LibraryResultPage items that make up most of the feed
+    item_types = ['LibraryAgenda']
+
     def process(self, *args, **kwargs):
         logger.info("Processing file {}".format(self.items_file_path))
         counter = 0
-        for item in file_wrapper(self.items_file_path):
+        for item in self._items():
             counter += 1
             if item['type'] == 'LibraryResultPage':
                 # Ignore these entries
@@ -25,10 +28,11 @@ class LibraryAgendaProcessor(BaseProcessor):
                 # Filter out ombudsman agendas
                 if 'Ombudsman' not in item['title_en']:
                     self._process_agenda_item(item)
-        logger.info("{} items processed, {} created, {} updated".format(counter, self._count_created, self._count_updated))
+        logger.info("{} items processed, {} created, {} updated, {} unchanged".format(counter, self._count_created, self._count_updated, self._count_unchanged))
 
     def _process_agenda_item(self, item):
         # Should generate two items, one for Chinese and one for English
+        fingerprint = item_fingerprint(item)
         uid = self._generate_base_agenda_uid(item)
         paper_number = self._get_paper_number(item)
         if len(item['links']) == 2:
@@ -55,12 +59,12 @@ class LibraryAgendaProcessor(BaseProcessor):
 
         # Try to get an existing record
         obj_en = self._get_agenda_record(uid, 'e')
-        if obj_en is not None:
+        if obj_en is not None and not self._is_unchanged(obj_en, fingerprint):
             obj_en = self._build_obj(obj_en, title_en, paper_number, LANG_EN, url_en, local_en, item)
             obj_en.save()
 
         obj_cn = self._get_agenda_record(uid, 'c')
-        if obj_cn is not None:
+        if obj_cn is not None and not self._is_unchanged(obj_cn, fingerprint):
             obj_cn = self._build_obj(obj_cn, title_cn, paper_number, LANG_CN, url_cn, local_cn, item)
             obj_cn.save()
 
@@ -86,7 +90,6 @@ class LibraryAgendaProcessor(BaseProcessor):
 
         try:
             obj = RawCouncilAgenda.objects.get(uid=uid)
-            self._count_updated += 1
         except RawCouncilAgenda.DoesNotExist:
             obj = RawCouncilAgenda(uid=uid)
             self._count_created += 1
@@ -2,11 +2,14 @@
 """
 Processor for Hansard
 """
+from collections import OrderedDict
 import logging
+import multiprocessing
+import os
 from raw.models import RawCouncilHansard, LANG_BOTH, LANG_EN, LANG_CN
-from raw.processors.base import BaseProcessor, file_wrapper
-from django.db.models import Count
+from raw.processors.base import BaseProcessor, item_fingerprint
 from django.core.exceptions import *
+from django.db import transaction
 from django.utils.timezone import now
 import warnings
 import re
@@ -21,19 +24,60 @@ class LibraryHansardProcessor(BaseProcessor):
     Class that handles the loading of Library Hansard scraped items 
     into RawCouncilHansard table
     """
+    # Skip the LibraryResultPage items that make up most of the feed
+    item_types = ['LibraryHansard']
+    shardable = True
+    # Number of processes used to merge the parts of hansards, defaults to the number of CPUs
+    merge_processes = None
+    # Don't pass huge lists of uids in a single query
+    LOOKUP_CHUNK_SIZE = 500
+    # Number of changed records to collect before writing them to the database
+    SAVE_BATCH_SIZE = 500
+
+    def __init__(self, *args, **kwargs):
+        super(LibraryHansardProcessor, self).__init__(*args, **kwargs)
+        # uids of the records saved in this run, which are the only ones whose parts may need merging
+        self._touched_uids = set()
+        # All of the records, by title.  Loaded once per run, instead of looking up every file link
+        self._hansards_by_title = None
+        # Changed records waiting to be written by _flush, by id() because unsaved model instances compare equal.
+        # In the order they were changed, so they are created in the order of the file
+        self._pending = OrderedDict()
+
+    def get_counts(self):
+        counts = super(LibraryHansardProcessor, self).get_counts()
+        counts['touched_uids'] = sorted(self._touched_uids)
+        return counts
+
+    def merge_counts(self, counts):
+        counts = dict(counts)
+        self._touched_uids.update(counts.pop('touched_uids', []))
+        super(LibraryHansardProcessor, self).merge_counts(counts)
+
     def process(self, *args, **kwargs):
-        logger.info("Processing file {}".format(self.items_file_path))
-        counter = 0
-        for item in file_wrapper(self.items_file_path):
-            counter += 1
+        self.process_items()
+        self.finalize()
+
+    def process_items(self):
+        logger.info("Processing file {} {}".format(self.items_file_path, self.shard or ''))
+        if self._hansards_by_title is None:
+            self._hansards_by_title = dict((xx.title, xx) for xx in RawCouncilHansard.objects.all())
+        for item in self._items():
+            self._count_items += 1
             if item['type'] == 'LibraryResultPage':
                 # Ignore these entries
                 continue
             if item['type'] == 'LibraryHansard':
                 self._process_hansard_item(item)
+                if len(self._pending) >= self.SAVE_BATCH_SIZE:
+                    self._flush()
+        self._flush()
+
+    def finalize(self):
         # After all downloaded hansards are created/updated, merge the ones that are parts of a hansard.
+        self._remove_duplicates(RawCouncilHansard)
         self._merge_parts()
-        logger.info("{} (raw) items processed, {} created, {} updated, {} warnings".format(counter, self._count_created, self._count_updated, self._count_warning))
+        logger.info("{} (raw) items processed, {} created, {} updated, {} unchanged, {} warnings".format(self._count_items, self._count_created, self._count_updated, self._count_unchanged, self._count_warning))
         logger.info("{} merged items created/updated.".format(self._count_merged))
         
     def _process_hansard_item(self, item):
@@ -44,6 +88,8 @@ class LibraryHansardProcessor(BaseProcessor):
         # Old harsards are bilingual (2 files), without floor version. 
         # Floor version seems to exist since 1995.10.12
         
+        # Every file in the item is stamped with the fingerprint of the whole item
+        fingerprint = item_fingerprint(item)
         # Loop over files in an item
         #print(u"Processing item: {}".format(item['title_en']))
         for i in range(len(item['links'])):
@@ -108,72 +154,107 @@ class LibraryHansardProcessor(BaseProcessor):
             obj = self._get_or_create_hansard_record_by_title(title,uid)
             #if obj is not None:
             # at the moment we do not deal with floor recordings
-            if obj is not None and language!=LANG_BOTH:
+            if obj is not None and language!=LANG_BOTH and not self._is_unchanged(obj, fingerprint):
                 obj = self._build_obj(obj, title, date_str, language, url, local_filename, item)
-                obj.save()
+                self._pending[id(obj)] = obj
+                self._touched_uids.add(obj.uid)
             #End of for loop
         
         
     def _merge_parts(self):
         # Search for non-unique UIDs, merge their DOCXs into one HTML file, and make a new object for it.
         ## Remember to set the field CREATED_BY_PARTS to True
-        # Get the list of duplicate UIDs
-        dup_hansard_uid = RawCouncilHansard.objects.values('uid').annotate(uid_count=Count('uid')).exclude(uid_count=1)
-        for item in dup_hansard_uid:
+        # Only the UIDs of records saved in this run can have parts that changed, along with the parts
+        # whose merge failed on an earlier run.  Parts are loaded in uid order, then in the order they were first created
+        uids = self._touched_uids.union(
+            RawCouncilHansard.objects.filter(merge_failed=True).values_list('uid', flat=True))
+        parts_by_uid = OrderedDict()
+        for han in self._chunked_filter(sorted(uids), order_by=('uid', 'pk')):
+            parts_by_uid.setdefault(han.uid, []).append(han)
+        dup_hansard_uid = [k for k, v in parts_by_uid.items() if len(v) > 1]
+        if not dup_hansard_uid:
+            return
+
+        normal_hans = {}
+        for han in self._chunked_filter(sorted(set([xx.replace('p', '') for xx in dup_hansard_uid]))):
+            normal_hans.setdefault(han.uid, []).append(han)
+
+        merges = []
+        for uid in dup_hansard_uid:
             # Firstly, check if we need to merge docs. Sometimes the parts are just appendices,
             # which we will ignore. In this case, there should be a normal UID for this object (without 'p').
-            normal_uid = item['uid'].replace('p','')
-            try:
-                normal_han = RawCouncilHansard.objects.get(uid=normal_uid)
-                #print normal_han
-                if normal_han.created_by_parts is False:
-                    # The parts are appendices. Do not process them.
-                    # if this condition is not matched, the program will continue, as we will update the old object
-                    continue
-            except MultipleObjectsReturned:
-                # Usually there should be no MultipleObjectsReturned exception.
+            normal_uid = uid.replace('p','')
+            normal_han = normal_hans.get(normal_uid, [])
+            if len(normal_han) > 1:
+                # Usually there should be no multiple objects.
                 # This is for a very special case on 2012.06.14
                 continue
-            except ObjectDoesNotExist:
-                # We need to create a new object
-                pass
+            if normal_han and normal_han[0].created_by_parts is False:
+                # The parts are appendices. Do not process them.
+                # if this condition is not matched, the program will continue, as we will update the old object
+                continue
 
-            self._count_merged += 1
-            print(u'Merging Hansard Parts {}'.format(normal_uid))
-            # We have to either create/update the Hansard
-            # get a list of hansard objects
-            han_part = RawCouncilHansard.objects.filter(uid=item['uid']).order_by('uid') #very weird, order by uid works but title does not
-            # get their full local filepaths
-            path_list = []
-            for han in han_part:
-                path_list.append(han.full_local_filename())
+            han_part = parts_by_uid[uid]
             # Make a name for output path, and create a full absolute path for saving
             html_name = han_part[0].uid + '-merge'
             out_htmlpath = han_part[0].full_local_filename().rsplit('/',1)[0] + '/' + html_name
-            # Also make a relative path in same format as other normal objects
-            local_filepath = '/'.join(out_htmlpath.rsplit('/',2)[1:])
-            # Pass the list to merger, and let it write out a file
-            html_str_or_None = utils.merge_docx(docx_list=path_list, out_htmlpath=out_htmlpath)
+            # The merged record keeps a fingerprint of the parts it was made from, in the same field
+            # that the other records use for the fingerprint of their item
+            manifest = item_fingerprint([[han.title, han.local_filename, han.fingerprint] for han in han_part])
+            obj = normal_han[0] if normal_han else RawCouncilHansard(uid=normal_uid)
+            if obj.fingerprint == manifest and os.path.exists(out_htmlpath) and not self.force:
+                continue
+            merges.append((obj, han_part, out_htmlpath, manifest))
+
+        # Converting the DOC/DOCXs is the slow part, so do that in parallel and save the results here
+        merged = self._run_merges([([han.full_local_filename() for han in xx[1]], xx[2]) for xx in merges])
+        for (obj, han_part, out_htmlpath, manifest), success in zip(merges, merged):
             # Sometimes the DOC/DOCX to HTML conversion fails.
             # In this case, we cannot parse the hansard anyway, so we leave the parts as is.
-            if html_str_or_None is None:
-                print(u'DOC/DOCX to HTML conversion failed for Hansard parts {}'.format(normal_uid))
+            if not success:
+                print(u'DOC/DOCX to HTML conversion failed for Hansard parts {}'.format(obj.uid))
+                RawCouncilHansard.objects.filter(pk__in=[han.pk for han in han_part]).update(merge_failed=True)
+                continue
+            RawCouncilHansard.objects.filter(pk__in=[han.pk for han in han_part], merge_failed=True).update(
+                merge_failed=False)
+            self._count_merged += 1
+            print(u'Merged Hansard Parts {}'.format(obj.uid))
+            # Also make a relative path in same format as other normal objects
+            local_filepath = '/'.join(out_htmlpath.rsplit('/',2)[1:])
+            obj.raw_date = han_part[0].raw_date
+            obj.language = han_part[0].language
+            obj.url = ''
+            obj.local_filename = local_filepath
+            obj.crawled_from = ''
+            obj.last_parsed = now()
+            if han_part[0].language == LANG_CN:
+                obj.title = 'H'+ han_part[0].raw_date+' '+u'(中文版)'+u'MERGE'
             else:
-                # Get/Create an object for merged file
-                obj,_ = RawCouncilHansard.objects.get_or_create(uid=normal_uid)
-                obj.raw_date = han_part[0].raw_date
-                obj.language = han_part[0].language
-                obj.url = ''
-                obj.local_filename = local_filepath
-                obj.crawled_from = ''
-                obj.last_parsed = now()
-                if han_part[0].language == LANG_CN:
-                    obj.title = 'H'+ han_part[0].raw_date+' '+u'(中文版)'+u'MERGE'
-                else:
-                    obj.title = 'H'+ han_part[0].raw_date+' '+u'(English Version)'+u'MERGE'
-                # Do not forget this
-                obj.created_by_parts = True
-                obj.save()
+                obj.title = 'H'+ han_part[0].raw_date+' '+u'(English Version)'+u'MERGE'
+            # Do not forget this
+            obj.created_by_parts = True
+            obj.fingerprint = manifest
+            obj.save()
+
+    def _chunked_filter(self, uids, order_by=('pk',)):
+        for i in range(0, len(uids), self.LOOKUP_CHUNK_SIZE):
+            for han in RawCouncilHansard.objects.filter(uid__in=uids[i:i + self.LOOKUP_CHUNK_SIZE]).order_by(*order_by):
+                yield han
+
+    def _run_merges(self, merge_args):
+        """
+        Merges each list of part files into its output path.  Returns a list of bools for whether each merge worked
+        """
+        # Celery's worker processes are daemonic, and can't start processes of their own
+        if len(merge_args) <= 1 or multiprocessing.current_process().daemon:
+            return [_merge_docx_args(xx) for xx in merge_args]
+        # The workers don't touch the database, they just convert files
+        pool = multiprocessing.Pool(min(self.merge_processes or multiprocessing.cpu_count(), len(merge_args)))
+        try:
+            return pool.map(_merge_docx_args, merge_args)
+        finally:
+            pool.close()
+            pool.join()
 
     def _build_obj(self, obj, title, raw_date, language, url, local_file, item):
         obj.title = title
@@ -191,7 +272,6 @@ class LibraryHansardProcessor(BaseProcessor):
     def _get_or_create_hansard_record_by_uid(self, uid):
         try:
             obj = RawCouncilHansard.objects.get(uid=uid)
-            self._count_updated += 1
         except RawCouncilHansard.DoesNotExist:
             obj = RawCouncilHansard(uid=uid)
             self._count_created += 1
@@ -202,13 +282,35 @@ class LibraryHansardProcessor(BaseProcessor):
 
 
     def _get_or_create_hansard_record_by_title(self,title,uid):
-        try:
-            obj = RawCouncilHansard.objects.get(title=title)
-            self._count_updated += 1
-        except RawCouncilHansard.DoesNotExist:
+        obj = self._hansards_by_title.get(title, None)
+        if obj is None:
             obj = RawCouncilHansard(title=title,uid=uid)
             self._count_created += 1
+            self._hansards_by_title[title] = obj
         return obj
+
+    def _flush(self):
+        """
+        Writes the pending records, inserting the new ones in bulk
+        """
+        if not self._pending:
+            return
+        new_objs = [xx for xx in self._pending.values() if xx.pk is None]
+        with transaction.atomic():
+            for obj in self._pending.values():
+                if obj.pk is not None:
+                    obj.save()
+            RawCouncilHansard.objects.bulk_create(new_objs)
+        if new_objs:
+            # bulk_create doesn't set the primary keys, and the records may come up again later in the run.
+            # The newest record of a title is this one, if a shard running at the same time also created it
+            titles = [xx.title for xx in new_objs]
+            pks = dict(RawCouncilHansard.objects.filter(title__in=titles).order_by('pk').values_list('title', 'pk'))
+            for obj in new_objs:
+                obj.pk = pks.get(obj.title)
+        for obj in self._pending.values():
+            self._saved(obj.title, obj.pk)
+        self._pending = OrderedDict()
     
     
     def _get_local_filename(self, link, item):
@@ -275,4 +377,10 @@ class LibraryHansardProcessor(BaseProcessor):
         """
         # Some rare cases the title e.g. H20070430 xxxxx is not in format,
         # so we get date from long title.
-        return item['title_en'][-11:].replace('.', '')
\ No newline at end of file
+        return item['title_en'][-11:].replace('.', '')
+
+
+def _merge_docx_args(args):
+    # Pool.map only passes a single argument.  Don't send the whole merged HTML back to the parent process
+    path_list, out_htmlpath = args
+    return utils.merge_docx(docx_list=path_list, out_htmlpath=out_htmlpath) is not None
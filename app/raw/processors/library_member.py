@@ -1,15 +1,14 @@
+from collections import OrderedDict
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.timezone import now
 import json
 import logging
-import os
 import re
-import shutil
 import warnings
-from raw.models import RawCouncilAgenda, LANG_EN, LANG_CN, RawMember, GENDER_M, GENDER_F
-from raw import utils
-from raw.processors.base import BaseProcessor, file_wrapper
+from raw.models import RawCouncilAgenda, LANG_EN, LANG_CN, RawMember, GENDER_M, GENDER_F, bump_members_generation
+from raw import photos, utils
+from raw.processors.base import BaseProcessor, item_fingerprint
 
 
 logger = logging.getLogger('legcowatch')
@@ -25,18 +24,34 @@ class LibraryMemberProcessor(BaseProcessor):
     def process(self, *args, **kwargs):
         logger.info("Processing file {}".format(self.items_file_path))
         counter = 0
-        for item in file_wrapper(self.items_file_path):
+        # Both language items of a member go into the same RawMember, so gather them
+        # before checking whether the member has changed.  The feed is only a few hundred items.
+        items_by_uid = OrderedDict()
+        for item in self._items():
             counter += 1
-            self._process_member(item)
-        logger.info("{} items processed, {} created, {} updated".format(counter, self._count_created, self._count_updated))
+            items_by_uid.setdefault(self._generate_uid(item), []).append(item)
+        for uid, items in items_by_uid.items():
+            self._process_member_items(uid, items)
+        if self._count_created or self._count_updated:
+            # The cached raw document pages match names against the members
+            bump_members_generation()
+        logger.info("{} items processed, {} created, {} updated, {} unchanged".format(counter, self._count_created, self._count_updated, self._count_unchanged))
 
-    def _process_member(self, item):
-        uid = self._generate_uid(item)
+    def _process_member_items(self, uid, items):
         obj = self._get_member_object(uid)
         if obj is None:
-            logger.warn(u'Could not process member item: {}'.format(item))
+            logger.warn(u'Could not process member items: {}'.format(items))
+            return
+        fingerprint = item_fingerprint(sorted(items, key=lambda xx: xx[u'language']))
+        if self._is_unchanged(obj, fingerprint):
             return
         obj.last_parsed = now()
+        for item in items:
+            self._process_member(item, obj)
+        obj.save()
+
+    def _process_member(self, item, obj):
+        uid = obj.uid
 
         lang = item[u'language']
         if lang == 'e':
@@ -50,23 +65,14 @@ class LibraryMemberProcessor(BaseProcessor):
                 obj.gender = GENDER_M
             else:
                 obj.gender = GENDER_F
-            # Copy and rename the photo to the app
-            # Unless it is the generic photo
+            # Add the photo to the photo store, unless it is the generic photo
             if 'photo.jpg' not in item[u'files'][0][u'url']:
                 try:
                     source_photo_path = utils.get_file_path(item[u'files'][0][u'path'])
-                    new_photo_path = 'member_photos/{}.jpg'.format(uid)
-                    new_photo_abspath = os.path.abspath(os.path.join('.', 'raw', 'static', 'member_photos', '{}.jpg'.format(uid)))
-                    # This should be moved up in the process, since we don't need to check if the directory exsts
-                    # for each photo
-                    if not os.path.exists(os.path.dirname(new_photo_abspath)):
-                        os.makedirs(os.path.dirname(new_photo_abspath))
-                    if not os.path.exists(new_photo_abspath) and os.path.exists(source_photo_path):
-                        shutil.copyfile(source_photo_path, new_photo_abspath)
-                    obj.photo_file = new_photo_path
-                except RuntimeError:
+                    obj.photo_file = photos.store_photo(source_photo_path, item[u'files'][0].get(u'checksum'))
+                except (RuntimeError, IOError):
                     # Photo didn't download for some reason
-                    logger.warn(u'Photo for {} did not download properly to path'.format(uid, item[u'files'][0][u'path']))
+                    logger.warn(u'Photo for {} did not download properly to path {}'.format(uid, item[u'files'][0][u'path']))
             else:
                 # Clear old photos
                 obj.photo_file = ''
@@ -94,12 +100,9 @@ class LibraryMemberProcessor(BaseProcessor):
             if val is not None:
                 setattr(obj, target, json.dumps(val))
 
-        obj.save()
-
     def _get_member_object(self, uid):
         try:
             obj = RawMember.objects.get(uid=uid)
-            self._count_updated += 1
         except RawMember.DoesNotExist:
             obj = RawMember(uid=uid)
             self._count_created += 1
@@ -7,7 +7,7 @@ from urlparse import urljoin
 import re
 from raw.models import RawCouncilQuestion, LANG_EN, LANG_CN, RawMember
 from raw.names import MemberName
-from raw.processors.base import BaseProcessor, file_wrapper
+from raw.processors.base import BaseProcessor, item_fingerprint
 from django.utils.timezone import now
 
 
@@ -15,9 +15,14 @@ logger = logging.getLogger('legcowatch')
 
 
 class QuestionProcessor(BaseProcessor):
+    shardable = True
+
     def process(self):
-        logger.info("Processing file {}".format(self.items_file_path))
-        counter = 0
+        self.process_items()
+        self.finalize()
+
+    def process_items(self):
+        logger.info("Processing file {} {}".format(self.items_file_path, self.shard or ''))
         # keys are fields in the jsonlines item, values are the fields in the model object
         field_map = {
             'asker': 'raw_asker',
@@ -29,18 +34,20 @@ class QuestionProcessor(BaseProcessor):
         }
         matcher_en = RawMember.get_matcher()
         matcher_cn = RawMember.get_matcher(False)
-        for item in file_wrapper(self.items_file_path):
+        for item in self._items():
             try:
-                counter += 1
+                self._count_items += 1
                 # For each question, fill in the raw values, then try to match against a RawMember instance
 
                 # Generate a uid and get the object
                 uid = self._generate_uid(item)
-                obj, created = RawCouncilQuestion.objects.get_or_create(uid=uid)
-                if created:
+                try:
+                    obj = RawCouncilQuestion.objects.get(uid=uid)
+                except RawCouncilQuestion.DoesNotExist:
+                    obj = RawCouncilQuestion(uid=uid)
                     self._count_created += 1
-                else:
-                    self._count_updated += 1
+                if self._is_unchanged(obj, item_fingerprint(item)):
+                    continue
 
                 # Fill in the last parsed and last crawled values
                 if self.job is not None:
@@ -105,16 +112,20 @@ class QuestionProcessor(BaseProcessor):
                 # In these cases, forget about them.
                 if obj.local_filename is not None:
                     obj.save()
+                    self._saved(uid, obj.pk)
                 
             except (KeyError, RuntimeError) as e:
                 self._count_error += 1
                 logger.warn(u'Could not process question {} from date {}'.format(item['number_and_type'], item['date']))
                 logger.warn(unicode(e))
                 continue
+
+    def finalize(self):
+        self._remove_duplicates(RawCouncilQuestion)
         #After saving all items, use parser to fix missing askers
         no_asker_list = RawCouncilQuestion.fix_asker_by_parser()
         
-        logger.info(u"{} items processed, {} created, {} updated, {} errors, {} questions without asker".format(counter, self._count_created, self._count_updated, self._count_error, len(no_asker_list)))
+        logger.info(u"{} items processed, {} created, {} updated, {} unchanged, {} errors, {} questions without asker".format(self._count_items, self._count_created, self._count_updated, self._count_unchanged, self._count_error, len(no_asker_list)))
         #for debugging
         print(no_asker_list)
         
@@ -4,7 +4,7 @@ import logging
 import warnings
 
 from raw.models import RawScheduleMember, RawCommittee, RawCommitteeMembership, RawMeetingCommittee, RawMeeting
-from raw.processors.base import BaseProcessor, file_wrapper
+from raw.processors.base import BaseProcessor, item_fingerprint
 
 
 logger = logging.getLogger('legcowatch')
@@ -13,14 +13,17 @@ logger = logging.getLogger('legcowatch')
 class BaseScheduleProcessor(BaseProcessor):
     # Doing some refactoring, but don't want to affect other processors
     model = None
+    # Skip items that have not changed since the object was last built from them.
+    # Turn this off for models whose objects are built from more than one item
+    fingerprint_items = True
 
     def process(self, *args, **kwargs):
         logger.info("Processing file {}".format(self.items_file_path))
         counter = 0
-        for item in file_wrapper(self.items_file_path):
+        for item in self._items():
             counter += 1
             self._process_item_wrapper(item)
-        logger.info("{} items processed, {} created, {} updated, {} errors".format(counter, self._count_created, self._count_updated, self._count_error))
+        logger.info("{} items processed, {} created, {} updated, {} unchanged, {} errors".format(counter, self._count_created, self._count_updated, self._count_unchanged, self._count_error))
 
     def _process_item(self, item, obj):
         raise NotImplementedError()
@@ -32,6 +35,11 @@ class BaseScheduleProcessor(BaseProcessor):
             logger.warn(u'Could not process member item: {}'.format(item))
             self._count_error += 1
             return
+        if self.fingerprint_items:
+            if self._is_unchanged(obj, item_fingerprint(item)):
+                return
+        elif obj.pk is not None:
+            self._count_updated += 1
         obj.last_parsed = datetime.now()
         if self.job is not None:
             obj.last_crawled = self.job.completed
@@ -40,7 +48,6 @@ class BaseScheduleProcessor(BaseProcessor):
     def _get_object(self, uid):
         try:
             obj = self.model.objects.get(uid=uid)
-            self._count_updated += 1
         except self.model.DoesNotExist:
             obj = self.model(uid=uid)
             self._count_created += 1
@@ -95,6 +102,8 @@ class ScheduleMeetingCommitteeProcessor(BaseScheduleProcessor):
         except RawCommittee.DoesNotExist:
             logger.warn('Could not find committee {}'.format(cuid))
             committee = None
+            # Look for the committee again on the next run
+            obj.fingerprint = ''
         obj.committee = committee
         obj.save()
 
@@ -146,6 +155,9 @@ class ScheduleMembershipProcessor(BaseScheduleProcessor):
             logger.warn('Could not find committee {}'.format(cuid))
             committee = None
         obj.committee = committee
+        if member is None or committee is None:
+            # Look for the member and committee again on the next run
+            obj.fingerprint = ''
         obj.save()
 
     def _generate_uid(self, item):
@@ -154,6 +166,8 @@ class ScheduleMembershipProcessor(BaseScheduleProcessor):
 
 class ScheduleMeetingProcessor(BaseScheduleProcessor):
     model = RawMeeting
+    # A meeting has one item per slot, so one item's fingerprint can't tell if the meeting changed
+    fingerprint_items = False
 
     def _process_item(self, item, obj):
         fields = [
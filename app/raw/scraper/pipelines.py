@@ -0,0 +1,100 @@
+"""
+Item pipelines for the legco spiders
+"""
+from datetime import datetime
+import json
+from scrapy import log
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.serialize import ScrapyJSONEncoder
+from twisted.internet import task
+
+
+class DatabasePipeline(object):
+    """
+    Loads items into the Raw models while the spider is running, instead of waiting for
+    process_scrape to read the feed once the crawl has finished.
+
+    Items are passed to the spider's processor in batches, every DATABASE_PIPELINE_BATCH_SIZE items
+    or every DATABASE_PIPELINE_FLUSH_INTERVAL seconds, whichever comes first.  Only processors
+    that can load their items independently of each other (see BaseProcessor.shardable) are supported,
+    the other spiders are left to process_scrape.  The feed is still written as a record of the crawl.
+
+    When the spider closes the processor is finalized and the ScrapeJob marked as loaded while crawling,
+    unless a batch failed, in which case process_scrape will load the whole feed as usual.
+    """
+    def __init__(self, batch_size, flush_interval, feed_uri):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.feed_uri = feed_uri
+        self.encoder = ScrapyJSONEncoder()
+        self.processor = None
+        self.job_id = None
+        self.batch = []
+        self.failed = False
+        self.loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DATABASE_PIPELINE_ENABLED'):
+            raise NotConfigured
+        return cls(
+            settings.getint('DATABASE_PIPELINE_BATCH_SIZE'),
+            settings.getfloat('DATABASE_PIPELINE_FLUSH_INTERVAL'),
+            settings.get('FEED_URI')
+        )
+
+    def open_spider(self, spider):
+        # The scraper doesn't otherwise need Django, so only import the models once enabled
+        from raw import processors
+        from raw.models import ScrapeJob
+
+        processor_class = processors.PROCESS_MAP.get(spider.name, None)
+        if processor_class is None or not processor_class.shardable:
+            log.msg('No batch processor for spider {}, leaving the feed to process_scrape'.format(spider.name),
+                    level=log.INFO, spider=spider)
+            return
+        # do_scrape creates the ScrapeJob before starting the crawl
+        job = ScrapeJob.objects.filter(spider=spider.name, raw_response=self.feed_uri).order_by('-scheduled').first()
+        if job is not None:
+            self.job_id = job.id
+        self.processor = processor_class(self.feed_uri, job)
+        self.loop = task.LoopingCall(self.flush)
+        self.loop.start(self.flush_interval, now=False)
+
+    def process_item(self, item, spider):
+        if self.processor is not None:
+            # Round trip through JSON, so the processor sees the item exactly as it is written to the feed
+            self.batch.append(json.loads(self.encoder.encode(dict(item))))
+            if len(self.batch) >= self.batch_size:
+                self.flush()
+        return item
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        if self.processor.job is not None:
+            # The job isn't completed yet, but these items were crawled just now.  Not saved
+            self.processor.job.completed = datetime.now()
+        try:
+            self.processor.process_batch(batch)
+        except Exception as e:
+            # Carry on crawling, the items are still in the feed
+            self.failed = True
+            log.msg(u'Could not load a batch of {} items: {}'.format(len(batch), e), level=log.ERROR)
+
+    def close_spider(self, spider):
+        if self.processor is None:
+            return
+        from raw.models import ScrapeJob
+
+        if self.loop.running:
+            self.loop.stop()
+        self.flush()
+        if self.failed:
+            log.msg('Some items could not be loaded, the feed needs to be processed', level=log.WARNING, spider=spider)
+            return
+        self.processor.finalize()
+        if self.job_id is not None:
+            ScrapeJob.objects.filter(id=self.job_id).update(last_fetched=datetime.now(), loaded_while_crawling=True)
@@ -20,8 +20,17 @@ USER_AGENT = 'legcoscraper (+http://odhk.github.io/)'
 # https://groups.google.com/forum/print/msg/scrapy-users/kzGHFjXywuY/O6PIhoT3thsJ
 ITEM_PIPELINES = [
     'scrapy.contrib.pipeline.files.FilesPipeline',
+    # Must come after the FilesPipeline, so the processors see the downloaded files
+    'raw.scraper.pipelines.DatabasePipeline',
 ]
 
+# Load items into the database while the spider runs, for spiders whose processors support it.
+# The items are still written to the feed, and the ScrapeJob is marked as processed when the spider closes
+DATABASE_PIPELINE_ENABLED = False
+DATABASE_PIPELINE_BATCH_SIZE = 100
+# Seconds between loading whatever items have arrived, even if the batch isn't full
+DATABASE_PIPELINE_FLUSH_INTERVAL = 5
+
 DATA_DIR_BASE = './legco-data' #original path
 #DATA_DIR_BASE = '/home/long/Desktop/legco-watch'
 FILES_STORE = os.path.join(DATA_DIR_BASE, 'files')
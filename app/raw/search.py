@@ -0,0 +1,307 @@
+"""
+Full text search over the hansard speeches and the parsed questions and replies
+
+The passages are copied into SearchEntry rows, one per speech, question or reply, along with the
+tokens of their text (see raw.tokenizers), and the database keeps the full text index over the tokens:
+
+- On Postgres, a GIN index over to_tsvector(tokens), which queries use through the same expression
+- On SQLite, an FTS5 table that has the entries as its external content, kept in sync by triggers
+- Elsewhere, queries fall back to scanning the text with LIKE
+
+Queries are split by the same tokenizer, so Chinese is matched by its bigrams (or by its characters, for
+a single character), like English by its words.
+
+update_index only indexes what changed since the entries were last updated, by the source_last_parsed
+of the ParsedSpeeches and ParsedQuestions, along with the sources whose overrides changed (their entries
+are marked stale when the overrides are saved or deleted) or that have no entries yet, e.g. reactivated
+ones.  It removes the entries of the sources that are no longer active.  raw2parsed runs it once it has
+populated the parsed models, so the index is brought up to date after each parse.
+"""
+import logging
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from raw.export import iter_objects
+from raw.models import Override, ParsedQuestion, ParsedSpeech, SearchEntry, LANG_CN, LANG_EN
+from raw.tokenizers import get_tokenizer
+from raw.utils import grouper, html_to_text
+
+
+logger = logging.getLogger('legcowatch')
+
+# Put around the matches in snippets, and turned into <mark> once the rest of the snippet is escaped
+MATCH_START = u'\ue000'
+MATCH_END = u'\ue001'
+BATCH_SIZE = 500
+TABLE = SearchEntry._meta.db_table
+
+
+class LikeSearchBackend(object):
+    """
+    Scans the text of every entry, for databases without a full text index
+    """
+    def install(self, cursor):
+        pass
+
+    def search(self, qs, query, phrases, limit):
+        for word in query.split():
+            qs = qs.filter(text__icontains=word)
+        return list(qs[:limit])
+
+
+class PostgresSearchBackend(object):
+    # The tokens are already split, lowercased and not stemmed
+    config = 'simple'
+    index_name = '{}_tokens_gin'.format(TABLE)
+
+    def install(self, cursor):
+        cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s', [self.index_name])
+        if cursor.fetchone() is None:
+            cursor.execute("CREATE INDEX {} ON {} USING gin (to_tsvector('{}', tokens))".format(
+                self.index_name, TABLE, self.config))
+
+    def search(self, qs, query, phrases, limit):
+        # Same expression as the index.  Every token has to match, though not necessarily next to each other
+        where = "to_tsvector('{}', {}.tokens) @@ plainto_tsquery('{}', %s)".format(self.config, TABLE, self.config)
+        tokens = u' '.join([token for phrase in phrases for token in phrase])
+        return list(qs.extra(where=[where], params=[tokens])[:limit])
+
+
+class SqliteSearchBackend(object):
+    fts_table = '{}_fts'.format(TABLE)
+
+    def install(self, cursor):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [self.fts_table])
+        if cursor.fetchone() is not None:
+            return
+        # The tokens are separated by spaces, which is all the default tokenizer needs
+        cursor.execute("CREATE VIRTUAL TABLE {fts} USING fts5(tokens, content='{table}', content_rowid='id')".format(
+            fts=self.fts_table, table=TABLE))
+        # From the SQLite documentation on external content tables
+        cursor.execute("CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+                       "INSERT INTO {fts}(rowid, tokens) VALUES (new.id, new.tokens); END".format(fts=self.fts_table,
+                                                                                                  table=TABLE))
+        cursor.execute("CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+                       "INSERT INTO {fts}({fts}, rowid, tokens) VALUES ('delete', old.id, old.tokens); END".format(
+                           fts=self.fts_table, table=TABLE))
+        cursor.execute("CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+                       "INSERT INTO {fts}({fts}, rowid, tokens) VALUES ('delete', old.id, old.tokens); "
+                       "INSERT INTO {fts}(rowid, tokens) VALUES (new.id, new.tokens); END".format(fts=self.fts_table,
+                                                                                                  table=TABLE))
+        # Index the entries that are already there
+        cursor.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=self.fts_table))
+
+    def search(self, qs, query, phrases, limit):
+        # Each phrase is quoted, so its tokens have to be next to each other, and the query is never read as FTS5 syntax
+        match = u' '.join([u'"{}"'.format(u' '.join(phrase).replace(u'"', u'""')) for phrase in phrases])
+        qs = qs.extra(
+            tables=[self.fts_table],
+            where=['{}.rowid = {}.id'.format(self.fts_table, TABLE), '{} MATCH %s'.format(self.fts_table)],
+            params=[match])
+        return list(qs[:limit])
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor, LikeSearchBackend)()
+
+
+def install():
+    """
+    Creates the full text index, if it doesn't exist yet
+    """
+    get_backend().install(connection.cursor())
+
+
+def search(query, kind=None, language=None, limit=20):
+    """
+    Returns the entries that match all of the words of a query, newest first.  Each has a snippet of
+    its text around the matches, with the matches between MATCH_START and MATCH_END, see highlight
+    """
+    qs = SearchEntry.objects.all()
+    if kind is not None:
+        qs = qs.filter(kind=kind)
+    if language is not None:
+        qs = qs.filter(language=language)
+    phrases = get_tokenizer().tokenize_query(query)
+    if not phrases:
+        return []
+    backend = get_backend()
+    # Cheap once the index exists
+    backend.install(connection.cursor())
+    entries = backend.search(qs, query, phrases, limit)
+    words = query.split()
+    for entry in entries:
+        entry.snippet = make_snippet(entry.text, words)
+    return entries
+
+
+def make_snippet(text, words):
+    # The text around the first match.  Made here rather than by the database, which only sees the tokens
+    lower = text.lower()
+    positions = [lower.find(xx.lower()) for xx in words]
+    positions = [xx for xx in positions if xx >= 0]
+    start = max(min(positions) - 60, 0) if positions else 0
+    snippet = text[start:start + 200]
+    for word in words:
+        index = snippet.lower().find(word.lower())
+        if index >= 0:
+            snippet = u''.join([snippet[:index], MATCH_START, snippet[index:index + len(word)], MATCH_END,
+                                snippet[index + len(word):]])
+    return (u'...' if start > 0 else u'') + snippet
+
+
+def highlight(snippet):
+    """
+    Escapes a snippet, and marks its matches with <mark>
+    """
+    return mark_safe(escape(snippet).replace(MATCH_START, u'<mark>').replace(MATCH_END, u'</mark>'))
+
+
+def last_indexed(kinds):
+    return SearchEntry.objects.filter(kind__in=kinds).aggregate(latest=Max('source_last_parsed'))['latest']
+
+
+def new_entry(**kwargs):
+    """
+    Returns an unsaved SearchEntry, with the tokens of its text
+    """
+    entry = SearchEntry(**kwargs)
+    entry.tokens = u' '.join(get_tokenizer().tokenize(entry.text))
+    return entry
+
+
+def replace_entries(kinds, uids, entries):
+    with transaction.atomic():
+        SearchEntry.objects.filter(kind__in=kinds, source_uid__in=uids).delete()
+        SearchEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+
+
+def changed_since(since, kinds, uid_field):
+    """
+    Returns a Q of the parsed objects that were parsed after since, or whose source (by uid_field) has stale
+    entries of the kinds or none at all
+    """
+    indexed = SearchEntry.objects.filter(kind__in=kinds)
+    return (Q(source_last_parsed__gt=since) |
+            Q(**{uid_field + '__in': indexed.filter(stale=True).values('source_uid')}) |
+            ~Q(**{uid_field + '__in': indexed.values('source_uid')}))
+
+
+def remove_inactive():
+    """
+    Removes the entries of the hansards without active speeches and of the questions that are no longer
+    active, e.g. deactivated by an override.  Returns the number of entries removed
+    """
+    removed = [
+        SearchEntry.objects.filter(kind=SearchEntry.SPEECH).exclude(
+            source_uid__in=ParsedSpeech.objects.active().values('hansard_uid')),
+        SearchEntry.objects.filter(kind__in=[SearchEntry.QUESTION, SearchEntry.REPLY]).exclude(
+            source_uid__in=ParsedQuestion.objects.active().values('uid')),
+    ]
+    count = 0
+    for qs in removed:
+        count += qs.count()
+        qs.delete()
+    return count
+
+
+def speech_entries(speeches):
+    """
+    Returns the SearchEntries for some ParsedSpeeches
+    """
+    return [new_entry(kind=SearchEntry.SPEECH, source_uid=speech.hansard_uid, order=speech.order,
+                      language=speech.language, date=speech.date, section=speech.section,
+                      speaker=speech.speaker_name, text=speech.text, source_last_parsed=speech.source_last_parsed)
+            for speech in speeches]
+
+
+def index_speeches(since=None):
+    """
+    Indexes the active ParsedSpeeches, with their overrides, of the hansards parsed after since or changed since
+    they were indexed, or all of them.  Returns the number of speeches
+    """
+    active = ParsedSpeech.objects.active()
+    qs = active
+    if since is not None:
+        qs = qs.filter(changed_since(since, [SearchEntry.SPEECH], 'hansard_uid'))
+    # A hansard at a time, in the order they were parsed, so an interrupted run carries on from where it stopped
+    hansards = qs.values('hansard_uid').annotate(latest=Max('source_last_parsed')).order_by('latest', 'hansard_uid')
+    payloads = Override.objects.get_payloads(ParsedSpeech)
+    count = 0
+    for hansard_uid in [xx['hansard_uid'] for xx in hansards]:
+        speeches = Override.objects.apply(active.filter(hansard_uid=hansard_uid).order_by('order'), ParsedSpeech,
+                                          payloads)
+        entries = speech_entries(speeches)
+        replace_entries([SearchEntry.SPEECH], [hansard_uid], entries)
+        count += len(entries)
+    return count
+
+
+def question_entries(question):
+    """
+    Returns the SearchEntries for the question and reply of a ParsedQuestion, in both languages
+    """
+    start_date = question.meeting.start_date
+    if start_date is not None and timezone.is_aware(start_date):
+        start_date = timezone.localtime(start_date)
+    asker = question.asker
+    parts = [
+        (SearchEntry.QUESTION, LANG_EN, asker.name_e if asker else u'', question.ask_subject_e, question.body_e),
+        (SearchEntry.REPLY, LANG_EN, question.repliers_e, question.reply_subject_e, question.reply_e),
+        (SearchEntry.QUESTION, LANG_CN, asker.name_c if asker else u'', question.ask_subject_c, question.body_c),
+        (SearchEntry.REPLY, LANG_CN, question.repliers_c, question.reply_subject_c, question.reply_c),
+    ]
+    entries = []
+    for order, (kind, language, speaker, section, body) in enumerate(parts):
+        text = html_to_text(body)
+        if text:
+            entries.append(new_entry(kind=kind, source_uid=question.uid, order=order, language=language,
+                                     date=start_date.date() if start_date else None, section=section,
+                                     speaker=(speaker or u'')[:255], text=text,
+                                     source_last_parsed=question.source_last_parsed))
+    return entries
+
+
+def index_questions(since=None):
+    """
+    Indexes the active ParsedQuestions, with their overrides, populated from raw questions parsed after since
+    or changed since they were indexed, or all of them.  Returns the number of entries
+    """
+    qs = ParsedQuestion.objects.active().select_related('meeting', 'asker')
+    if since is not None:
+        qs = qs.filter(changed_since(since, [SearchEntry.QUESTION, SearchEntry.REPLY], 'uid'))
+    count = 0
+    for batch in grouper(iter_objects(qs, BATCH_SIZE), BATCH_SIZE):
+        questions = [xx for xx in batch if xx is not None]
+        entries = [entry for question in questions for entry in question_entries(question)]
+        replace_entries([SearchEntry.QUESTION, SearchEntry.REPLY], [xx.uid for xx in questions], entries)
+        count += len(entries)
+    return count
+
+
+def update_index(rebuild=False):
+    """
+    Indexes the speeches and questions that changed since the last update, or everything with rebuild, and
+    removes the ones that are no longer active.  Returns the number of entries indexed of each, and removed
+    """
+    install()
+    if rebuild:
+        SearchEntry.objects.all().delete()
+    removed = remove_inactive()
+    speeches_since = None if rebuild else last_indexed([SearchEntry.SPEECH])
+    questions_since = None if rebuild else last_indexed([SearchEntry.QUESTION, SearchEntry.REPLY])
+    res = {
+        'speeches': index_speeches(speeches_since),
+        'questions': index_questions(questions_since),
+        'removed': removed,
+    }
+    logger.info(u'Indexed {speeches} speeches and {questions} questions and replies, removed {removed}'.format(**res))
+    return res
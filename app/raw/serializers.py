@@ -0,0 +1,60 @@
+"""
+Serializers for the read-only API over the parsed models, see raw.api
+"""
+from rest_framework import serializers
+from raw.models import (ParsedCommittee, ParsedCommitteeMembership, ParsedCouncilMeeting, ParsedPerson,
+                        ParsedQuestion)
+
+
+class ParsedModelSerializer(serializers.ModelSerializer):
+    """
+    Leaves out the internal fields of the parsed models, and refers to other parsed objects by uid.
+
+    Clients can ask for some of the fields with ?fields=uid,name_e
+    """
+    serializer_related_field = serializers.SlugRelatedField
+
+    class Meta:
+        exclude = ('id', 'deactivate', 'source_last_parsed')
+
+    def __init__(self, *args, **kwargs):
+        super(ParsedModelSerializer, self).__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested = request.query_params.get('fields') if request is not None else None
+        if requested:
+            requested = set(xx.strip() for xx in requested.split(','))
+            for name in list(self.fields.keys()):
+                if name not in requested:
+                    self.fields.pop(name)
+
+    def build_relational_field(self, field_name, relation_info):
+        field_class, field_kwargs = super(ParsedModelSerializer, self).build_relational_field(field_name, relation_info)
+        field_kwargs['slug_field'] = 'uid'
+        return field_class, field_kwargs
+
+
+class ParsedPersonSerializer(ParsedModelSerializer):
+    class Meta(ParsedModelSerializer.Meta):
+        model = ParsedPerson
+        # The committees are in the committee memberships
+        exclude = ParsedModelSerializer.Meta.exclude + ('committees',)
+
+
+class ParsedCommitteeSerializer(ParsedModelSerializer):
+    class Meta(ParsedModelSerializer.Meta):
+        model = ParsedCommittee
+
+
+class ParsedCommitteeMembershipSerializer(ParsedModelSerializer):
+    class Meta(ParsedModelSerializer.Meta):
+        model = ParsedCommitteeMembership
+
+
+class ParsedCouncilMeetingSerializer(ParsedModelSerializer):
+    class Meta(ParsedModelSerializer.Meta):
+        model = ParsedCouncilMeeting
+
+
+class ParsedQuestionSerializer(ParsedModelSerializer):
+    class Meta(ParsedModelSerializer.Meta):
+        model = ParsedQuestion
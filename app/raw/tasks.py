@@ -1,15 +1,19 @@
 from __future__ import absolute_import
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import logging
-from celery import shared_task
+import billiard
+from celery import chord, shared_task
 from twisted.internet import reactor
 from scrapy.crawler import Crawler
 from scrapy import log, signals
 from scrapy.utils.project import get_project_settings
 import os
-from raw import processors
-from raw.models import ScrapeJob
+from raw import pipeline, processors
+from raw.models import PipelineStep, ScrapeJob
+from raw.processors.base import split_items_file
 from django.conf import settings
+from django.db import connection
 from django.db.backends import BaseDatabaseWrapper
 from django.db.backends.util import CursorWrapper
 
@@ -51,10 +55,11 @@ def is_spider_scraping(spider_name):
 
 
 @shared_task
-def do_scrape(spider_name):
+def do_scrape(spider_name, job_id=None):
     """
     Asynchronous task for individual scrapes that is executed by Celery workers.
     :param spider_name: str name of the spider that should be run
+    :param job_id: str job_id to record on the ScrapeJob, defaults to the id of this task
     :return: the full path of the jsonlines output file to which results are stored
     """
     # create and configure the spider
@@ -78,7 +83,7 @@ def do_scrape(spider_name):
     if is_scraping is False:
         logger.info('Starting new scrape of {}'.format(spider_name))
         # Create the ScrapeJob record
-        job_id = do_scrape.request.id
+        job_id = job_id or do_scrape.request.id
         if job_id is None:
             # Case if called directly without using Celery, put in a dummy job id
             timestamp = datetime.now().strftime('%y%m%d%H%M')
@@ -107,12 +112,36 @@ def do_scrape(spider_name):
     return job.raw_response
 
 
+@contextmanager
+def sql_logging_disabled():
+    """
+    Stops Django from keeping every query in memory while processing in DEBUG mode
+    """
+    if settings.DEBUG:
+        original = BaseDatabaseWrapper.make_debug_cursor
+        BaseDatabaseWrapper.make_debug_cursor = lambda self, cursor: CursorWrapper(cursor, self)
+    try:
+        yield
+    finally:
+        if settings.DEBUG:
+            BaseDatabaseWrapper.make_debug_cursor = original
+
+
+def mark_processed(job):
+    # Log that the job was processed just now
+    job.last_fetched = datetime.now()
+    job.save()
+
+
 @shared_task
-def process_scrape(spider_name):
+def process_scrape(spider_name, force=False, shards=1):
     """
     Process the results of a scrape for a spider.  Will read the JSONLines file and make the appropriate
     Raw objects in the database
     :param spider_name: str name of the spider that produced the results
+    :param force: bool rewrite objects even if their items have not changed since the last run
+    :param shards: int split the file into this many parts to be processed in parallel, if the processor
+        supports it.  The shards run as a Celery chord, or in a local process pool if this is called directly
     :return:
     """
     try:
@@ -121,22 +150,169 @@ def process_scrape(spider_name):
         logger.warn("No jobs found for spider {}".format(spider_name))
         return
 
-    items_file = job.raw_response # a jsonl file in ./scrapes
+    if job.loaded_while_crawling:
+        # The DatabasePipeline already loaded the items.  Jobs that were processed here can be processed again
+        logger.info("Latest job for spider {} was loaded while crawling".format(spider_name))
+        return
 
-    # Disable SQL logging
-    if settings.DEBUG:
-        original = BaseDatabaseWrapper.make_debug_cursor
-        BaseDatabaseWrapper.make_debug_cursor = lambda self, cursor: CursorWrapper(cursor, self)
+    items_file = job.raw_response # a jsonl file in ./scrapes
 
     # Get the processor and run it
     processor = processors.get_processor_for_spider(spider_name)
+    if processor.shardable and shards > 1:
+        byte_ranges = split_items_file(items_file, shards)
+        if len(byte_ranges) > 1:
+            logger.info('Processing file {} from ScrapeJob {} in {} shards'.format(items_file, job.id, len(byte_ranges)))
+            if process_scrape.request.id is None:
+                # Called directly without using Celery
+                shard_counts = process_shards_locally(spider_name, job.id, byte_ranges, force)
+                finish_sharded_scrape(shard_counts, spider_name, job.id, force)
+            else:
+                header = [process_scrape_shard.s(spider_name, job.id, xx, force) for xx in byte_ranges]
+                chord(header)(finish_sharded_scrape.s(spider_name, job.id, force))
+            return
+
     logger.info('Processing file {} from ScrapeJob {}'.format(items_file, job.id))
-    processor(items_file, job).process()
+    with sql_logging_disabled():
+        processor(items_file, job, force=force).process()
+    mark_processed(job)
+    return
 
-    if settings.DEBUG:
-        BaseDatabaseWrapper.make_debug_cursor = original
 
-    # Log that the job was processed just now
-    job.last_fetched = datetime.now()
-    job.save()
-    return
+@shared_task
+def process_scrape_shard(spider_name, job_id, byte_range, force=False):
+    """
+    Loads the items in one byte range of a ScrapeJob's items file.
+    Returns the processor's counts, to be merged by finish_sharded_scrape
+    """
+    job = ScrapeJob.objects.get(id=job_id)
+    processor = processors.get_processor_for_spider(spider_name)(job.raw_response, job, force=force, shard=tuple(byte_range))
+    with sql_logging_disabled():
+        processor.process_items()
+    return processor.get_counts()
+
+
+@shared_task
+def finish_sharded_scrape(shard_counts, spider_name, job_id, force=False):
+    """
+    Runs the steps that need all of the items loaded, e.g. merging hansard parts, once every shard is done
+    :param shard_counts: list of the counts returned by process_scrape_shard
+    """
+    job = ScrapeJob.objects.get(id=job_id)
+    processor = processors.get_processor_for_spider(spider_name)(job.raw_response, job, force=force)
+    for counts in shard_counts:
+        processor.merge_counts(counts)
+    with sql_logging_disabled():
+        processor.finalize()
+    mark_processed(job)
+
+
+def _process_shard_args(args):
+    # Pool.map only passes a single argument
+    return process_scrape_shard(*args)
+
+
+def process_shards_locally(spider_name, job_id, byte_ranges, force=False):
+    """
+    Processes the shards in a local process pool, for when process_scrape isn't run as a Celery task, e.g. by
+    a pipeline step.  billiard's pools can be started from Celery's daemonic workers, unlike multiprocessing's
+    """
+    # Don't share this process's database connection with the workers, they'll open their own
+    connection.close()
+    pool = billiard.Pool(len(byte_ranges))
+    try:
+        return pool.map(_process_shard_args, [(spider_name, job_id, xx, force) for xx in byte_ranges])
+    finally:
+        pool.close()
+        pool.join()
+
+
+def scrape_job(spider_name, job_id):
+    """
+    Runs do_scrape under job_id, and fails if it found another scrape of the spider pending instead of
+    starting its own
+    """
+    do_scrape(spider_name, job_id)
+    if not ScrapeJob.objects.filter(spider=spider_name, job_id=job_id).exists():
+        raise RuntimeError('Did not scrape {}, another scrape of it is pending'.format(spider_name))
+
+
+def scrape_in_subprocess(spider_name, job_id):
+    """
+    Runs scrape_job in a child process.  The Twisted reactor can't be restarted once it has stopped,
+    so this is how one process, e.g. a Celery worker, runs more than one scrape.  billiard's processes
+    can be started from the daemonic worker processes, unlike multiprocessing's
+    """
+    # Don't share this process's database connection with the child, it'll open its own
+    connection.close()
+    process = billiard.Process(target=scrape_job, args=(spider_name, job_id))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError('Scrape of {} failed with exit code {}'.format(spider_name, process.exitcode))
+
+
+@shared_task
+def run_pipeline(spiders=None, scrape=True, force=False, shards=1):
+    """
+    Scrapes and processes the spiders, starting each step as soon as the steps it depends on have
+    completed (see raw.pipeline), so independent spiders are scraped and processed in parallel
+    :param spiders: list of spider names, defaults to all of the spiders with processors
+    :param scrape: bool scrape the spiders first, otherwise just process their latest scrapes
+    :param force: bool passed on to process_scrape
+    :param shards: int passed on to process_scrape
+    :return: the run id, for looking up the PipelineSteps
+    """
+    graph = pipeline.build_graph(spiders, scrape)
+    run_id = run_pipeline.request.id
+    if run_id is None:
+        # Case if called directly without using Celery, put in a dummy run id
+        timestamp = datetime.now().strftime('%y%m%d%H%M%S')
+        run_id = 'MANUAL_RUN{}'.format(timestamp)
+    for name in graph:
+        PipelineStep.objects.create(run_id=run_id, name=name)
+    logger.info('Starting pipeline run {} with {} steps'.format(run_id, len(graph)))
+
+    if run_pipeline.request.id is None:
+        # Without Celery there's nothing to run the steps in parallel, so run them one after the other
+        for name in pipeline.topological_order(graph):
+            PipelineStep.objects.claim(run_id, name)
+            execute_pipeline_step(run_id, name, force, shards=shards)
+    else:
+        for name in PipelineStep.objects.claim_ready(run_id, graph, graph.keys()):
+            run_pipeline_step.delay(run_id, name, spiders, scrape, force, shards)
+    return run_id
+
+
+@shared_task
+def run_pipeline_step(run_id, name, spiders=None, scrape=True, force=False, shards=1):
+    """
+    Runs one step of a pipeline run, then starts any steps that were only waiting on this one
+    """
+    graph = pipeline.build_graph(spiders, scrape)
+    execute_pipeline_step(run_id, name, force, job_id=run_pipeline_step.request.id, shards=shards)
+    for downstream in PipelineStep.objects.claim_ready(run_id, graph, pipeline.dependents(graph, name)):
+        run_pipeline_step.delay(run_id, downstream, spiders, scrape, force, shards)
+
+
+def execute_pipeline_step(run_id, name, force=False, job_id=None, shards=1):
+    """
+    Scrapes a spider or processes its results, recording the outcome on the PipelineStep.
+    Each scrape runs in a child process of its own, so the steps can share a process
+    :param job_id: str job_id of the ScrapeJob a scrape step starts, defaults to one made from the run and step
+    :param shards: int passed on to process_scrape, whose shards then run in a local process pool
+    """
+    kind, spider = pipeline.parse_step_name(name)
+    logger.info('Pipeline run {}: starting {}'.format(run_id, name))
+    try:
+        if kind == pipeline.SCRAPE:
+            scrape_in_subprocess(spider, job_id or u'{}:{}'.format(run_id, name))
+        else:
+            # Process the whole file here, so the step isn't complete until the objects are loaded
+            process_scrape(spider, force=force, shards=shards)
+    except Exception:
+        logger.exception('Pipeline run {}: {} failed, its dependents will not be run'.format(run_id, name))
+        PipelineStep.objects.filter(run_id=run_id, name=name).update(failed=datetime.now())
+        raise
+    PipelineStep.objects.filter(run_id=run_id, name=name).update(completed=datetime.now())
+    logger.info('Pipeline run {}: completed {}'.format(run_id, name))
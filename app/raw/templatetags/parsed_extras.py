@@ -1,6 +1,8 @@
 from django import template
 from django.core.urlresolvers import reverse
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
+from raw import photos
 from raw.models import BaseParsedModel
 
 
@@ -12,4 +14,18 @@ def link_model(val):
     if isinstance(val, BaseParsedModel):
         return mark_safe(u'<a href="{}">{}</a>'.format(reverse('parsed_model_detail', kwargs={'model': val._meta.model_name, 'uid': val.uid}), unicode(val)))
     else:
-        return val
\ No newline at end of file
+        return val
+
+
+@register.filter
+def thumbnail(photo_file, size='small'):
+    # Static path of a smaller version of a member photo, see raw.photos.THUMBNAIL_SIZES
+    return photos.thumbnail_file(photo_file, size)
+
+
+@register.simple_tag(takes_context=True)
+def query_string(context, key, value):
+    # The current query string with only key set to value, e.g. for the page links of one of several paginated lists
+    params = context['request'].GET.copy()
+    params[key] = value
+    return escape(params.urlencode())
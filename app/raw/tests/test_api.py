@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+import json
+import logging
+from django.core.cache import cache
+from django.db.models import F
+from django.test import TestCase
+from django.utils.timezone import utc
+from raw.models import (Override, ParsedCouncilMeeting, ParsedGeneration, ParsedPerson, ParsedQuestion, RawMember,
+                        GENDER_M, bump_parsed_generation)
+
+
+logging.disable(logging.CRITICAL)
+
+
+class ParsedApiTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.person = ParsedPerson.objects.create(uid='member-1', name_e='CHAN Tai-man', name_c=u'陳大文',
+                                                  gender=GENDER_M)
+
+    def add_questions(self, start, end):
+        for xx in range(start, end):
+            meeting = ParsedCouncilMeeting.objects.create(uid='cmeeting-{}'.format(xx),
+                                                          start_date=datetime(2014, 1, 1, 11, tzinfo=utc))
+            ParsedQuestion.objects.create(uid='cmeeting-{}-q1'.format(xx), meeting=meeting, number=1,
+                                          asker=self.person, question_type=ParsedQuestion.ORAL)
+
+    def get_json(self, url, **kwargs):
+        res = self.client.get(url, HTTP_ACCEPT='application/json', **kwargs)
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.content)
+
+    def test_detail(self):
+        data = self.get_json('/api/people/member-1/')
+        self.assertEqual(data['name_c'], u'陳大文')
+        self.assertNotIn('id', data)
+        self.assertNotIn('deactivate', data)
+
+    def test_related_by_uid(self):
+        self.add_questions(0, 1)
+        data = self.get_json('/api/questions/cmeeting-0-q1/')
+        self.assertEqual(data['asker'], 'member-1')
+        self.assertEqual(data['meeting'], 'cmeeting-0')
+
+    def test_fields(self):
+        data = self.get_json('/api/people/member-1/', data={'fields': 'uid,name_e'})
+        self.assertEqual(data, {'uid': 'member-1', 'name_e': 'CHAN Tai-man'})
+
+    def test_cursor_pages(self):
+        self.add_questions(0, 60)
+        data = self.get_json('/api/questions/')
+        self.assertEqual(len(data['results']), 50)
+        self.assertIsNone(data['previous'])
+        data = self.get_json(data['next'])
+        self.assertEqual([xx['uid'] for xx in data['results']], ['cmeeting-{}-q1'.format(xx) for xx in range(50, 60)])
+        self.assertIsNone(data['next'])
+
+    def test_constant_queries(self):
+        self.add_questions(0, 5)
+        # The generation for the cache key, then the generation and the overrides for active(), the page
+        # with its meetings and askers, and the generation again to apply the overrides
+        with self.assertNumQueries(5):
+            self.get_json('/api/questions/')
+        self.add_questions(5, 50)
+        bump_parsed_generation()
+        with self.assertNumQueries(5):
+            data = self.get_json('/api/questions/')
+        self.assertEqual(len(data['results']), 50)
+
+    def test_cached(self):
+        self.get_json('/api/people/')
+        # Just the generation
+        with self.assertNumQueries(1):
+            self.get_json('/api/people/')
+
+    def test_generation_is_read_from_the_database(self):
+        bump_parsed_generation()
+        self.get_json('/api/people/member-1/')
+        ParsedPerson.objects.filter(uid='member-1').update(name_e='CHAN Siu-ming')
+        self.assertEqual(self.get_json('/api/people/member-1/')['name_e'], 'CHAN Tai-man')
+        # As another process would, without touching this process's cache
+        ParsedGeneration.objects.filter(pk=1).update(value=F('value') + 1)
+        self.assertEqual(self.get_json('/api/people/member-1/')['name_e'], 'CHAN Siu-ming')
+
+    def test_etag(self):
+        res = self.client.get('/api/people/member-1/', HTTP_ACCEPT='application/json')
+        etag = res['ETag']
+        res = self.client.get('/api/people/member-1/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+
+    def test_overrides(self):
+        self.get_json('/api/people/member-1/')
+        override = Override.objects.create_from(self.person)
+        override.merge_payload({'name_e': 'CHAN Siu-ming'})
+        override.save()
+        data = self.get_json('/api/people/member-1/')
+        self.assertEqual(data['name_e'], 'CHAN Siu-ming')
+        Override.objects.set_deactivated([self.person])
+        self.assertEqual(self.client.get('/api/people/member-1/', HTTP_ACCEPT='application/json').status_code, 404)
+        self.assertEqual(self.get_json('/api/people/')['results'], [])
+
+    def test_populate_invalidates(self):
+        self.assertEqual(len(self.get_json('/api/people/')['results']), 1)
+        RawMember.objects.create(uid='member-2', name_e='Member 2', gender=GENDER_M)
+        ParsedPerson.objects.populate()
+        # member-1 has no RawMember, so it is deactivated
+        self.assertEqual([xx['uid'] for xx in self.get_json('/api/people/')['results']], ['member-2'])
@@ -3,6 +3,7 @@
 
 # Tests for RawCouncilQuestion object
 
+from datetime import date
 from django.test import TestCase
 import logging
 from raw.docs import question
@@ -13,4 +14,11 @@ logging.disable(logging.CRITICAL)
 class RawCouncilQuestionTest(TestCase):
     
     def setUp(self):
-        pass
\ No newline at end of file
+        pass
+
+    def test_date_is_set_on_save(self):
+        obj = RawCouncilQuestion.objects.create(uid='question-20140108-1-e', raw_date='8.1.2014')
+        self.assertEqual(RawCouncilQuestion.objects.get(pk=obj.pk).date, date(2014, 1, 8))
+        obj.raw_date = u''
+        obj.save()
+        self.assertIsNone(RawCouncilQuestion.objects.get(pk=obj.pk).date)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import csv
+from datetime import datetime
+import gzip
+import json
+import logging
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils.timezone import utc
+from raw import export
+from raw.models import Override, ParsedCouncilMeeting, ParsedPerson, ParsedQuestion, GENDER_M
+
+
+logging.disable(logging.CRITICAL)
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.person = ParsedPerson.objects.create(uid='member-1', name_e='CHAN Tai-man', name_c=u'陳大文',
+                                                  gender=GENDER_M)
+        for xx in range(5):
+            meeting = ParsedCouncilMeeting.objects.create(uid='cmeeting-{}'.format(xx),
+                                                          start_date=datetime(2014, 1, 1, 11, tzinfo=utc))
+            ParsedQuestion.objects.create(uid='cmeeting-{}-q1'.format(xx), meeting=meeting, number=1,
+                                          asker=self.person, question_type=ParsedQuestion.ORAL,
+                                          body_e='Line 1\nLine 2', body_c=u'問題 {}'.format(xx),
+                                          source_last_parsed=datetime(2014, 1, xx + 1, tzinfo=utc))
+
+    def test_jsonl(self):
+        lines = list(export.export_lines(ParsedQuestion, 'jsonl', batch_size=2))
+        rows = [json.loads(xx) for xx in lines]
+        self.assertEqual([xx['uid'] for xx in rows], ['cmeeting-{}-q1'.format(xx) for xx in range(5)])
+        self.assertEqual(rows[0]['asker'], 'member-1')
+        self.assertEqual(rows[0]['meeting'], 'cmeeting-0')
+        self.assertEqual(rows[0]['body_c'], u'問題 0')
+        self.assertNotIn('id', rows[0])
+
+    def test_csv(self):
+        rows = list(csv.reader(StringIO(''.join(export.export_lines(ParsedQuestion, 'csv')))))
+        self.assertEqual(rows[0], export.export_fields(ParsedQuestion))
+        self.assertEqual(len(rows), 6)
+        row = dict(zip(rows[0], rows[1]))
+        self.assertEqual(row['body_e'], 'Line 1\nLine 2')
+        self.assertEqual(row['body_c'].decode('utf-8'), u'問題 0')
+
+    def test_since(self):
+        rows = list(export.export_rows(ParsedQuestion, since=datetime(2014, 1, 3, tzinfo=utc)))
+        self.assertEqual([xx['uid'] for xx in rows], ['cmeeting-3-q1', 'cmeeting-4-q1'])
+
+    def test_overrides(self):
+        override = Override.objects.create_from(self.person)
+        override.merge_payload({'name_e': 'CHAN Siu-ming'})
+        override.save()
+        rows = list(export.export_rows(ParsedPerson))
+        self.assertEqual(rows[0]['name_e'], 'CHAN Siu-ming')
+        Override.objects.set_deactivated([self.person])
+        self.assertEqual(list(export.export_rows(ParsedPerson)), [])
+
+    def test_batches(self):
+        # The generation and the overrides for active(), the generation again, then a query per batch
+        with self.assertNumQueries(3 + 3):
+            self.assertEqual(len(list(export.export_rows(ParsedQuestion, batch_size=2))), 5)
+
+    def test_view(self):
+        url = reverse('parsed_export', kwargs={'name': 'questions', 'fmt': 'jsonl'})
+        res = self.client.get(url, {'since': '2014-01-04'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        content = gzip.GzipFile(fileobj=StringIO(''.join(res.streaming_content))).read()
+        self.assertEqual([json.loads(xx)['uid'] for xx in content.splitlines()], ['cmeeting-4-q1'])
+        self.assertEqual(self.client.get(url, {'since': 'yesterday'}).status_code, 400)
+        url = reverse('parsed_export', kwargs={'name': 'nothing', 'fmt': 'csv'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_command(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            call_command('export_parsed', 'people', 'questions', format='jsonl', output_dir=tmp_dir, gzip=True,
+                         stdout=StringIO())
+            with gzip.open(os.path.join(tmp_dir, 'questions.jsonl.gz')) as f:
+                self.assertEqual(len(f.readlines()), 5)
+            with gzip.open(os.path.join(tmp_dir, 'people.jsonl.gz')) as f:
+                self.assertEqual(json.loads(f.read())['uid'], 'member-1')
+        finally:
+            shutil.rmtree(tmp_dir)
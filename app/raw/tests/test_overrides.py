@@ -1,6 +1,11 @@
+# -*- coding: utf-8 -*-
+import json
 import logging
+from django.core.cache import cache
+from django.db.models import F
 from django.test import TestCase
-from raw.models import RawMember, Override
+from raw.models import (RawCommittee, RawMember, Override, ParsedCommittee, ParsedGeneration,
+                        bump_parsed_generation)
 
 
 logging.disable(logging.CRITICAL)
@@ -34,3 +39,76 @@ class OverrideTestCase(TestCase):
         override = Override.objects.create_from(self.obj)
         mdl = override._get_model()
         self.assertEqual(mdl, RawMember)
+
+
+class OverrideEngineTestCase(TestCase):
+    def setUp(self):
+        # The payloads are cached across tests, but the overrides are rolled back
+        cache.clear()
+        for xx in range(5):
+            RawCommittee.objects.create(uid='committee-{}'.format(xx), name_e='Committee {}'.format(xx))
+        ParsedCommittee.objects.populate()
+        Override.objects.create(ref_model='parsedcommittee', ref_uid='committee-1',
+                                data=json.dumps({'name_e': 'Finance Committee'}))
+        Override.objects.create(ref_model='parsedcommittee', ref_uid='committee-2',
+                                data=json.dumps({'deactivate': True}))
+
+    def test_payloads_are_loaded_once(self):
+        # The generation, then the overrides
+        with self.assertNumQueries(2):
+            payloads = Override.objects.get_payloads(ParsedCommittee)
+        self.assertEqual(payloads['committee-1'], {'name_e': 'Finance Committee'})
+        with self.assertNumQueries(1):
+            Override.objects.get_payloads('parsedcommittee')
+
+    def test_payloads_follow_the_generation_in_the_database(self):
+        Override.objects.get_payloads(ParsedCommittee)
+        # As another process would, without the post_save signal or touching this process's cache
+        Override.objects.filter(ref_uid='committee-1').update(data=json.dumps({'name_e': 'Panel'}))
+        self.assertEqual(Override.objects.get_payloads(ParsedCommittee)['committee-1']['name_e'], 'Finance Committee')
+        ParsedGeneration.objects.update(value=F('value') + 1)
+        self.assertEqual(Override.objects.get_payloads(ParsedCommittee)['committee-1']['name_e'], 'Panel')
+
+    def test_saving_invalidates(self):
+        Override.objects.get_payloads(ParsedCommittee)
+        override = Override.objects.get(ref_uid='committee-1')
+        override.merge_payload({'name_c': u'財務委員會'})
+        override.save()
+        self.assertEqual(Override.objects.get_payloads(ParsedCommittee)['committee-1']['name_c'], u'財務委員會')
+        override.delete()
+        self.assertNotIn('committee-1', Override.objects.get_payloads(ParsedCommittee))
+
+    def test_apply(self):
+        Override.objects.get_payloads(ParsedCommittee)
+        # The committees and the generation
+        with self.assertNumQueries(2):
+            objs = Override.objects.apply(ParsedCommittee.objects.order_by('uid'))
+        self.assertEqual(objs[1].name_e, 'Finance Committee')
+        self.assertTrue(objs[2].deactivate)
+        self.assertEqual(objs[3].name_e, 'Committee 3')
+
+    def test_populate_stores_parsed_values(self):
+        res = ParsedCommittee.objects.populate()
+        self.assertEqual(res['unchanged'], 5)
+        self.assertEqual(ParsedCommittee.objects.get(uid='committee-1').name_e, 'Committee 1')
+        self.assertFalse(ParsedCommittee.objects.get(uid='committee-2').deactivate)
+        # The overrides are applied when reading
+        self.assertNotIn('committee-2', ParsedCommittee.objects.active().values_list('uid', flat=True))
+        committee = Override.objects.apply([ParsedCommittee.objects.get(uid='committee-1')])[0]
+        self.assertEqual(committee.name_e, 'Finance Committee')
+        # So removing an override brings back the parsed values without populating again
+        Override.objects.get(ref_uid='committee-2').delete()
+        self.assertIn('committee-2', ParsedCommittee.objects.active().values_list('uid', flat=True))
+
+    def test_set_deactivated(self):
+        committees = list(ParsedCommittee.objects.filter(uid__in=['committee-1', 'committee-2', 'committee-3']))
+        bump_parsed_generation()
+        with self.assertNumQueries(7):
+            # Load the overrides, then update one and insert one, in a transaction.  Saving the updated one
+            # bumps the generation, and so does the end
+            Override.objects.set_deactivated(committees)
+        payloads = Override.objects.get_payloads(ParsedCommittee)
+        self.assertEqual(payloads['committee-1'], {'name_e': 'Finance Committee', 'deactivate': True})
+        self.assertEqual(payloads['committee-3'], {'deactivate': True})
+        Override.objects.set_deactivated(committees, False)
+        self.assertFalse(Override.objects.get(ref_uid='committee-2').is_deactivated())
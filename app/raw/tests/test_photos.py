@@ -0,0 +1,45 @@
+import logging
+import os
+import shutil
+import tempfile
+from PIL import Image
+from django.test import TestCase
+from raw import photos
+
+
+logging.disable(logging.CRITICAL)
+
+
+class PhotoStoreTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.photo_dir = os.path.join(self.tmp_dir, 'member_photos')
+        self.source = os.path.join(self.tmp_dir, 'download.jpg')
+        Image.new('RGB', (300, 400), (200, 100, 50)).save(self.source, 'JPEG')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_store_photo(self):
+        checksum = photos.file_checksum(self.source)
+        res = photos.store_photo(self.source, photo_dir=self.photo_dir)
+        self.assertEqual(res, u'member_photos/{}.jpg'.format(checksum))
+        self.assertTrue(os.path.exists(os.path.join(self.photo_dir, '{}.jpg'.format(checksum))))
+        for size, dimensions in photos.THUMBNAIL_SIZES.items():
+            thumbnail = Image.open(os.path.join(self.photo_dir, '{}-{}.jpg'.format(checksum, size)))
+            self.assertEqual(thumbnail.size, dimensions)
+
+    def test_stored_photo_is_not_copied_again(self):
+        checksum = photos.file_checksum(self.source)
+        photos.store_photo(self.source, checksum, photo_dir=self.photo_dir)
+        os.remove(self.source)
+        # The checksum from the scraped item is enough to find the stored photo
+        res = photos.store_photo(self.source, checksum, photo_dir=self.photo_dir)
+        self.assertEqual(res, u'member_photos/{}.jpg'.format(checksum))
+
+    def test_thumbnail_file(self):
+        name = u'member_photos/{}.jpg'.format('a' * 32)
+        self.assertEqual(photos.thumbnail_file(name, 'small'), u'member_photos/{}-small.jpg'.format('a' * 32))
+        # Photos stored before the thumbnails were made are used as they are
+        self.assertEqual(photos.thumbnail_file(u'member_photos/member-10.jpg', 'small'), u'member_photos/member-10.jpg')
+        self.assertEqual(photos.thumbnail_file(u'', 'small'), u'')
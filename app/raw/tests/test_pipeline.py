@@ -0,0 +1,161 @@
+from datetime import datetime
+import logging
+import os
+import shutil
+from StringIO import StringIO
+import sys
+import tempfile
+from celery import current_app
+from django.core.management import call_command
+from django.test import TestCase
+from raw import pipeline, tasks
+from raw.models import PipelineStep, ScrapeJob
+
+
+logging.disable(logging.CRITICAL)
+
+
+class PipelineGraphTestCase(TestCase):
+    def test_order_respects_dependencies(self):
+        graph = pipeline.build_graph()
+        order = pipeline.topological_order(graph)
+        self.assertEqual(len(order), len(graph))
+        for name, deps in graph.items():
+            for dep in deps:
+                self.assertLess(order.index(dep), order.index(name))
+
+    def test_processing_waits_for_scrape(self):
+        graph = pipeline.build_graph(['library_member'])
+        self.assertEqual(graph['process:library_member'], ['scrape:library_member'])
+        graph = pipeline.build_graph(['library_member'], scrape=False)
+        self.assertEqual(graph.keys(), ['process:library_member'])
+
+    def test_independent_steps_are_ready_together(self):
+        graph = pipeline.build_graph(scrape=False)
+        ready = pipeline.ready_steps(graph, [])
+        self.assertIn('process:schedule_member', ready)
+        self.assertIn('process:schedule_committee', ready)
+        self.assertIn('process:library_hansard', ready)
+        self.assertNotIn('process:schedule_membership', ready)
+
+        ready = pipeline.ready_steps(graph, ['process:schedule_committee'])
+        self.assertIn('process:schedule_meeting_committee', ready)
+        self.assertNotIn('process:schedule_membership', ready)
+
+    def test_dependencies_outside_the_run_are_dropped(self):
+        graph = pipeline.build_graph(['schedule_membership', 'schedule_committee'], scrape=False)
+        self.assertEqual(graph['process:schedule_membership'], ['process:schedule_committee'])
+
+    def test_circular_dependencies(self):
+        graph = {'a': ['b'], 'b': ['a'], 'c': []}
+        self.assertRaises(RuntimeError, pipeline.topological_order, graph)
+
+    def test_invalid_spider(self):
+        self.assertRaises(RuntimeError, pipeline.build_graph, ['not_a_spider'])
+
+
+class PipelineStepTestCase(TestCase):
+    def setUp(self):
+        self.graph = pipeline.build_graph(['schedule_member', 'schedule_committee', 'schedule_membership'], scrape=False)
+        for name in self.graph:
+            PipelineStep.objects.create(run_id='test', name=name)
+
+    def complete(self, name):
+        PipelineStep.objects.filter(run_id='test', name=name).update(dispatched='2014-01-01', completed='2014-01-01')
+
+    def test_dependent_is_claimed_once(self):
+        self.complete('process:schedule_member')
+        self.assertEqual(
+            PipelineStep.objects.claim_ready('test', self.graph, ['process:schedule_membership']), [])
+        self.complete('process:schedule_committee')
+        self.assertEqual(
+            PipelineStep.objects.claim_ready('test', self.graph, ['process:schedule_membership']),
+            ['process:schedule_membership'])
+        # The other upstream step finishing at the same time doesn't start it again
+        self.assertEqual(
+            PipelineStep.objects.claim_ready('test', self.graph, ['process:schedule_membership']), [])
+
+
+class FakeScrape(object):
+    """
+    Stands in for do_scrape, recording the process and the job_id each spider was scraped with.
+    Like do_scrape, it starts no job of its own for the spiders that already have a pending one
+    """
+    def __init__(self, out_dir, failing=None, pending=None):
+        self.out_dir = out_dir
+        self.failing = failing
+        self.pending = pending
+
+    def __call__(self, spider_name, job_id=None):
+        if spider_name == self.failing:
+            sys.exit(1)
+        if spider_name != self.pending:
+            ScrapeJob.objects.create(spider=spider_name, scheduled=datetime.now(), completed=datetime.now(),
+                                     job_id=job_id, raw_response='')
+        with open(os.path.join(self.out_dir, spider_name), 'w') as f:
+            f.write('{} {}'.format(os.getpid(), job_id))
+
+
+class ScrapeStepTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        original = tasks.do_scrape
+        self.addCleanup(setattr, tasks, 'do_scrape', original)
+        self.spiders = ['schedule_member', 'schedule_committee']
+
+    def read_scrapes(self):
+        # The pid and job_id of each scrape
+        return [open(os.path.join(self.tmp_dir, xx)).read().split(' ') for xx in self.spiders]
+
+
+class LocalRunTestCase(ScrapeStepTestCase):
+    def test_scrapes_run_in_child_processes(self):
+        tasks.do_scrape = FakeScrape(self.tmp_dir)
+        run_id = tasks.run_pipeline(self.spiders)
+        pids = [int(xx[0]) for xx in self.read_scrapes()]
+        # The reactor can only run once per process
+        self.assertEqual(len(set(pids)), 2)
+        self.assertNotIn(os.getpid(), pids)
+        self.assertFalse(PipelineStep.objects.filter(run_id=run_id, completed=None).exists())
+
+    def test_failed_scrape(self):
+        tasks.do_scrape = FakeScrape(self.tmp_dir, failing='schedule_member')
+        with self.assertRaises(RuntimeError):
+            tasks.run_pipeline(self.spiders)
+        self.assertTrue(PipelineStep.objects.filter(name='scrape:schedule_member').exclude(failed=None).exists())
+
+    def test_shards_are_passed_on(self):
+        calls = []
+        original = tasks.process_scrape
+        tasks.process_scrape = lambda spider, **kwargs: calls.append((spider, kwargs['shards']))
+        self.addCleanup(setattr, tasks, 'process_scrape', original)
+        call_command('run_pipeline', *self.spiders, scrape=False, local=True, shards=3, stdout=StringIO())
+        self.assertEqual(sorted(calls), [('schedule_committee', 3), ('schedule_member', 3)])
+
+    def test_pending_scrape_fails_the_step(self):
+        # The step didn't scrape anything itself, so it mustn't let the processing go ahead
+        tasks.do_scrape = FakeScrape(self.tmp_dir, pending='schedule_member')
+        with self.assertRaises(RuntimeError):
+            tasks.run_pipeline(self.spiders)
+        self.assertTrue(PipelineStep.objects.filter(name='scrape:schedule_member').exclude(failed=None).exists())
+
+
+class CeleryRunTestCase(ScrapeStepTestCase):
+    def setUp(self):
+        super(CeleryRunTestCase, self).setUp()
+        for name, value in [('CELERY_ALWAYS_EAGER', True), ('CELERY_EAGER_PROPAGATES_EXCEPTIONS', True)]:
+            self.addCleanup(setattr, current_app.conf, name, getattr(current_app.conf, name))
+            setattr(current_app.conf, name, value)
+
+    def test_scrape_steps_run_in_child_processes(self):
+        tasks.do_scrape = FakeScrape(self.tmp_dir)
+        run_id = tasks.run_pipeline.delay(self.spiders).get()
+        scrapes = self.read_scrapes()
+        # Each step has its own task, and the eager steps share this process, where the reactor could only run once
+        self.assertEqual(len(set(xx[0] for xx in scrapes)), 2)
+        self.assertNotIn(str(os.getpid()), [xx[0] for xx in scrapes])
+        job_ids = [xx[1] for xx in scrapes]
+        self.assertEqual(len(set(job_ids)), 2)
+        self.assertFalse([xx for xx in job_ids if xx.startswith('MANUAL_RUN')])
+        self.assertFalse(PipelineStep.objects.filter(run_id=run_id, completed=None).exists())
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+from datetime import date, datetime
+import json
+import logging
+import math
+from StringIO import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.utils.timezone import utc
+from raw.docs.question import logger as question_logger
+from raw.models.parsed import BaseParsedManager, bump_parsed_generation
+from raw.models import (RawCommittee, RawCommitteeMembership, RawCouncilAgenda, RawMember, RawScheduleMember,
+                        ParsedCommittee, ParsedCommitteeMembership, ParsedCouncilMeeting, ParsedMembership,
+                        ParsedPerson, ParsedQuestion, ParsedSpeech, RawCouncilHansard, RawCouncilQuestion, GENDER_M,
+                        LANG_BOTH, LANG_EN, LANG_CN)
+
+
+logging.disable(logging.CRITICAL)
+
+
+def insert_batches(model, count):
+    """
+    The number of inserts bulk_create needs for count new objects of a model, for the database's limit on query parameters
+    """
+    # The parsed objects keep the ids of their raw objects, so the id is inserted too
+    fields = model._meta.local_concrete_fields
+    batch_size = min(BaseParsedManager.BATCH_SIZE, max(connection.ops.bulk_batch_size(fields, []), 1))
+    return int(math.ceil(count / float(batch_size)))
+
+
+class PopulateTestCase(TestCase):
+    def setUp(self):
+        for xx in range(20):
+            RawCommittee.objects.create(uid='committee-{}'.format(xx), code='c{}'.format(xx),
+                                        name_e='Committee {}'.format(xx), name_c=u'委員會')
+
+    def test_populate(self):
+        res = ParsedCommittee.objects.populate()
+        self.assertEqual(res['created'], 20)
+        self.assertEqual(ParsedCommittee.objects.count(), 20)
+        obj = ParsedCommittee.objects.get(uid='committee-3')
+        self.assertEqual(obj.name_e, 'Committee 3')
+        self.assertFalse(obj.deactivate)
+
+    def test_populate_again(self):
+        ParsedCommittee.objects.populate()
+        RawCommittee.objects.filter(uid='committee-3').update(name_e='Finance Committee')
+        RawCommittee.objects.create(uid='committee-20', code='c20', name_e='Committee 20', name_c=u'委員會')
+        res = ParsedCommittee.objects.populate()
+        self.assertEqual((res['created'], res['updated'], res['unchanged']), (1, 1, 19))
+        self.assertEqual(ParsedCommittee.objects.count(), 21)
+        self.assertEqual(ParsedCommittee.objects.get(uid='committee-3').name_e, 'Finance Committee')
+
+    def test_deactivated_duplicates_are_left_alone(self):
+        ParsedCommittee.objects.populate()
+        ParsedCommittee.objects.create(id=1000, uid='committee-3', name_e='Duplicate', deactivate=True)
+        RawCommittee.objects.filter(uid='committee-3').update(name_e='Finance Committee')
+        ParsedCommittee.objects.populate()
+        self.assertEqual(ParsedCommittee.objects.get(uid='committee-3', deactivate=False).name_e, 'Finance Committee')
+        self.assertEqual(ParsedCommittee.objects.get(uid='committee-3', deactivate=True).name_e, 'Duplicate')
+
+    def test_query_count_does_not_grow_with_rows(self):
+        # Load the existing rows, load the raw rows, insert, then bump the generation.  The savepoints
+        # count as queries too
+        bump_parsed_generation()
+        with self.assertNumQueries(8):
+            ParsedCommittee.objects.populate()
+        for xx in range(20, 40):
+            RawCommittee.objects.create(uid='committee-{}'.format(xx), code='c{}'.format(xx),
+                                        name_e='Committee {}'.format(xx), name_c=u'委員會')
+        with self.assertNumQueries(8):
+            ParsedCommittee.objects.populate()
+
+    def test_person(self):
+        RawMember.objects.create(uid='member-1', name_e='CHAN Tai-man', name_c=u'陳大文', title_e='Hon',
+                                 title_c=u'議員', gender=GENDER_M,
+                                 education_e=json.dumps(['BA', 'MA']), occupation_e='')
+        ParsedPerson.objects.populate()
+        person = ParsedPerson.objects.get(uid='member-1')
+        self.assertEqual(person.education_e, 'BA, MA')
+        self.assertEqual(person.occupation_e, '')
+
+    def test_meeting_agendas_share_a_meeting(self):
+        RawCouncilAgenda.objects.create(uid='council_agenda-20140101-e', start_date=date(2014, 1, 1), language=LANG_EN)
+        RawCouncilAgenda.objects.create(uid='council_agenda-20140101-c', start_date=date(2014, 1, 1), language=LANG_CN)
+        res = ParsedCouncilMeeting.objects.populate()
+        self.assertEqual(res['created'], 1)
+        self.assertEqual(ParsedCouncilMeeting.objects.get().uid, 'cmeeting-20140101')
+
+
+class MembershipPopulateTestCase(TestCase):
+    def setUp(self):
+        for xx in range(10):
+            RawMember.objects.create(
+                uid='member-{}'.format(xx), name_e='Member {}'.format(xx), name_c=u'議員', gender=GENDER_M,
+                service_e=json.dumps([
+                    ['1 October 2008 - 30 September 2012', 'Elected (Geographical Constituency - Kowloon East)'],
+                    ['1 October 2012 - ', 'Elected (Functional Constituency - Finance)', '(Resigned)'],
+                ]))
+        ParsedPerson.objects.populate()
+
+    def test_populate(self):
+        res = ParsedMembership.objects.populate()
+        self.assertEqual(res['created'], 20)
+        membership = ParsedMembership.objects.get(uid='member-3.20121001.functional-constituency-finance')
+        self.assertEqual(membership.person.uid, 'member-3')
+        self.assertEqual(membership.end_date, None)
+        self.assertEqual(membership.note, 'Resigned')
+
+        res = ParsedMembership.objects.populate()
+        self.assertEqual((res['created'], res['updated'], res['unchanged']), (0, 0, 20))
+
+    def test_query_count_does_not_grow_with_rows(self):
+        # Load the people, the memberships and the raw members, insert, then bump the generation
+        bump_parsed_generation()
+        with self.assertNumQueries(9):
+            ParsedMembership.objects.populate()
+        RawMember.objects.filter(uid='member-3').update(service_e=json.dumps([
+            ['1 October 2008 - 30 September 2012', 'Elected (Geographical Constituency - Kowloon East)', '(Retired)'],
+            ['1 October 2012 - ', 'Elected (Functional Constituency - Finance)', '(Resigned)'],
+            ['1 October 2016 - ', 'Elected (Functional Constituency - Finance)'],
+        ]))
+        # ...then one update for the changed membership and an insert for the new one
+        with self.assertNumQueries(10):
+            ParsedMembership.objects.populate()
+
+
+class CommitteeMembershipPopulateTestCase(TestCase):
+    def setUp(self):
+        self.committees = [RawCommittee.objects.create(uid='committee-{}'.format(xx), name_e='Committee {}'.format(xx))
+                           for xx in range(3)]
+        self.members = []
+        for xx in range(5):
+            RawMember.objects.create(uid='member-{}'.format(xx), name_e='Member {}'.format(xx), gender=GENDER_M)
+            self.members.append(RawScheduleMember.objects.create(uid='smember-{}'.format(xx)))
+        ParsedCommittee.objects.populate()
+        ParsedPerson.objects.populate()
+        self.add_memberships(0, 10)
+
+    def add_memberships(self, start, end):
+        for xx in range(start, end):
+            RawCommitteeMembership.objects.create(
+                uid='cmembership-{}'.format(xx), committee=self.committees[xx % 3], member=self.members[xx % 5],
+                post_e='Member', start_date=datetime(2012, 10, 1))
+
+    def test_populate(self):
+        res = ParsedCommitteeMembership.objects.populate()
+        self.assertEqual(res['created'], 10)
+        obj = ParsedCommitteeMembership.objects.get(uid='cmembership-7')
+        self.assertEqual(obj.committee.uid, 'committee-1')
+        self.assertEqual(obj.person.uid, 'member-2')
+
+    def test_query_count_does_not_grow_with_rows(self):
+        # Committees, RawMember uids, people, existing memberships, raw memberships, the insert, then the
+        # generation bump
+        bump_parsed_generation()
+        with self.assertNumQueries(11):
+            ParsedCommitteeMembership.objects.populate()
+        ParsedCommitteeMembership.objects.all().delete()
+        self.add_memberships(10, 100)
+        # The same queries, except that the database may need the rows inserted in more than one batch
+        with self.assertNumQueries(10 + insert_batches(ParsedCommitteeMembership, 100)):
+            ParsedCommitteeMembership.objects.populate()
+
+
+class QuestionPopulateTestCase(TestCase):
+    def setUp(self):
+        RawCouncilAgenda.objects.create(uid='council_agenda-20140101-e', start_date=date(2014, 1, 1), language=LANG_EN)
+        ParsedCouncilMeeting.objects.populate()
+        members = [RawMember.objects.create(uid='member-{}'.format(xx), name_e='Member {}'.format(xx), gender=GENDER_M)
+                   for xx in range(2)]
+        ParsedPerson.objects.populate()
+        for xx in range(1, 5):
+            RawCouncilQuestion.objects.create(uid='question-20140101-{}-e'.format(xx), raw_date='1.1.2014',
+                                              number_and_type='Q. {} (Oral)'.format(xx), language=LANG_EN,
+                                              asker=members[0] if xx != 4 else None)
+            # The asker of the last question is only matched in Chinese
+            RawCouncilQuestion.objects.create(uid='question-20140101-{}-c'.format(xx), raw_date='1.1.2014',
+                                              number_and_type=u'Q. {} (口頭)'.format(xx), language=LANG_CN,
+                                              asker=members[1] if xx == 4 else None)
+        # No meeting on this date
+        RawCouncilQuestion.objects.create(uid='question-20140108-1-e', raw_date='8.1.2014',
+                                          number_and_type='Q. 1 (Oral)', language=LANG_EN, asker=members[0])
+
+    def check_questions(self, res):
+        self.assertEqual(res['created'], 4)
+        question = ParsedQuestion.objects.get(uid='cmeeting-20140101-q4')
+        self.assertEqual(question.asker.uid, 'member-1')
+        self.assertEqual(question.question_type, ParsedQuestion.ORAL)
+
+    def test_populate(self):
+        self.check_questions(ParsedQuestion.objects.populate(processes=1))
+        res = ParsedQuestion.objects.populate(processes=1)
+        self.assertEqual((res['created'], res['updated'], res['unchanged']), (0, 0, 4))
+
+    def test_populate_in_parallel(self):
+        self.check_questions(ParsedQuestion.objects.populate(processes=2))
+
+    def test_populate_error_restores_logger(self):
+        def fail(pairs, processes=None):
+            raise ValueError('Could not parse')
+        ParsedQuestion.objects._parse_pairs = fail
+        self.addCleanup(delattr, ParsedQuestion.objects, '_parse_pairs')
+        with self.assertRaises(ValueError):
+            ParsedQuestion.objects.populate(processes=1)
+        self.assertTrue(question_logger.deactivate)
+
+    def test_populate_since(self):
+        ParsedQuestion.objects.populate(processes=1)
+        # Only the pair with a change in either language is rebuilt
+        RawCouncilQuestion.objects.filter(uid='question-20140101-2-c').update(
+            last_parsed=datetime(2014, 3, 1, tzinfo=utc))
+        res = ParsedQuestion.objects.populate(processes=1, since=datetime(2014, 2, 1, tzinfo=utc))
+        self.assertEqual((res['created'], res['updated'], res['unchanged']), (0, 1, 0))
+        self.assertEqual(ParsedQuestion.objects.get(uid='cmeeting-20140101-q2').source_last_parsed,
+                         datetime(2014, 3, 1, tzinfo=utc))
+
+
+# What the hansards parse to, by uid, instead of parsing their files
+HANSARD_SPEECHES = {
+    'council_hansard-20140101-e': [
+        (u'HOSPITAL BEDS', u'MR CHAN TAI-MAN', u'<p>President, the <b>waiting</b> time is too long.</p>'),
+        (u'HOSPITAL BEDS', u'SECRETARY FOR FOOD AND HEALTH', u'<p>We are adding beds.</p>'),
+        (u'HOSPITAL BEDS', u'PRESIDENT', u'<p> </p>'),
+    ],
+    'council_hansard-20140101-c': [(u'醫院病床', u'陳大文議員', u'<p>主席，輪候時間太長。</p>')],
+    'council_hansard-20140102-e': [(u'ADJOURNMENT', u'MR CHAN TAI-MAN', u'<p>Thank you.</p>')],
+    # The parts of a hansard, which are parsed from the record they are merged into
+    'council_hansard-20140108p-e': [(u'MOTION', u'MR CHAN TAI-MAN', u'<p>Part of a hansard.</p>')],
+}
+
+
+class FakeHansardParser(object):
+    def __init__(self, speeches):
+        self.speeches = speeches
+
+    def get_speeches(self):
+        return self.speeches
+
+
+def get_fake_parser(hansard):
+    speeches = HANSARD_SPEECHES.get(hansard.uid)
+    return FakeHansardParser(speeches) if speeches is not None else None
+
+
+class SpeechPopulateTestCase(TestCase):
+    def setUp(self):
+        # Also in the forked parser processes
+        original = RawCouncilHansard.get_parser
+        RawCouncilHansard.get_parser = get_fake_parser
+        self.addCleanup(setattr, RawCouncilHansard, 'get_parser', original)
+        self.person = ParsedPerson.objects.create(uid='member-1', name_e='CHAN Tai-man', name_c=u'陳大文',
+                                                  gender=GENDER_M)
+        self.meeting = ParsedCouncilMeeting.objects.create(uid='cmeeting-20140101',
+                                                           start_date=datetime(2014, 1, 1, 3, tzinfo=utc))
+        self.before = datetime(2014, 1, 3, tzinfo=utc)
+        for uid, language in [('council_hansard-20140101-e', LANG_EN), ('council_hansard-20140101-c', LANG_CN),
+                              ('council_hansard-20140102-e', LANG_EN), ('council_hansard-20140108-e', LANG_EN)]:
+            RawCouncilHansard.objects.create(uid=uid, language=language, local_filename='hansard.doc',
+                                             last_parsed=self.before)
+        # Neither of these can be parsed
+        RawCouncilHansard.objects.create(uid='council_hansard-20140115-f', language=LANG_BOTH,
+                                         local_filename='hansard.mp3')
+        RawCouncilHansard.objects.create(uid='council_hansard-20140115-e', language=LANG_EN)
+        RawCouncilHansard.objects.create(uid='council_hansard-20140116-e', language=LANG_EN, local_filename='')
+        # Nor are the parts, which share a uid
+        for xx in range(2):
+            RawCouncilHansard.objects.create(uid='council_hansard-20140108p-e', language=LANG_EN,
+                                             local_filename='part{}.doc'.format(xx), last_parsed=self.before)
+
+    def check_speeches(self, res, counts=(4, 0, 0)):
+        self.assertEqual((res['created'], res['updated'], res['unchanged']), counts)
+        speech = ParsedSpeech.objects.get(uid='council_hansard-20140101-e-0')
+        self.assertEqual((speech.meeting, speech.speaker, speech.date), (self.meeting, self.person, date(2014, 1, 1)))
+        self.assertEqual(speech.text, u'President, the waiting time is too long.')
+        self.assertEqual(speech.source_last_parsed, self.before)
+        speech = ParsedSpeech.objects.get(uid='council_hansard-20140101-e-1')
+        self.assertEqual((speech.speaker, speech.speaker_name), (None, u'SECRETARY FOR FOOD AND HEALTH'))
+        self.assertEqual(ParsedSpeech.objects.get(uid='council_hansard-20140101-c-0').speaker, self.person)
+        # The second day of a meeting
+        speech = ParsedSpeech.objects.get(uid='council_hansard-20140102-e-0')
+        self.assertEqual((speech.meeting, speech.speaker), (None, self.person))
+
+    def test_populate(self):
+        self.check_speeches(ParsedSpeech.objects.populate(processes=1))
+        # The speeches are replaced
+        self.check_speeches(ParsedSpeech.objects.populate(processes=1), (0, 0, 4))
+        self.assertEqual(ParsedSpeech.objects.count(), 4)
+        self.assertFalse(ParsedSpeech.objects.filter(hansard_uid='council_hansard-20140108p-e').exists())
+
+    def test_populate_in_parallel(self):
+        self.check_speeches(ParsedSpeech.objects.populate(processes=2))
+
+    def test_populate_since(self):
+        ParsedSpeech.objects.populate(processes=1)
+        after = datetime(2014, 3, 1, tzinfo=utc)
+        RawCouncilHansard.objects.filter(uid='council_hansard-20140101-c').update(last_parsed=after)
+        HANSARD_SPEECHES['council_hansard-20140101-c'] = [
+            (u'醫院病床', u'陳大文議員', u'<p>主席，輪候時間太長了。</p>'), (u'醫院病床', u'主席', u'<p>多謝。</p>')]
+        self.addCleanup(HANSARD_SPEECHES.__setitem__, 'council_hansard-20140101-c',
+                        [(u'醫院病床', u'陳大文議員', u'<p>主席，輪候時間太長。</p>')])
+        res = ParsedSpeech.objects.populate(processes=1, since=datetime(2014, 2, 1, tzinfo=utc))
+        self.assertEqual((res['created'], res['updated'], res['unchanged']), (1, 1, 0))
+        self.assertEqual(ParsedSpeech.objects.get_last_populated(), after)
+        self.assertEqual(ParsedSpeech.objects.count(), 5)
+
+    def test_count_by_speaker_and_year(self):
+        ParsedSpeech.objects.populate(processes=1)
+        self.assertEqual(ParsedSpeech.objects.count_by_speaker_and_year(),
+                         [{'speaker': self.person.id, 'year': 2014, 'count': 3}])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('populate_speeches', processes=1, stdout=out)
+        self.assertIn('4 speeches created', out.getvalue())
+        self.assertIn('Search index: 4 speeches', out.getvalue())
+
+
+class IncrementalPopulateTestCase(TestCase):
+    def setUp(self):
+        self.before = datetime(2014, 1, 1, tzinfo=utc)
+        self.since = datetime(2014, 2, 1, tzinfo=utc)
+        self.after = datetime(2014, 3, 1, tzinfo=utc)
+        for xx in range(3):
+            RawCommittee.objects.create(uid='committee-{}'.format(xx), name_e='Committee {}'.format(xx),
+                                        last_parsed=self.before)
+            RawMember.objects.create(
+                uid='member-{}'.format(xx), name_e='Member {}'.format(xx), gender=GENDER_M, last_parsed=self.before,
+                service_e=json.dumps([['1 October 2012 - ', 'Elected (Functional Constituency - Finance)']]))
+            RawCommitteeMembership.objects.create(
+                uid='cmembership-{}'.format(xx), committee=RawCommittee.objects.get(uid='committee-{}'.format(xx)),
+                member=RawScheduleMember.objects.create(uid='smember-{}'.format(xx), last_parsed=self.before),
+                post_e='Member', start_date=datetime(2012, 10, 1, tzinfo=utc), last_parsed=self.before)
+        for model in [ParsedCommittee, ParsedPerson, ParsedMembership, ParsedCommitteeMembership]:
+            model.objects.populate()
+
+    def test_populate_since(self):
+        self.assertEqual(ParsedCommittee.objects.get_last_populated(), self.before)
+        RawCommittee.objects.filter(uid='committee-1').update(name_e='Finance Committee', last_parsed=self.after)
+        res = ParsedCommittee.objects.populate(since=self.since)
+        self.assertEqual((res['created'], res['updated'], res['unchanged']), (0, 1, 0))
+        self.assertEqual(ParsedCommittee.objects.get(uid='committee-1').name_e, 'Finance Committee')
+        self.assertEqual(ParsedCommittee.objects.get_last_populated(), self.after)
+        # Nothing else has changed since
+        res = ParsedCommittee.objects.populate(since=self.after)
+        self.assertEqual((res['created'], res['updated'], res['unchanged']), (0, 0, 0))
+
+    def test_member_service_change_rebuilds_memberships(self):
+        RawMember.objects.filter(uid='member-2').update(last_parsed=self.after, service_e=json.dumps([
+            ['1 October 2012 - ', 'Elected (Functional Constituency - Finance)', '(Resigned)']]))
+        res = ParsedMembership.objects.populate(since=self.since)
+        self.assertEqual((res['created'], res['updated'], res['unchanged']), (0, 1, 0))
+        self.assertEqual(ParsedMembership.objects.get(person__uid='member-2').note, 'Resigned')
+        self.assertEqual(ParsedMembership.objects.count(), 3)
+
+    def test_committee_change_rebuilds_committee_memberships(self):
+        RawCommittee.objects.filter(uid='committee-0').update(last_parsed=self.after)
+        res = ParsedCommitteeMembership.objects.populate(since=self.since)
+        self.assertEqual((res['created'], res['updated'], res['unchanged']), (0, 1, 0))
+        self.assertEqual(ParsedCommitteeMembership.objects.get(uid='cmembership-0').source_last_parsed, self.after)
+
+    def test_new_member_rebuilds_committee_memberships(self):
+        # The schedule member only gets a person once its RawMember turns up
+        RawCommitteeMembership.objects.create(
+            uid='cmembership-3', committee=RawCommittee.objects.get(uid='committee-0'),
+            member=RawScheduleMember.objects.create(uid='smember-3', last_parsed=self.before),
+            post_e='Member', start_date=datetime(2012, 10, 1, tzinfo=utc), last_parsed=self.before)
+        RawMember.objects.create(uid='member-3', name_e='Member 3', gender=GENDER_M, last_parsed=self.after)
+        ParsedPerson.objects.populate(since=self.since)
+        res = ParsedCommitteeMembership.objects.populate(since=self.since)
+        self.assertEqual(res['created'], 1)
+        self.assertEqual(ParsedCommitteeMembership.objects.get(uid='cmembership-3').person.uid, 'member-3')
+
+    def test_changed_only_command(self):
+        RawCommittee.objects.create(uid='committee-3', name_e='Committee 3', last_parsed=self.after)
+        call_command('raw2parsed', changed_only=True, stdout=StringIO())
+        self.assertTrue(ParsedCommittee.objects.filter(uid='committee-3').exists())
+        self.assertEqual(ParsedCommittee.objects.get_last_populated(), self.after)
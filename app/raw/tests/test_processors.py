@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+from celery import current_app
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from raw import processors, tasks
+from raw.models import RawCommittee, RawCouncilHansard, ScrapeJob, LANG_EN
+from raw.processors.base import BaseProcessor, file_wrapper, item_fingerprint, split_items_file
+from raw.processors import library_hansard
+from raw.processors.library_hansard import LibraryHansardProcessor
+from raw.processors.schedule import ScheduleCommitteeProcessor
+from raw.scraper.pipelines import DatabasePipeline
+
+
+logging.disable(logging.CRITICAL)
+
+
+def make_feed(items):
+    return StringIO(u'\n'.join([json.dumps(xx) for xx in items]))
+
+
+class FingerprintTestCase(TestCase):
+    def setUp(self):
+        self.items = [
+            {'type': 'ScheduleCommittee', 'id': 1, 'code': 'cm', 'name_e': 'Council', 'name_c': u'立法會',
+             'url_e': '', 'url_c': ''},
+            {'type': 'ScheduleCommittee', 'id': 2, 'code': 'fc', 'name_e': 'Finance', 'name_c': u'財務',
+             'url_e': '', 'url_c': ''},
+        ]
+
+    def test_fingerprint_ignores_key_order(self):
+        reordered = dict(reversed(list(self.items[0].items())))
+        self.assertEqual(item_fingerprint(self.items[0]), item_fingerprint(reordered))
+        self.assertNotEqual(item_fingerprint(self.items[0]), item_fingerprint(self.items[1]))
+
+    def test_unchanged_items_are_skipped(self):
+        proc = ScheduleCommitteeProcessor(make_feed(self.items))
+        proc.process()
+        self.assertEqual(proc._count_created, 2)
+
+        proc = ScheduleCommitteeProcessor(make_feed(self.items))
+        proc.process()
+        self.assertEqual(proc._count_unchanged, 2)
+        self.assertEqual(proc._count_updated, 0)
+
+    def test_changed_items_are_updated(self):
+        ScheduleCommitteeProcessor(make_feed(self.items)).process()
+        self.items[1]['name_e'] = 'Finance Committee'
+        proc = ScheduleCommitteeProcessor(make_feed(self.items))
+        proc.process()
+        self.assertEqual(proc._count_unchanged, 1)
+        self.assertEqual(proc._count_updated, 1)
+        self.assertEqual(RawCommittee.objects.get(uid='committee-2').name_e, 'Finance Committee')
+
+    def test_force_rewrites_unchanged_items(self):
+        ScheduleCommitteeProcessor(make_feed(self.items)).process()
+        proc = ScheduleCommitteeProcessor(make_feed(self.items), force=True)
+        proc.process()
+        self.assertEqual(proc._count_unchanged, 0)
+        self.assertEqual(proc._count_updated, 2)
+
+
+class FileWrapperTestCase(TestCase):
+    def setUp(self):
+        self.items = [
+            {'type': 'LibraryResultPage', 'title': 'Hansard', 'link': 'http://example.com/1'},
+            {'type': 'LibraryHansard', 'title_en': 'Hong Kong Hansard 2014.10.15', 'links': []},
+            # The type name of another item can turn up in a field value
+            {'type': 'LibraryResultPage', 'title': 'LibraryHansard', 'link': 'http://example.com/2'},
+        ]
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_all_types(self):
+        res = list(file_wrapper(make_feed(self.items)))
+        self.assertEqual(res, self.items)
+
+    def test_filter_types(self):
+        res = list(file_wrapper(make_feed(self.items), ['LibraryHansard']))
+        self.assertEqual(res, [self.items[1]])
+
+    def test_gzip_feed(self):
+        path = os.path.join(self.tmp_dir, 'feed.jsonl.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(make_feed(self.items).getvalue().encode('utf-8'))
+        res = list(file_wrapper(path, ['LibraryHansard']))
+        self.assertEqual(res, [self.items[1]])
+
+
+class ShardTestCase(TestCase):
+    def setUp(self):
+        self.items = [
+            {'type': 'ScheduleCommittee', 'id': xx, 'code': 'c{}'.format(xx), 'name_e': 'Committee {}'.format(xx),
+             'name_c': u'委員會', 'url_e': '', 'url_c': ''}
+            for xx in range(50)
+        ]
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'feed.jsonl')
+        with open(self.path, 'wb') as f:
+            f.write(make_feed(self.items).getvalue().encode('utf-8') + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_shards_cover_file(self):
+        byte_ranges = split_items_file(self.path, 4)
+        self.assertEqual(len(byte_ranges), 4)
+        self.assertEqual(byte_ranges[0][0], 0)
+        self.assertEqual(byte_ranges[-1][1], os.path.getsize(self.path))
+        res = []
+        for byte_range in byte_ranges:
+            res.extend(file_wrapper(self.path, byte_range=byte_range))
+        self.assertEqual(res, self.items)
+
+    def test_more_shards_than_lines(self):
+        byte_ranges = split_items_file(self.path, 500)
+        res = []
+        for byte_range in byte_ranges:
+            res.extend(file_wrapper(self.path, byte_range=byte_range))
+        self.assertEqual(res, self.items)
+
+    def test_gzip_is_not_split(self):
+        gz_path = self.path + '.gz'
+        with open(self.path, 'rb') as f_in:
+            with gzip.open(gz_path, 'wb') as f_out:
+                f_out.write(f_in.read())
+        self.assertEqual(split_items_file(gz_path, 4), [(0, None)])
+
+    def test_merge_counts(self):
+        merged = ScheduleCommitteeProcessor(self.path)
+        for byte_range in split_items_file(self.path, 3):
+            proc = ScheduleCommitteeProcessor(self.path, shard=byte_range)
+            proc.process()
+            merged.merge_counts(proc.get_counts())
+        self.assertEqual(merged._count_created, 50)
+        self.assertEqual(RawCommittee.objects.count(), 50)
+
+
+class RecordingProcessor(BaseProcessor):
+    item_types = ['LibraryHansard']
+    shardable = True
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingProcessor, self).__init__(*args, **kwargs)
+        self.batches = []
+        self.finalized = False
+
+    def process_items(self):
+        self.batches.append(list(self._items()))
+
+    def finalize(self):
+        self.finalized = True
+
+
+class DatabasePipelineTestCase(TestCase):
+    def setUp(self):
+        processors.PROCESS_MAP['test_spider'] = RecordingProcessor
+        self.spider = type('Spider', (object,), {'name': 'test_spider'})()
+
+    def tearDown(self):
+        del processors.PROCESS_MAP['test_spider']
+
+    def test_batches(self):
+        pipeline = DatabasePipeline(2, 60, 'feed.jsonl')
+        pipeline.open_spider(self.spider)
+        for xx in range(5):
+            item = {'type': 'LibraryHansard', 'title_en': 'Hansard {}'.format(xx)}
+            self.assertEqual(pipeline.process_item(item, self.spider), item)
+        pipeline.process_item({'type': 'LibraryResultPage'}, self.spider)
+        pipeline.close_spider(self.spider)
+
+        batches = pipeline.processor.batches
+        self.assertEqual([len(xx) for xx in batches], [2, 2, 1])
+        self.assertEqual(batches[0][0], {'type': 'LibraryHansard', 'title_en': 'Hansard 0'})
+        self.assertTrue(pipeline.processor.finalized)
+
+    def test_job_is_marked_loaded(self):
+        job = ScrapeJob.objects.create(spider='test_spider', scheduled=timezone.now(), job_id='1',
+                                       raw_response='feed.jsonl')
+        pipeline = DatabasePipeline(2, 60, 'feed.jsonl')
+        pipeline.open_spider(self.spider)
+        pipeline.process_item({'type': 'LibraryHansard', 'title_en': 'Hansard'}, self.spider)
+        pipeline.close_spider(self.spider)
+        job = ScrapeJob.objects.get(id=job.id)
+        self.assertTrue(job.loaded_while_crawling)
+        self.assertIsNotNone(job.last_fetched)
+
+    def test_unsupported_spider(self):
+        self.spider.name = 'schedule_committee'
+        pipeline = DatabasePipeline(2, 60, 'feed.jsonl')
+        pipeline.open_spider(self.spider)
+        pipeline.process_item({'type': 'ScheduleCommittee'}, self.spider)
+        pipeline.close_spider(self.spider)
+        self.assertIsNone(pipeline.processor)
+
+
+class CountingProcessor(BaseProcessor):
+    runs = 0
+
+    def process(self):
+        CountingProcessor.runs += 1
+
+
+class ProcessScrapeTestCase(TestCase):
+    def setUp(self):
+        processors.PROCESS_MAP['test_spider'] = CountingProcessor
+        CountingProcessor.runs = 0
+
+    def tearDown(self):
+        del processors.PROCESS_MAP['test_spider']
+
+    def add_job(self, **kwargs):
+        return ScrapeJob.objects.create(spider='test_spider', scheduled=timezone.now(), job_id='1',
+                                        raw_response='feed.jsonl', completed=timezone.now(), **kwargs)
+
+    def test_processed_job_is_processed_again(self):
+        self.add_job(last_fetched=timezone.now())
+        tasks.process_scrape('test_spider')
+        self.assertEqual(CountingProcessor.runs, 1)
+
+    def test_job_loaded_while_crawling_is_skipped(self):
+        self.add_job(last_fetched=timezone.now(), loaded_while_crawling=True)
+        tasks.process_scrape('test_spider')
+        # force only stops the processors skipping unchanged items
+        tasks.process_scrape('test_spider', force=True)
+        self.assertEqual(CountingProcessor.runs, 0)
+
+
+class RecordingHansardProcessor(LibraryHansardProcessor):
+    # Output paths of the merges that fail
+    failing = ()
+
+    def _run_merges(self, merge_args):
+        self.merge_args = merge_args
+        results = []
+        for path_list, out_htmlpath in merge_args:
+            results.append(out_htmlpath not in self.failing)
+            if results[-1]:
+                open(out_htmlpath, 'wb').close()
+        return results
+
+
+class MergePartsTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmp_dir, 'full'))
+        self.settings_override = override_settings(SCRAPY_FILES_PATH=self.tmp_dir)
+        self.settings_override.enable()
+        for date in ['20120629', '20130101']:
+            for part in ['1', '2']:
+                local_filename = 'full/{}-{}.doc'.format(date, part)
+                open(os.path.join(self.tmp_dir, local_filename), 'wb').close()
+                RawCouncilHansard.objects.create(
+                    uid='council_hansard-{}p-e'.format(date), title='H{} (English Version) Part {}'.format(date, part),
+                    raw_date=date, language=LANG_EN, local_filename=local_filename, fingerprint=part)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.tmp_dir)
+
+    def merge(self, touched_uids, force=False, failing=()):
+        proc = RecordingHansardProcessor(make_feed([]), force=force)
+        proc.failing = [os.path.join(self.tmp_dir, 'full', xx) for xx in failing]
+        proc.merge_counts({'touched_uids': touched_uids})
+        proc._merge_parts()
+        return proc
+
+    def test_only_touched_parts_are_merged(self):
+        proc = self.merge(['council_hansard-20120629p-e'])
+        self.assertEqual(proc._count_merged, 1)
+        self.assertEqual([len(xx[0]) for xx in proc.merge_args], [2])
+        merged = RawCouncilHansard.objects.get(uid='council_hansard-20120629-e')
+        self.assertTrue(merged.created_by_parts)
+        self.assertEqual(merged.local_filename, 'full/council_hansard-20120629p-e-merge')
+        self.assertFalse(RawCouncilHansard.objects.filter(uid='council_hansard-20130101-e').exists())
+
+    def test_unchanged_parts_are_not_merged_again(self):
+        self.merge(['council_hansard-20120629p-e'])
+        proc = self.merge(['council_hansard-20120629p-e'])
+        self.assertEqual(proc._count_merged, 0)
+
+        RawCouncilHansard.objects.filter(title='H20120629 (English Version) Part 2').update(fingerprint='changed')
+        proc = self.merge(['council_hansard-20120629p-e'])
+        self.assertEqual(proc._count_merged, 1)
+        self.assertEqual(RawCouncilHansard.objects.filter(uid='council_hansard-20120629-e').count(), 1)
+
+    def test_force_merges_again(self):
+        self.merge(['council_hansard-20120629p-e'])
+        proc = self.merge(['council_hansard-20120629p-e'], force=True)
+        self.assertEqual(proc._count_merged, 1)
+
+    def test_failed_merges_are_retried(self):
+        proc = self.merge(['council_hansard-20120629p-e'], failing=['council_hansard-20120629p-e-merge'])
+        self.assertEqual(proc._count_merged, 0)
+        self.assertEqual(RawCouncilHansard.objects.filter(merge_failed=True).count(), 2)
+        # The parts haven't changed, so they aren't touched by the next run
+        proc = self.merge([])
+        self.assertEqual(proc._count_merged, 1)
+        self.assertFalse(RawCouncilHansard.objects.filter(merge_failed=True).exists())
+        self.assertTrue(RawCouncilHansard.objects.get(uid='council_hansard-20120629-e').created_by_parts)
+
+    def test_merges_run_serially_in_daemonic_processes(self):
+        process = multiprocessing.current_process()
+        process.daemon = True
+        self.addCleanup(setattr, process, 'daemon', False)
+        original = library_hansard._merge_docx_args
+        library_hansard._merge_docx_args = lambda args: os.getpid()
+        self.addCleanup(setattr, library_hansard, '_merge_docx_args', original)
+        proc = LibraryHansardProcessor(make_feed([]))
+        self.assertEqual(proc._run_merges([([], 'a'), ([], 'b')]), [os.getpid(), os.getpid()])
+
+    def test_appendices_are_not_merged(self):
+        RawCouncilHansard.objects.create(uid='council_hansard-20130101-e', title='H20130101 (English Version)')
+        proc = self.merge(['council_hansard-20130101p-e'])
+        self.assertEqual(proc._count_merged, 0)
+
+
+class HansardUpsertTestCase(TestCase):
+    def make_item(self, date, source_url='http://example.com/1'):
+        links = [[u'H{} (English Version)'.format(date), 'http://example.com/{}e.doc'.format(date)],
+                 [u'H{} (中文版)'.format(date), 'http://example.com/{}c.doc'.format(date)]]
+        return {
+            'type': 'LibraryHansard', 'title_en': 'Hong Kong Hansard {}.{}.{}'.format(date[:4], date[4:6], date[6:]),
+            'links': links, 'files': [{'url': xx[1], 'path': 'full/' + xx[1][-13:]} for xx in links],
+            'source_url': source_url,
+        }
+
+    def test_records_are_saved_once_per_title(self):
+        proc = LibraryHansardProcessor(make_feed([]))
+        proc.SAVE_BATCH_SIZE = 1
+        proc.process_batch([self.make_item('20141015'), self.make_item('20141016')])
+        proc.process_batch([self.make_item('20141015', 'http://example.com/2')])
+        self.assertEqual(proc._count_created, 4)
+        self.assertEqual(proc._count_updated, 2)
+        self.assertEqual(RawCouncilHansard.objects.count(), 4)
+        self.assertEqual(RawCouncilHansard.objects.get(title=u'H20141015 (中文版)').crawled_from, 'http://example.com/2')
+
+        proc = LibraryHansardProcessor(make_feed([self.make_item('20141015', 'http://example.com/2')]))
+        proc.process_items()
+        self.assertEqual(proc._count_unchanged, 2)
+
+
+class SerialPool(object):
+    """
+    Stands in for the local process pool, whose workers would write to copies of the in-memory test database
+    """
+    def __init__(self, processes):
+        self.processes = processes
+
+    def map(self, func, iterable):
+        return map(func, iterable)
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class FinalizeRecordingHansardProcessor(RecordingHansardProcessor):
+    # The counts of each processor that ran finalize
+    finalized = []
+
+    def finalize(self):
+        super(FinalizeRecordingHansardProcessor, self).finalize()
+        FinalizeRecordingHansardProcessor.finalized.append(self.get_counts())
+
+
+class ShardedProcessScrapeTestCase(TestCase):
+    ROW_FIELDS = ('uid', 'title', 'raw_date', 'language', 'url', 'local_filename', 'crawled_from', 'fingerprint',
+                  'created_by_parts', 'merge_failed')
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        os.mkdir(os.path.join(self.tmp_dir, 'full'))
+        self.settings_override = override_settings(SCRAPY_FILES_PATH=self.tmp_dir)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        processors.PROCESS_MAP['test_spider'] = FinalizeRecordingHansardProcessor
+        self.addCleanup(processors.PROCESS_MAP.pop, 'test_spider')
+        FinalizeRecordingHansardProcessor.finalized = []
+        items = []
+        for day in range(1, 13):
+            date = '201410{:02d}'.format(day)
+            items.append({'type': 'LibraryResultPage', 'url': 'http://example.com/page{}'.format(day)})
+            items.append(self.make_item(date, [u'H{} (English Version)'.format(date), u'H{} (中文版)'.format(date)]))
+        # The parts of a hansard, to be merged once every shard is loaded.  The same hansard again, with its
+        # parts in a different order, at the other end of the file
+        parts = [u'H20120629 (English Version) Part {}'.format(xx) for xx in [1, 2]]
+        items.insert(3, self.make_item('20120629', parts))
+        items.append(self.make_item('20120629', parts[::-1], 'http://example.com/again'))
+        self.path = os.path.join(self.tmp_dir, 'feed.jsonl')
+        with open(self.path, 'wb') as f:
+            f.write(make_feed(items).getvalue().encode('utf-8') + '\n')
+        self.job = ScrapeJob.objects.create(spider='test_spider', scheduled=timezone.now(), job_id='1',
+                                            raw_response=self.path, completed=timezone.now())
+
+    def make_item(self, date, titles, source_url='http://example.com/1'):
+        links = [[title, 'http://example.com/{}-{}.doc'.format(date, i)] for i, title in enumerate(titles)]
+        for url in [xx[1] for xx in links]:
+            open(os.path.join(self.tmp_dir, 'full', url.rsplit('/', 1)[1]), 'wb').close()
+        return {
+            'type': 'LibraryHansard', 'title_en': 'Hong Kong Hansard {}.{}.{}'.format(date[:4], date[4:6], date[6:]),
+            'links': links, 'files': [{'url': xx[1], 'path': 'full/' + xx[1].rsplit('/', 1)[1]} for xx in links],
+            'source_url': source_url,
+        }
+
+    def process(self, process_scrape, shards):
+        """
+        Processes the feed into an empty table.  Returns the rows, and the counts the finalize calls saw
+        """
+        RawCouncilHansard.objects.all().delete()
+        FinalizeRecordingHansardProcessor.finalized = []
+        process_scrape('test_spider', shards=shards)
+        rows = list(RawCouncilHansard.objects.order_by('uid', 'title').values_list(*self.ROW_FIELDS))
+        # The pks depend on the database
+        finalized = [dict((k, v) for k, v in xx.items() if k != 'saved_pks')
+                     for xx in FinalizeRecordingHansardProcessor.finalized]
+        return rows, finalized
+
+    def check_shards(self, process_scrape):
+        byte_ranges = split_items_file(self.path, 3)
+        self.assertEqual(len(byte_ranges), 3)
+        # The shards start on the line after where the file would be cut evenly, so no item is read by two
+        # shards or by neither
+        size = os.path.getsize(self.path)
+        self.assertNotIn(size // 3, [xx[0] for xx in byte_ranges])
+        rows, finalized = self.process(tasks.process_scrape, 1)
+        self.assertEqual(len(finalized), 1)
+        # Every record but the merged one comes from an item
+        merged_uid = 'council_hansard- 20120629-e'
+        self.assertEqual(finalized[0]['touched_uids'], sorted(set(xx[0] for xx in rows) - set([merged_uid])))
+        self.assertEqual((finalized[0]['created'], finalized[0]['updated'], finalized[0]['merged']), (26, 2, 1))
+        sharded_rows, sharded_finalized = self.process(process_scrape, 3)
+        self.assertEqual(sharded_rows, rows)
+        self.assertEqual(sharded_finalized, finalized)
+
+    def test_local_pool(self):
+        original = tasks.billiard.Pool
+        tasks.billiard.Pool = SerialPool
+        self.addCleanup(setattr, tasks.billiard, 'Pool', original)
+        self.check_shards(tasks.process_scrape)
+
+    def test_chord(self):
+        for name, value in [('CELERY_ALWAYS_EAGER', True), ('CELERY_EAGER_PROPAGATES_EXCEPTIONS', True)]:
+            self.addCleanup(setattr, current_app.conf, name, getattr(current_app.conf, name))
+            setattr(current_app.conf, name, value)
+        self.check_shards(lambda *args, **kwargs: tasks.process_scrape.delay(*args, **kwargs).get())
+
+    def test_duplicates_from_parallel_shards(self):
+        # Two shards that ran at the same time both created a record the file has twice
+        first, second = [RawCouncilHansard.objects.create(uid='council_hansard-20141001-e', crawled_from=xx,
+                                                          title='H20141001 (English Version)')
+                         for xx in ['first', 'second']]
+        proc = FinalizeRecordingHansardProcessor(make_feed([]))
+        for obj in [first, second]:
+            proc.merge_counts({'created': 1, 'touched_uids': [obj.uid], 'saved_pks': {obj.title: obj.pk}})
+        proc.finalize()
+        self.assertEqual(RawCouncilHansard.objects.get().crawled_from, 'second')
+        self.assertEqual((proc._count_created, proc._count_updated), (1, 1))
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+import logging
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils.timezone import utc
+from raw import search
+from raw.docs.hansard import CouncilHansard
+from raw.models import (Override, ParsedCouncilMeeting, ParsedPerson, ParsedQuestion, ParsedSpeech, SearchEntry,
+                        GENDER_M, LANG_CN, LANG_EN)
+from raw.tokenizers import BigramTokenizer
+
+
+logging.disable(logging.CRITICAL)
+
+
+class SearchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.person = ParsedPerson.objects.create(uid='member-1', name_e='CHAN Tai-man', name_c=u'陳大文',
+                                                  gender=GENDER_M)
+        self.meeting = ParsedCouncilMeeting.objects.create(uid='cmeeting-20140101',
+                                                           start_date=datetime(2014, 1, 1, 3, tzinfo=utc))
+        self.add_question(1, u'<p>Will the Government build more public housing?</p>', u'<p>The housing supply target</p>')
+        self.add_question(2, u'<p>How many hospital beds are there?</p>', u'<p>There are 27 000 beds</p>')
+
+    def add_question(self, number, body, reply, parsed=datetime(2014, 1, 2, tzinfo=utc)):
+        return ParsedQuestion.objects.create(
+            uid='cmeeting-20140101-q{}'.format(number), meeting=self.meeting, number=number, asker=self.person,
+            question_type=ParsedQuestion.ORAL, ask_subject_e='Subject {}'.format(number), body_e=body,
+            reply_e=reply, repliers_e='Secretary for Transport and Housing', source_last_parsed=parsed)
+
+    def test_questions(self):
+        self.assertEqual(search.update_index(), {'speeches': 0, 'questions': 4, 'removed': 0})
+        results = search.search('public housing')
+        self.assertEqual([(xx.source_uid, xx.kind) for xx in results], [('cmeeting-20140101-q1', SearchEntry.QUESTION)])
+        entry = results[0]
+        self.assertEqual(entry.speaker, 'CHAN Tai-man')
+        self.assertEqual(entry.date, datetime(2014, 1, 1).date())
+        self.assertEqual(entry.section, 'Subject 1')
+        self.assertIn(u'<mark>housing</mark>', search.highlight(entry.snippet))
+        self.assertEqual(len(search.search('housing')), 2)
+        self.assertEqual([xx.kind for xx in search.search('housing', kind=SearchEntry.REPLY)], [SearchEntry.REPLY])
+        self.assertEqual(search.search('"housing'), search.search('housing'))
+        self.assertEqual(search.search('ferries'), [])
+
+    def test_incremental(self):
+        search.update_index()
+        question = ParsedQuestion.objects.get(number=2)
+        question.body_e = u'<p>How many ferries are there?</p>'
+        question.source_last_parsed = datetime(2014, 1, 3, tzinfo=utc)
+        question.save()
+        self.add_question(3, u'<p>Ferries to the islands</p>', u'', parsed=datetime(2014, 1, 3, tzinfo=utc))
+        # Only the changed questions
+        self.assertEqual(search.update_index(), {'speeches': 0, 'questions': 3, 'removed': 0})
+        self.assertEqual(sorted([xx.source_uid for xx in search.search('ferries')]),
+                         ['cmeeting-20140101-q2', 'cmeeting-20140101-q3'])
+        self.assertEqual(search.search('hospital'), [])
+        self.assertEqual(SearchEntry.objects.count(), 5)
+
+    def test_speeches(self):
+        parsed = datetime(2014, 1, 2, tzinfo=utc)
+        for order, (speaker, text) in enumerate([(u'MR CHAN TAI-MAN', u'President, the waiting time is too long.'),
+                                                 (u'SECRETARY FOR FOOD AND HEALTH', u'We are adding beds.')]):
+            ParsedSpeech.objects.create(uid='council_hansard-20140101-e-{}'.format(order), meeting=self.meeting,
+                                        hansard_uid='council_hansard-20140101-e', date=datetime(2014, 1, 1).date(),
+                                        section=u'HOSPITAL BEDS', order=order, speaker_name=speaker,
+                                        language=LANG_EN, text=text, source_last_parsed=parsed)
+        self.assertEqual(search.update_index(), {'speeches': 2, 'questions': 4, 'removed': 0})
+        results = search.search('waiting time', kind=SearchEntry.SPEECH)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].source_uid, 'council_hansard-20140101-e')
+        self.assertEqual(results[0].speaker, u'MR CHAN TAI-MAN')
+        self.assertEqual(results[0].date, datetime(2014, 1, 1).date())
+        self.assertEqual(results[0].text, u'President, the waiting time is too long.')
+        # Nothing changed
+        self.assertEqual(search.update_index(), {'speeches': 0, 'questions': 0, 'removed': 0})
+        # Deactivating a speech indexes its hansard again
+        Override.objects.set_deactivated([ParsedSpeech.objects.get(order=1)])
+        self.assertEqual(search.update_index(), {'speeches': 1, 'questions': 0, 'removed': 0})
+        self.assertEqual(search.search('adding beds', kind=SearchEntry.SPEECH), [])
+
+    def test_deactivated_questions_are_removed(self):
+        search.update_index()
+        question = ParsedQuestion.objects.get(number=2)
+        Override.objects.set_deactivated([question])
+        self.assertEqual(search.update_index(), {'speeches': 0, 'questions': 0, 'removed': 2})
+        self.assertEqual(search.search('hospital'), [])
+        # And reactivating it indexes it again
+        Override.objects.set_deactivated([question], False)
+        self.assertEqual(search.update_index(), {'speeches': 0, 'questions': 2, 'removed': 0})
+        self.assertEqual([xx.source_uid for xx in search.search('hospital')], ['cmeeting-20140101-q2'])
+
+    def test_overrides_are_indexed(self):
+        search.update_index()
+        override = Override(ref_model='parsedquestion', ref_uid='cmeeting-20140101-q1')
+        override.merge_payload({'body_e': u'<p>Will the Government build more ferry piers?</p>'})
+        override.save()
+        self.assertTrue(SearchEntry.objects.get(source_uid='cmeeting-20140101-q1', kind=SearchEntry.QUESTION).stale)
+        # Only the question with the override
+        self.assertEqual(search.update_index(), {'speeches': 0, 'questions': 2, 'removed': 0})
+        self.assertEqual([xx.source_uid for xx in search.search('ferry piers')], ['cmeeting-20140101-q1'])
+        self.assertEqual(search.search('public housing'), [])
+        override.delete()
+        search.update_index()
+        self.assertEqual(search.search('ferry piers'), [])
+        self.assertEqual(len(search.search('public housing')), 1)
+
+    def test_chinese(self):
+        question = ParsedQuestion.objects.get(number=1)
+        question.body_c = u'<p>政府會否興建更多公共房屋？</p>'
+        question.save()
+        search.update_index()
+        self.assertEqual(SearchEntry.objects.get(language=LANG_CN).tokens,
+                         u'政府 府會 會否 否興 興建 建更 更多 多公 公共 共房 房屋 政 府 會 否 興 建 更 多 公 共 房 屋')
+        for query in [u'公共房屋', u'房屋', u'興建  房屋', u'屋', u'建 屋']:
+            results = search.search(query)
+            self.assertEqual([xx.source_uid for xx in results], ['cmeeting-20140101-q1'])
+        self.assertIn(u'<mark>公共房屋</mark>', search.highlight(search.search(u'公共房屋')[0].snippet))
+        # The bigrams of a run of characters have to be next to each other
+        self.assertEqual(search.search(u'公共政府'), [])
+        self.assertEqual(search.search(u'房屋公共'), [])
+        self.assertEqual(search.search(u'稅'), [])
+
+    def test_chinese_single_character(self):
+        question = ParsedQuestion.objects.get(number=1)
+        question.body_c = u'<p>政府會否檢討薪俸稅的免稅額？</p>'
+        question.save()
+        search.update_index()
+        for query in [u'稅', u'薪俸稅', u'俸']:
+            self.assertEqual([xx.source_uid for xx in search.search(query)], ['cmeeting-20140101-q1'])
+        self.assertIn(u'<mark>稅</mark>', search.highlight(search.search(u'稅')[0].snippet))
+        self.assertEqual(search.search(u'港'), [])
+
+    def test_like_backend(self):
+        search.update_index()
+        query = 'HOSPITAL beds'
+        results = search.LikeSearchBackend().search(SearchEntry.objects.all(), query, None, 10)
+        self.assertEqual([xx.source_uid for xx in results], ['cmeeting-20140101-q2'])
+        self.assertIn(u'<mark>hospital</mark> <mark>beds</mark>',
+                      search.highlight(search.make_snippet(results[0].text, query.split())))
+
+    def test_view(self):
+        search.update_index()
+        res = self.client.get('/search/', {'q': 'hospital'})
+        self.assertContains(res, '<mark>hospital</mark>')
+        self.assertContains(res, '/parsed/parsedquestion/cmeeting-20140101-q2')
+
+
+class BigramTokenizerTestCase(TestCase):
+    def setUp(self):
+        self.tokenizer = BigramTokenizer()
+
+    def test_tokenize(self):
+        self.assertEqual(self.tokenizer.tokenize(u'The Hon CHAN Tai-man 陳大文議員, 2014年'),
+                         [u'the', u'hon', u'chan', u'tai', u'man', u'陳大', u'大文', u'文議', u'議員', u'2014', u'年',
+                          u'陳', u'大', u'文', u'議', u'員'])
+
+    def test_tokenize_query(self):
+        self.assertEqual(self.tokenizer.tokenize_query(u'房屋 "housing" 樓'), [[u'房屋'], [u'housing'], [u'樓']])
+        self.assertEqual(self.tokenizer.tokenize_query(u'公共房屋'), [[u'公共', u'共房', u'房屋']])
+        self.assertEqual(self.tokenizer.tokenize_query(u' ?! '), [])
+
+
+class HansardSpeechesTestCase(TestCase):
+    def test_get_speeches(self):
+        # Without parsing a document
+        parser = CouncilHansard.__new__(CouncilHansard)
+        parser.language = LANG_CN
+        parser.before_meeting = [(u'主席', u'<p>請秘書響鐘。</p>'), (None, u'(在傳召鐘響後，多位議員進入會議廳)')]
+        parser.urgent_questions = None
+        parser.oral_questions = [(1, u'公共房屋', [(u'陳大文議員', u'<p>問題</p>'), (u'運輸及房屋局局長', u'<p>答覆</p>')])]
+        parser.written_questions = [(2, u'醫院病床', u'<p>ERROR_PARSING_BODY</p>')]
+        parser.bills = []
+        parser.motions = [(None, [(u'主席', u'<p>議案</p>')])]
+        parser.ce_q_and_a = None
+        parser.suspension = [(u'主席', u'<p>休會</p>')]
+        self.assertEqual([xx[:2] for xx in parser.get_speeches()], [
+            (u'會議前', u'主席'), (u'公共房屋', u'陳大文議員'), (u'公共房屋', u'運輸及房屋局局長'), (u'', u'主席'),
+            (u'休會', u'主席')])
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+from datetime import date, datetime
+import gzip
+import logging
+import os
+import re
+import shutil
+from StringIO import StringIO
+import tempfile
+from urlparse import parse_qs
+from django.core.cache import cache, get_cache
+from django.core.urlresolvers import reverse
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+from django.utils.timezone import utc
+from raw.models import (ParsedCommittee, ParsedCommitteeMembership, ParsedCouncilMeeting, ParsedMembership,
+                        ParsedPerson, ParsedQuestion, ParsedSpeech, RawCouncilHansard, RawCouncilQuestion, RawMember,
+                        GENDER_M, LANG_CN, LANG_EN, bump_members_generation)
+from raw.views import RawCouncilHansardDetailView
+
+
+logging.disable(logging.CRITICAL)
+
+
+class ParsedModelDetailViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.person = ParsedPerson.objects.create(uid='member-1', name_e='CHAN Tai-man', name_c=u'陳大文',
+                                                  gender=GENDER_M)
+        self.committee = ParsedCommittee.objects.create(uid='committee-1', name_e='Finance Committee')
+        self.url = reverse('parsed_model_detail', kwargs={'model': 'parsedperson', 'uid': 'member-1'})
+
+    def add_relations(self, start, end):
+        for xx in range(start, end):
+            meeting = ParsedCouncilMeeting.objects.create(uid='cmeeting-{}'.format(xx),
+                                                          start_date=datetime(2014, 1, 1, 11, tzinfo=utc))
+            ParsedQuestion.objects.create(uid='cmeeting-{}-q1'.format(xx), meeting=meeting, number=1,
+                                          asker=self.person, question_type=ParsedQuestion.ORAL)
+            ParsedMembership.objects.create(uid='membership-{}'.format(xx), person=self.person,
+                                            start_date=datetime(2012, 10, 1, tzinfo=utc))
+            ParsedCommitteeMembership.objects.create(uid='cmembership-{}'.format(xx), person=self.person,
+                                                     committee=self.committee,
+                                                     start_date=datetime(2012, 10, 1, tzinfo=utc))
+            ParsedSpeech.objects.create(uid='council_hansard-20140101-e-{}'.format(xx), meeting=meeting,
+                                        hansard_uid='council_hansard-20140101-e', date=date(2014, 1, 1), order=xx,
+                                        speaker=self.person, speaker_name='MR CHAN TAI-MAN', language=LANG_EN)
+
+    def test_query_budget(self):
+        # The person and its overrides, then a count, a page and the overrides for each of the 4 relations.
+        # Each lookup of the overrides checks the generation too
+        budget = 3 + 4 * 4
+        self.add_relations(0, 5)
+        with self.assertNumQueries(budget):
+            res = self.client.get(self.url)
+        self.assertEqual(len(res.context['relations'][0]['objects']), 5)
+        self.add_relations(5, 200)
+        cache.clear()
+        with self.assertNumQueries(budget):
+            res = self.client.get(self.url)
+        self.assertContains(res, 'Page 1 of 4')
+
+    def test_relation_pages(self):
+        self.add_relations(0, 60)
+        relations = self.client.get(self.url, {'questions_page': 2}).context['relations']
+        questions = [xx for xx in relations if xx['page_kwarg'] == 'questions_page'][0]
+        self.assertEqual(questions['page'].number, 2)
+        self.assertEqual(len(questions['objects']), 10)
+        # Out of range pages fall back to the first page
+        relations = self.client.get(self.url, {'questions_page': 'x'}).context['relations']
+        self.assertEqual(relations[0]['page'].number, 1)
+
+    def test_relation_page_links_keep_the_other_pages(self):
+        self.add_relations(0, 60)
+        res = self.client.get(self.url, {'questions_page': 2, 'speeches_page': 1})
+        links = [parse_qs(xx.replace('&amp;', '&')) for xx in re.findall(r'href="\?([^"]*)"', res.content)]
+        self.assertIn({'questions_page': ['1'], 'speeches_page': ['1']}, links)
+        self.assertIn({'questions_page': ['2'], 'speeches_page': ['2']}, links)
+        self.assertIn({'questions_page': ['2'], 'speeches_page': ['1'], 'memberships_page': ['2']}, links)
+
+
+class CountingHansardView(RawCouncilHansardDetailView):
+    # Skips converting and parsing the document, and counts the pages rendered
+    rendered = 0
+
+    def get_context_data(self, **kwargs):
+        CountingHansardView.rendered += 1
+        return {'object': self.object, 'parser': None}
+
+
+class CachedPageTestCase(TestCase):
+    def setUp(self):
+        get_cache('raw_pages').clear()
+        CountingHansardView.rendered = 0
+        self.hansard = RawCouncilHansard.objects.create(uid='council_hansard-20140101-e',
+                                                        last_parsed=datetime(2014, 1, 1, tzinfo=utc))
+        self.factory = RequestFactory()
+
+    def get(self):
+        request = self.factory.get(reverse('raw_hansard', kwargs={'pk': self.hansard.pk}))
+        return CountingHansardView.as_view()(request, pk=self.hansard.pk)
+
+    def test_repeat_views_are_cached(self):
+        first = self.get()
+        first.render()
+        second = self.get()
+        self.assertEqual(CountingHansardView.rendered, 1)
+        self.assertEqual(second.content, first.content)
+
+    def test_reimport_invalidates(self):
+        self.get().render()
+        RawCouncilHansard.objects.filter(pk=self.hansard.pk).update(last_parsed=datetime(2014, 2, 1, tzinfo=utc))
+        self.get().render()
+        self.assertEqual(CountingHansardView.rendered, 2)
+
+    def test_member_change_invalidates(self):
+        self.get().render()
+        bump_members_generation()
+        self.get().render()
+        self.assertEqual(CountingHansardView.rendered, 2)
+
+    def test_cache_hit_queries(self):
+        self.get().render()
+        view = CountingHansardView(request=self.factory.get(reverse('raw_hansard', kwargs={'pk': self.hansard.pk})))
+        view.object = self.hansard
+        with self.assertNumQueries(0):
+            view.get_page_cache_key()
+        # Loading the hansard is the only query
+        with self.assertNumQueries(1):
+            self.get()
+        self.assertEqual(CountingHansardView.rendered, 1)
+
+
+class SourceFileViewTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(SCRAPY_FILES_PATH=self.tmp_dir)
+        self.settings_override.enable()
+        self.source = u'<html><body>{}</body></html>'.format(u'質詢' * 1000).encode('hkscs')
+        with open(os.path.join(self.tmp_dir, 'question.htm'), 'wb') as f:
+            f.write(self.source)
+        self.question = RawCouncilQuestion.objects.create(uid='question-20140101-1-c', language=LANG_CN,
+                                                          local_filename='question.htm')
+        self.url = reverse('raw_question_source_uid', kwargs={'slug': self.question.uid})
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_streams_the_file(self):
+        res = self.client.get(self.url)
+        self.assertTrue(res.streaming)
+        self.assertEqual(''.join(res.streaming_content), self.source)
+        self.assertEqual(res['Content-Type'], 'text/html; charset=big5-hkscs')
+        self.assertTrue(res.has_header('ETag'))
+        self.assertTrue(res.has_header('Last-Modified'))
+
+    def test_not_modified(self):
+        res = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=res['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=res['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_gzip(self):
+        res = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        content = gzip.GzipFile(fileobj=StringIO(''.join(res.streaming_content))).read()
+        self.assertEqual(content, self.source)
+
+    def test_missing_file(self):
+        os.remove(os.path.join(self.tmp_dir, 'question.htm'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class KeysetListTestCase(TestCase):
+    def setUp(self):
+        asker = RawMember.objects.create(uid='member-1', name_e='CHAN Tai-man', gender=GENDER_M)
+        for xx in range(250):
+            RawCouncilQuestion.objects.create(uid='question-2014{:04d}-1-e'.format(xx), language=LANG_EN,
+                                              subject='Question {}'.format(xx), asker=asker)
+        self.url = reverse('raw_question_list')
+
+    def uids(self, res):
+        return [xx.uid for xx in res.context['object_list']]
+
+    def test_pages(self):
+        first = self.client.get(self.url)
+        self.assertEqual(self.uids(first)[0], 'question-20140249-1-e')
+        self.assertFalse(first.context['page_obj'].has_previous())
+        second = self.client.get(self.url, {'after': first.context['page_obj'].next_cursor()})
+        self.assertEqual(self.uids(second)[0], 'question-20140149-1-e')
+        last = self.client.get(self.url, {'after': second.context['page_obj'].next_cursor()})
+        self.assertEqual(len(self.uids(last)), 50)
+        self.assertFalse(last.context['page_obj'].has_next())
+        back = self.client.get(self.url, {'before': last.context['page_obj'].previous_cursor()})
+        self.assertEqual(self.uids(back), self.uids(second))
+        self.assertTrue(back.context['page_obj'].has_previous())
+
+    def test_query_count(self):
+        # A single query for the page, with the asker joined in, however deep the page is
+        with self.assertNumQueries(1):
+            res = self.client.get(self.url, {'after': u'question-20140100-1-e~100'})
+        self.assertContains(res, 'CHAN Tai-man')
+
+    def test_ascending(self):
+        for xx in range(2, 30):
+            RawMember.objects.create(uid='member-{:02d}'.format(xx), name_e='Member {}'.format(xx), gender=GENDER_M)
+        url = reverse('raw_member_list')
+        first = self.client.get(url)
+        self.assertEqual(self.uids(first)[:2], ['member-02', 'member-03'])
+        second = self.client.get(url, {'after': first.context['page_obj'].next_cursor()})
+        self.assertEqual(self.uids(second), ['member-26', 'member-27', 'member-28', 'member-29'])
+        back = self.client.get(url, {'before': second.context['page_obj'].previous_cursor()})
+        self.assertEqual(self.uids(back), self.uids(first))
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(self.url, {'after': 'question'}).status_code, 404)
+
+
+class RawMemberDetailViewTestCase(TestCase):
+    def setUp(self):
+        self.member = RawMember.objects.create(uid='member-1', name_e='CHAN Tai-man', gender=GENDER_M)
+        # Dates that sort differently as text
+        for xx, raw_date in enumerate(['10.1.2014', '9.1.2014', '1.12.2013'] * 50):
+            RawCouncilQuestion.objects.create(uid='question-{}-e'.format(xx), raw_date=raw_date, language=LANG_EN,
+                                              asker=self.member)
+        self.url = reverse('raw_member', kwargs={'pk': self.member.pk})
+
+    def test_questions_are_ordered_and_paginated(self):
+        res = self.client.get(self.url)
+        questions = list(res.context['questions'])
+        self.assertEqual(len(questions), 100)
+        self.assertEqual(questions[0].date, date(2013, 12, 1))
+        self.assertEqual(questions[-1].date, date(2014, 1, 9))
+        res = self.client.get(self.url, {'page': 2})
+        self.assertEqual(list(res.context['questions'])[-1].date, date(2014, 1, 10))
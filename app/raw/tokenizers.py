@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Tokenizers for the search index, see raw.search
+
+Chinese is written without spaces between words, so a run of Chinese characters is split into
+its overlapping pairs of characters (bigrams): 公共房屋 is indexed as 公共 共房 房屋, and a query for
+房屋 matches it without having to know where the words are.  A query for a longer run of characters
+has to match all of its bigrams next to each other, in the same order.  The single characters of the
+runs are indexed too, after all of the bigrams so they don't come between them, because a query for
+one character such as 稅 has no bigrams to match 薪俸稅 by.  Other text is split into lowercase words.
+
+The entries store their tokens, separated by spaces, and the database indexes those rather than the text.
+Set SEARCH_TOKENIZER to the dotted path of another class with the same methods to change how text
+is split, then rebuild the index with update_search_index --rebuild
+"""
+import re
+from django.conf import settings
+from django.utils.module_loading import import_by_path
+
+
+# CJK Unified Ideographs and extension A, CJK Compatibility Ideographs, and Japanese kana
+CJK_RANGES = u'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+TOKEN_RE = re.compile(u'([{cjk}]+)|([^\\W_{cjk}]+)'.format(cjk=CJK_RANGES), re.UNICODE)
+DEFAULT_TOKENIZER = 'raw.tokenizers.BigramTokenizer'
+
+
+class BigramTokenizer(object):
+    def tokenize(self, text):
+        """
+        Returns the list of tokens of some text, in order, followed by the single characters of its runs
+        of Chinese characters that were split into bigrams
+        """
+        tokens = []
+        characters = []
+        for match in TOKEN_RE.finditer(text or u''):
+            tokens.extend(self.split(match))
+            cjk = match.group(1)
+            if cjk is not None and len(cjk) > 1:
+                characters.extend(cjk)
+        return tokens + characters
+
+    def tokenize_query(self, query):
+        """
+        Returns the list of the phrases in a query, each a list of tokens that have to be next to each other
+        """
+        return [self.split(match) for match in TOKEN_RE.finditer(query or u'')]
+
+    def split(self, match):
+        # The tokens of a match of TOKEN_RE: the bigrams of a run of Chinese characters, or a word
+        cjk, word = match.groups()
+        if cjk is None:
+            return [word.lower()]
+        if len(cjk) == 1:
+            return [cjk]
+        return [cjk[i:i + 2] for i in range(len(cjk) - 1)]
+
+
+def get_tokenizer():
+    return import_by_path(getattr(settings, 'SEARCH_TOKENIZER', DEFAULT_TOKENIZER))()
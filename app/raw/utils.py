@@ -3,6 +3,8 @@ Some utilities for working with spiders
 """
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from datetime import datetime
 from itertools import izip_longest
 from scrapy.crawler import Crawler
 from scrapy.utils.project import get_project_settings
@@ -97,6 +99,44 @@ def docx_to_html(filepath, overwrite=False):
     return res
 
 
+def html_source_file(filepath):
+    """
+    Returns the path of an html version of a document, for serving it from disk.  doc and docx files are
+    converted the first time, and the conversion is kept next to them as doc_to_html and docx_to_html do
+
+    :param filepath: full path to the document
+    :return: full path to an html file, or None if the document can't be converted
+    """
+    filetype = check_file_type(filepath)
+    if filetype == HTML:
+        return filepath
+    if filetype not in (DOC, DOCX):
+        return None
+    html_file = '{}.html'.format(filepath)
+    if not os.path.exists(html_file):
+        convert = doc_to_html if filetype == DOC else docx_to_html
+        if convert(filepath) is None:
+            return None
+    return html_file
+
+
+def parse_since(value):
+    """
+    Parses a YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS date, e.g. from a --since option, in the default timezone
+    """
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            res = datetime.strptime(value, fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        raise ValueError(u'{} is not YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS'.format(value))
+    if settings.USE_TZ:
+        res = timezone.make_aware(res, timezone.get_default_timezone())
+    return res
+
+
 def get_file_path(rel_path):
     """
     Given a relative path for a file downloaded by scrapy, get the absolute path
@@ -137,6 +177,17 @@ def grouper(iterable, n, fillvalue=None):
     args = [iter(iterable)] * n
     return izip_longest(fillvalue=fillvalue, *args)
 
+def html_to_text(html):
+    """
+    The text of some html, with the whitespace collapsed
+    """
+    if not html:
+        return u''
+    if u'<' in html:
+        html = lxml.html.fromstring(html).text_content()
+    return u' '.join(html.split())
+
+
 def utf2html(ustring):
     ustring = ustring.replace('\r\n','<br><br />')
     ustring = ustring.replace('\n','<br><br />')
@@ -1,28 +1,201 @@
 import inspect
 import json
-from django.db.models import get_model
+import os
+from django.core.servers.basehttp import FileWrapper
+from django.core.cache import get_cache
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.core.urlresolvers import reverse
+from django.db.models import get_model, Q
 from django.forms import ModelForm
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import redirect
-from django.views.generic import ListView, DetailView, FormView, TemplateView
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
+from django.views.generic import ListView, DetailView, FormView, TemplateView, View
 from django.views.generic.detail import BaseDetailView
 from django.views.generic.edit import FormMixin
-from raw import models
+from django.views.decorators.gzip import gzip_page
+from django.views.static import was_modified_since
+from raw import export, models, search
 from raw.forms import OverrideForm
-from raw.models import RawCouncilAgenda, RawCouncilHansard, RawMember, RawCommittee, RawCouncilQuestion, Override
+from raw.models import (RawCouncilAgenda, RawCouncilHansard, RawMember, RawCommittee, RawCouncilQuestion, Override,
+                        members_generation)
 from raw.names import NameMatcher, MemberName
 from raw.models.constants import LANG_EN, LANG_CN
+from raw.docs import agenda, hansard, question
+from raw.utils import parse_since
+
+
+class KeysetPage(object):
+    """
+    A page of a KeysetListMixin list.  Links to the neighbouring pages use the cursors of the
+    first and last objects, instead of page numbers
+    """
+    def __init__(self, object_list, has_previous, has_next):
+        self.object_list = object_list
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def has_previous(self):
+        return self._has_previous and len(self.object_list) > 0
+
+    def has_next(self):
+        return self._has_next and len(self.object_list) > 0
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def previous_cursor(self):
+        return KeysetListMixin.make_cursor(self.object_list[0])
+
+    def next_cursor(self):
+        return KeysetListMixin.make_cursor(self.object_list[-1])
+
+
+class KeysetListMixin(object):
+    """
+    Paginates a ListView by uid instead of by offset, so every page is a range scan on the uid index
+    and deep pages are as fast as the first.  ?after=<cursor> is the page after an object,
+    ?before=<cursor> the page before it.  The cursor is the uid and the pk, because uids aren't unique
+
+    list_fields are the columns the template shows, the rest aren't loaded
+    """
+    ordering = '-uid'
+    list_fields = None
+
+    def get_queryset(self):
+        qs = super(KeysetListMixin, self).get_queryset()
+        if self.list_fields is not None:
+            qs = qs.only(*self.list_fields)
+        return qs
+
+    @staticmethod
+    def make_cursor(obj):
+        return u'{}~{}'.format(obj.uid, obj.pk)
+
+    def parse_cursor(self, cursor):
+        try:
+            uid, pk = cursor.rsplit(u'~', 1)
+            return uid, int(pk)
+        except ValueError:
+            raise Http404(u'Invalid cursor {}'.format(cursor))
+
+    def paginate_queryset(self, queryset, page_size):
+        descending = self.ordering.startswith('-')
+        forward = ['-uid', '-pk'] if descending else ['uid', 'pk']
+        backward = ['uid', 'pk'] if descending else ['-uid', '-pk']
+        after = self.request.GET.get('after')
+        before = self.request.GET.get('before')
+        if before:
+            uid, pk = self.parse_cursor(before)
+            if descending:
+                queryset = queryset.filter(Q(uid__gt=uid) | Q(uid=uid, pk__gt=pk))
+            else:
+                queryset = queryset.filter(Q(uid__lt=uid) | Q(uid=uid, pk__lt=pk))
+            objs = list(queryset.order_by(*backward)[:page_size + 1])
+            page = KeysetPage(objs[:page_size][::-1], len(objs) > page_size, True)
+        else:
+            if after:
+                uid, pk = self.parse_cursor(after)
+                if descending:
+                    queryset = queryset.filter(Q(uid__lt=uid) | Q(uid=uid, pk__lt=pk))
+                else:
+                    queryset = queryset.filter(Q(uid__gt=uid) | Q(uid=uid, pk__gt=pk))
+            objs = list(queryset.order_by(*forward)[:page_size + 1])
+            page = KeysetPage(objs[:page_size], bool(after), len(objs) > page_size)
+        return None, page, page.object_list, page.has_other_pages()
+
+
+class CachedPageMixin(object):
+    """
+    Serves the rendered detail page of a raw document from the 'raw_pages' cache, because converting
+    and parsing the document takes seconds.
+
+    Pages are keyed by the object's uid and last_parsed, the version of its parser, the generation of
+    the members its names are matched against and the path, so a re-import or a new parser version gets a new key
+    and the old page is never served again.  Apart from loading the object, a cache hit makes no queries
+    """
+    page_cache_alias = 'raw_pages'
+    # PARSER_VERSION of the module in raw.docs that parses the documents.  The parsers don't change the
+    # documents' last_parsed, so a parser module bumps its PARSER_VERSION whenever its output changes,
+    # otherwise the pages rendered by the old parser would still be served from the cache
+    parser_version = None
+
+    def get_page_cache_key(self):
+        # The page links back to its own path, which could have the pk or the uid
+        parts = [self.model._meta.model_name, self.object.uid, self.object.last_parsed, self.parser_version,
+                 members_generation(), self.request.path]
+        return u'raw-page:' + u':'.join([xx.strftime('%Y%m%d%H%M%S%f') if hasattr(xx, 'strftime') else unicode(xx)
+                                         for xx in parts])
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        page_cache = get_cache(self.page_cache_alias)
+        key = self.get_page_cache_key()
+        content = page_cache.get(key)
+        if content is not None:
+            return HttpResponse(content)
+        response = self.render_to_response(self.get_context_data(object=self.object))
+        response.render()
+        page_cache.set(key, response.content)
+        return response
+
+
+class SourceFileView(BaseDetailView):
+    """
+    Streams the html source of a raw document from disk, in chunks, rather than reading it into memory.
+
+    The ETag and Last-Modified come from the file's size and mtime, so browsers can revalidate
+    without the file being read, and get a 304 if it hasn't changed.  Responses are gzipped
+    for the clients that accept it
+    """
+    slug_field = 'uid'
+    charset = 'utf-8'
+    chunk_size = 64 * 1024
+
+    @method_decorator(gzip_page)
+    def dispatch(self, request, *args, **kwargs):
+        return super(SourceFileView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        try:
+            path = self.object.get_source_file()
+        except RuntimeError:
+            # The file has not been downloaded
+            path = None
+        if path is None:
+            raise Http404(u'No source for {}'.format(self.object.uid))
+        stat = os.stat(path)
+        etag = u'"{:x}-{:x}"'.format(int(stat.st_mtime), stat.st_size)
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            not_modified = etag in [xx.strip() for xx in if_none_match.split(',')] or if_none_match.strip() == '*'
+        else:
+            not_modified = not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                                                  stat.st_mtime, stat.st_size)
+        if not_modified:
+            response = HttpResponseNotModified()
+        else:
+            response = StreamingHttpResponse(FileWrapper(open(path, 'rb'), self.chunk_size),
+                                             content_type='text/html; charset={}'.format(self.charset))
+            response['Content-Length'] = stat.st_size
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        return response
 
 #RawCouncilAgenda
-class RawCouncilAgendaListView(ListView):
+class RawCouncilAgendaListView(KeysetListMixin, ListView):
     model = RawCouncilAgenda
     template_name = 'raw/agenda_list.html'
+    list_fields = ['uid']
     paginate_by = 25
 
-class RawCouncilAgendaDetailView(DetailView):
+class RawCouncilAgendaDetailView(CachedPageMixin, DetailView):
     model = RawCouncilAgenda
     slug_field = 'uid'
     template_name = 'raw/agenda_detail.html'
+    parser_version = agenda.PARSER_VERSION
 
     def get_context_data(self, **kwargs):
         context = super(RawCouncilAgendaDetailView, self).get_context_data(**kwargs)
@@ -45,24 +218,21 @@ class RawCouncilAgendaDetailView(DetailView):
         context['questions'] = questions
         return context
 
-class RawCouncilAgendaSourceView(BaseDetailView):
-    model = RawCouncilHansard
-    slug_field = 'uid'
-
-    def get(self, request, *args, **kwargs):
-        self.object = self.get_object()
-        return HttpResponse(self.object.get_source())
+class RawCouncilAgendaSourceView(SourceFileView):
+    model = RawCouncilAgenda
 
 ##RawcouncilHansard
-class RawCouncilHansardListView(ListView):
+class RawCouncilHansardListView(KeysetListMixin, ListView):
     model = RawCouncilHansard
     template_name = 'raw/hansard_list.html'
+    list_fields = ['uid']
     paginate_by = 25
 
-class RawCouncilHansardDetailView(DetailView):
+class RawCouncilHansardDetailView(CachedPageMixin, DetailView):
     model = RawCouncilHansard
     slug_field = 'uid'
     template_name = 'raw/hansard_detail.html'
+    parser_version = hansard.PARSER_VERSION
 
     def get_context_data(self, **kwargs):
         context = super(RawCouncilHansardDetailView, self).get_context_data(**kwargs)
@@ -81,24 +251,22 @@ class RawCouncilHansardDetailView(DetailView):
                     context['president']=obj
         return context
     
-class RawCouncilHansardSourceView(BaseDetailView):
+class RawCouncilHansardSourceView(SourceFileView):
     model = RawCouncilHansard
-    slug_field = 'uid'
-
-    def get(self, request, *args, **kwargs):
-        self.object = self.get_object()
-        return HttpResponse(self.object.get_source())
 
 ##RawMember
-class RawMemberListView(ListView):
+class RawMemberListView(KeysetListMixin, ListView):
     model = RawMember
     template_name = 'raw/member_list.html'
+    ordering = 'uid'
+    list_fields = ['uid', 'name_e', 'name_c', 'photo_file']
     paginate_by = 25
 
 class RawMemberDetailView(DetailView):
     model = RawMember
     slug_field = 'uid'
     template_name = 'raw/member_detail.html'
+    questions_paginate_by = 100
 
     def get_context_data(self, **kwargs):
         context = super(RawMemberDetailView, self).get_context_data(**kwargs)
@@ -108,15 +276,22 @@ class RawMemberDetailView(DetailView):
             res = {'label': f, 'value': getattr(self.object, f, '')}
             context['fields'].append(res)
 
-        questions = self.object.raw_questions.filter(language=models.LANG_EN)
-        questions_with_dates = sorted([(xx, xx.date) for xx in questions], key=lambda x: x[1])
-        context['questions'] = [xx for xx, dd in questions_with_dates]
+        questions = self.object.raw_questions.filter(language=models.LANG_EN).order_by('date', 'uid')
+        paginator = Paginator(questions.only('uid', 'date', 'subject', 'subject_link'), self.questions_paginate_by)
+        try:
+            page = paginator.page(self.request.GET.get('page', 1))
+        except (PageNotAnInteger, EmptyPage):
+            page = paginator.page(1)
+        context['questions'] = page.object_list
+        context['questions_page'] = page
         return context
 
 #RawCommittee
-class RawCommitteeListView(ListView):
+class RawCommitteeListView(KeysetListMixin, ListView):
     model = RawCommittee
     template_name = 'raw/committee_list.html'
+    ordering = 'uid'
+    list_fields = ['uid', 'code', 'name_e']
     paginate_by = 25
 
 class RawCommitteeDetailView(DetailView):
@@ -126,15 +301,20 @@ class RawCommitteeDetailView(DetailView):
 
 
 #RawCouncilQuestion
-class RawCouncilQuestionListView(ListView):
+class RawCouncilQuestionListView(KeysetListMixin, ListView):
     model = RawCouncilQuestion
     template_name = 'raw/council_question_list.html'
     paginate_by = 100
+    list_fields = ['uid', 'subject', 'raw_asker', 'asker', 'asker__name_e']
+
+    def get_queryset(self):
+        return super(RawCouncilQuestionListView, self).get_queryset().select_related('asker')
     
-class RawCouncilQuestionDetailView(DetailView):
+class RawCouncilQuestionDetailView(CachedPageMixin, DetailView):
     model = RawCouncilQuestion
     slug_field = 'uid'
     template_name = 'raw/council_question_detail.html'
+    parser_version = question.PARSER_VERSION
     
     def get_context_data(self, **kwargs):
         context = super(RawCouncilQuestionDetailView, self).get_context_data(**kwargs)
@@ -151,13 +331,10 @@ class RawCouncilQuestionDetailView(DetailView):
                 context['name']=match
         return context
 
-class RawCouncilQuestionSourceView(BaseDetailView):
+class RawCouncilQuestionSourceView(SourceFileView):
     model = RawCouncilQuestion
-    slug_field = 'uid'
-
-    def get(self, request, *args, **kwargs):
-        self.object = self.get_object()
-        return HttpResponse(self.object.get_source().decode('hkscs',errors='ignore'))
+    # Served as it is, the browser decodes it
+    charset = 'big5-hkscs'
 """
 #######################################
 ###########Parsed model view###########
@@ -195,6 +372,7 @@ class ParsedModelInstanceList(ListView):
 
     def get_context_data(self, **kwargs):
         context = super(ParsedModelInstanceList, self).get_context_data(**kwargs)
+        context['object_list'] = Override.objects.apply(context['object_list'], self.get_model())
         context['model'] = self.get_model()
         context['model_name'] = context['model']._meta.verbose_name.capitalize()
         context['path'] = self.kwargs['model']
@@ -210,30 +388,20 @@ class ParsedModelInstanceList(ListView):
         if len(ids_to_deactivate) > 0:
             # Get the models that we want to deactivate.  ORM will coerce to ints for us
             mdl = self.get_model()
-            instances_to_deactivate = mdl.objects.filter(id__in=ids_to_deactivate)
-            deactivate = {'deactivate': True}
-            for instance in instances_to_deactivate:
-                override = Override.objects.get_or_create_from_reference(instance)
-                override.merge_payload(deactivate)
-                override.save()
+            Override.objects.set_deactivated(list(mdl.objects.filter(id__in=ids_to_deactivate).only('id', 'uid')))
 
         if len(ids_to_reactivate) > 0:
             # Re-activate any existing overrides
             mdl = self.get_model()
-            instances_to_reactivate = mdl.objects.filter(id__in=ids_to_reactivate)
-            reactivate = {'deactivate': False}
-            for instance in instances_to_reactivate:
-                override = Override.objects.get_from_reference(instance)
-                if override is None:
-                    continue
-                override.merge_payload(reactivate)
-                override.save()
+            Override.objects.set_deactivated(list(mdl.objects.filter(id__in=ids_to_reactivate).only('id', 'uid')), False)
 
         return redirect(request.META['HTTP_REFERER'])
 
 
 class ParsedModelDetailView(TemplateView):
     template_name = 'raw/parsedmodel_detail.html'
+    # Related objects shown per page of each relation
+    relation_paginate_by = 50
 
     def __init__(self, *args, **kwargs):
         super(ParsedModelDetailView, self).__init__(*args, **kwargs)
@@ -242,14 +410,14 @@ class ParsedModelDetailView(TemplateView):
     def get(self, request, *args, **kwargs):
         # Check if an override exists.  If it does, load it and use its data to populate the form
         # Get the form
-        override = self.get_override()
         model_instance = self.get_model_instance()
-        if override is None:
+        payload = Override.objects.get_payloads(self.get_model_class()).get(model_instance.uid)
+        if payload is None:
             # No override exists, show a blank form
             form_kwargs = None
         else:
-            # An override exists, so we load it up and use the data as the initial data
-            form_kwargs = {'initial': json.loads(override.data)}
+            # An override exists, so we use its data as the initial data
+            form_kwargs = {'initial': payload}
         form = OverrideForm.from_model(model_instance, form_kwargs)
         return self.render_to_response(self.get_context_data(form=form))
 
@@ -287,7 +455,8 @@ class ParsedModelDetailView(TemplateView):
     def get_model_instance(self):
         # Gets the instance of the model class that we're viewing
         if self._model_instance is None:
-            self._model_instance = self.get_model_class().objects.get(uid=self.kwargs['uid'])
+            # Follow the foreign keys, which are shown as links
+            self._model_instance = self.get_model_class().objects.select_related().get(uid=self.kwargs['uid'])
         return self._model_instance
 
     def get_override(self):
@@ -305,28 +474,30 @@ class ParsedModelDetailView(TemplateView):
             res.append((field.name, getattr(model, field.name), form_field))
         return res
 
+    def get_relation_page(self, relation, queryset):
+        # Gets the requested page of a relation, from ?<accessor name>_page=
+        paginator = Paginator(queryset, self.relation_paginate_by)
+        page_kwarg = u'{}_page'.format(relation.get_accessor_name())
+        try:
+            return paginator.page(self.request.GET.get(page_kwarg, 1))
+        except (PageNotAnInteger, EmptyPage):
+            return paginator.page(1)
+
     def get_relations(self):
-        # Gets related models for display on the detail page
+        # Gets related models for display on the detail page.  Each relation costs a count and a query
+        # for the page of objects, with their own foreign keys joined in because they are shown
+        # in the objects' names, however many objects there are
         model = self.get_model_instance()
         relations = model._meta.get_all_related_objects()
         res = []
         for relation in relations:
             name = relation.get_accessor_name()
-            objs = getattr(model, name)
+            page = self.get_relation_page(relation, getattr(model, name).select_related().order_by('pk'))
             # We also need to find out which instances of this relation are already deactivated
-            # So we get the uids, get all the overrides for them, and then deserialize the payload to check
-            uids = [xx.uid for xx in objs.all()]
-            overrides = {xx.ref_uid: xx for xx in Override.objects.filter(ref_uid__in=uids)}
-            objects = []
-            for obj in objs.all():
-                uid = obj.uid
-                override = overrides.get(uid, None)
-                if override is not None:
-                    is_deactivated = override.get_payload().get('deactivate', False)
-                else:
-                    is_deactivated = False
-                objects.append((obj, is_deactivated))
-            res.append({'name': name.capitalize(), 'model_name': relation.var_name, 'objects': objects})
+            payloads = Override.objects.get_payloads(relation.model)
+            objects = [(obj, payloads.get(obj.uid, {}).get('deactivate', False)) for obj in page.object_list]
+            res.append({'name': name.capitalize(), 'model_name': relation.var_name, 'objects': objects,
+                        'page': page, 'page_kwarg': u'{}_page'.format(name)})
         return res
 
     def get_context_data(self, **kwargs):
@@ -336,3 +507,52 @@ class ParsedModelDetailView(TemplateView):
         # Get any related child models, and set those up to be displayed
         context['relations'] = self.get_relations()
         return context
+
+
+class ParsedExportView(View):
+    """
+    Streams the export of a parsed model as CSV or JSON lines, see raw.export.  ?since=YYYY-MM-DD only
+    exports the objects that changed since then.  Gzipped for the clients that accept it
+    """
+    @method_decorator(gzip_page)
+    def dispatch(self, request, *args, **kwargs):
+        return super(ParsedExportView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request, name, fmt):
+        model = export.EXPORT_MODELS.get(name)
+        if model is None:
+            raise Http404(u'No export of {}'.format(name))
+        try:
+            since = parse_since(request.GET['since']) if request.GET.get('since') else None
+        except ValueError as e:
+            return HttpResponseBadRequest(unicode(e))
+        response = StreamingHttpResponse(export.export_lines(model, fmt, since),
+                                         content_type=export.CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(name, fmt)
+        return response
+
+
+class SearchView(TemplateView):
+    """
+    Searches the hansard speeches and the parsed questions and replies, see raw.search
+    """
+    template_name = 'raw/search.html'
+    limit = 50
+
+    def get_context_data(self, **kwargs):
+        context = super(SearchView, self).get_context_data(**kwargs)
+        query = self.request.GET.get('q', u'').strip()
+        kind = self.request.GET.get('kind', u'')
+        kind = int(kind) if kind.isdigit() else None
+        results = search.search(query, kind=kind, limit=self.limit) if query else []
+        for entry in results:
+            entry.highlighted = search.highlight(entry.snippet)
+            if entry.kind == models.SearchEntry.SPEECH:
+                entry.url = reverse('raw_hansard_uid', kwargs={'slug': entry.source_uid})
+            else:
+                entry.url = reverse('parsed_model_detail', kwargs={'model': 'parsedquestion', 'uid': entry.source_uid})
+        context['query'] = query
+        context['kind'] = kind
+        context['kinds'] = models.SearchEntry.KIND_CHOICES
+        context['results'] = results
+        return context